@@ -10,20 +10,32 @@ try:
     # 尝试相对导入（ComfyUI 正常加载时）
     from .nodes import NODE_CLASS_MAPPINGS as LLM_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as LLM_NODE_DISPLAY_NAME_MAPPINGS
     from .nodes_openrouter import NODE_CLASS_MAPPINGS as OR_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as OR_NODE_DISPLAY_NAME_MAPPINGS
+    from .nodes_async import NODE_CLASS_MAPPINGS as ASYNC_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as ASYNC_NODE_DISPLAY_NAME_MAPPINGS
+    from .nodes_tools import NODE_CLASS_MAPPINGS as TOOLS_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as TOOLS_NODE_DISPLAY_NAME_MAPPINGS
+    from .nodes_batch import NODE_CLASS_MAPPINGS as BATCH_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as BATCH_NODE_DISPLAY_NAME_MAPPINGS
 except ImportError:
     # 回退到绝对导入（测试时）
     from nodes import NODE_CLASS_MAPPINGS as LLM_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as LLM_NODE_DISPLAY_NAME_MAPPINGS
     from nodes_openrouter import NODE_CLASS_MAPPINGS as OR_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as OR_NODE_DISPLAY_NAME_MAPPINGS
+    from nodes_async import NODE_CLASS_MAPPINGS as ASYNC_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as ASYNC_NODE_DISPLAY_NAME_MAPPINGS
+    from nodes_tools import NODE_CLASS_MAPPINGS as TOOLS_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as TOOLS_NODE_DISPLAY_NAME_MAPPINGS
+    from nodes_batch import NODE_CLASS_MAPPINGS as BATCH_NODE_CLASS_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as BATCH_NODE_DISPLAY_NAME_MAPPINGS
 
-# 合并两组节点
+# 合并各组节点
 NODE_CLASS_MAPPINGS = {
     **LLM_NODE_CLASS_MAPPINGS,
     **OR_NODE_CLASS_MAPPINGS,
+    **ASYNC_NODE_CLASS_MAPPINGS,
+    **TOOLS_NODE_CLASS_MAPPINGS,
+    **BATCH_NODE_CLASS_MAPPINGS,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     **LLM_NODE_DISPLAY_NAME_MAPPINGS,
     **OR_NODE_DISPLAY_NAME_MAPPINGS,
+    **ASYNC_NODE_DISPLAY_NAME_MAPPINGS,
+    **TOOLS_NODE_DISPLAY_NAME_MAPPINGS,
+    **BATCH_NODE_DISPLAY_NAME_MAPPINGS,
 }
 
 __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
@@ -31,3 +43,6 @@ __all__ = ['NODE_CLASS_MAPPINGS', 'NODE_DISPLAY_NAME_MAPPINGS']
 print("\033[92m[ComfyUI-Gemini v4.0.0]\033[0m \033[93mLoaded (LiteLLM + OpenRouter).\033[0m")
 print("  - \033[96mLiteLLM nodes:\033[0m Category 'Gemini-LiteLLM'")
 print("  - \033[96mOpenRouter nodes:\033[0m Category 'Gemini-OpenRouter'")
+print("  - \033[96mAsync nodes:\033[0m Category 'Gemini-Async'")
+print("  - \033[96mTool nodes:\033[0m Category 'Gemini-Tools'")
+print("  - \033[96mBatch nodes:\033[0m Category 'Gemini-Batch'")
@@ -0,0 +1,218 @@
+"""
+ComfyUI Gemini 离线批处理（OpenAI 兼容 Batch API）
+Offline batch mode for large captioning / generation jobs
+
+流程:
+1. 把执行节点构建的请求体写成 batch JSONL（每行 custom_id + method + url + body）
+2. 以 purpose=batch 上传到 /files，再 POST /batches 创建任务
+3. 轮询 GET /batches/{id}（指数退避，遵守 429 Retry-After）
+4. 下载输出 / 错误文件，按 custom_id 分发回每个条目
+
+同一批请求体（按内容哈希）提交过的任务 ID 会缓存到磁盘，重新执行节点时继续轮询而不会重复提交。
+"""
+
+import json
+import os
+import time
+
+try:
+    from .llm_cache import TTLCache, cache_dir, content_hash
+    from .llm_files import multipart_body
+    from .llm_http import send, Timeouts, HTTPStatusError, interruptible_sleep
+    from .llm_usage import record_call
+except ImportError:
+    from llm_cache import TTLCache, cache_dir, content_hash
+    from llm_files import multipart_body
+    from llm_http import send, Timeouts, HTTPStatusError, interruptible_sleep
+    from llm_usage import record_call
+
+
+def _log(msg: str):
+    print(f"[LLM-Batch] {msg}")
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+
+# 任务 ID 缓存时间：略长于 24h 完成窗口
+_JOB_TTL = 26 * 3600
+# 轮询间隔上限（秒）与退避倍数
+_MAX_POLL_INTERVAL = 300
+_POLL_BACKOFF = 1.5
+
+_TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+_jobs = None
+
+
+def _job_cache() -> TTLCache:
+    global _jobs
+    if _jobs is None:
+        _jobs = TTLCache(os.path.join(cache_dir("batch"), "jobs.json"), _JOB_TTL)
+    return _jobs
+
+
+def _auth(api_key: str) -> dict:
+    return {"Authorization": f"Bearer {(api_key or '').strip()}", "User-Agent": "ComfyUI"}
+
+
+def _json_call(method: str, url: str, api_key: str, data: dict = None) -> dict:
+    headers = _auth(api_key)
+    body = None
+    if data is not None:
+        headers["Content-Type"] = "application/json"
+        body = json.dumps(data).encode()
+    _, _, raw = send(method, url, headers, body, Timeouts(idle=120))
+    return json.loads(raw.decode())
+
+
+def _provider(model: str) -> dict:
+    # LiteLLM 需要 provider 前缀才能路由到对应的 Files / Batches API（如 gemini/...）
+    return {"custom_llm_provider": model.split("/", 1)[0]} if "/" in (model or "") else {}
+
+
+def build_jsonl(payloads: list) -> bytes:
+    """请求体列表 → batch JSONL；custom_id 为条目序号"""
+    lines = []
+    for i, payload in enumerate(payloads):
+        lines.append(json.dumps({
+            "custom_id": f"item-{i}",
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": payload,
+        }, ensure_ascii=False))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def submit_batch(base: str, api_key: str, model: str, jsonl: bytes, metadata: dict = None) -> dict:
+    """上传 JSONL 并创建任务，返回 batch 对象"""
+    start = time.time()
+    fields = {"purpose": "batch", **_provider(model)}
+    body, content_type = multipart_body(fields, f"batch-{content_hash(jsonl)[:16]}.jsonl", jsonl,
+                                        "application/jsonl")
+    headers = {**_auth(api_key), "Content-Type": content_type}
+    _, _, raw = send("POST", f"{base}/files", headers, body, Timeouts(idle=300))
+    file_id = json.loads(raw.decode()).get("id")
+    if not file_id:
+        raise Exception(f"Batch file upload returned no id: {raw[:200]!r}")
+    _log(f"Uploaded batch file {file_id} ({len(jsonl)} bytes) in {time.time() - start:.2f}s")
+
+    batch = _json_call("POST", f"{base}/batches", api_key, {
+        "input_file_id": file_id,
+        "endpoint": BATCH_ENDPOINT,
+        "completion_window": COMPLETION_WINDOW,
+        "metadata": metadata or {},
+        **_provider(model),
+    })
+    if not batch.get("id"):
+        raise Exception(f"Batch creation returned no id: {str(batch)[:200]}")
+    _log(f"Created batch {batch['id']} (status: {batch.get('status')})")
+    return batch
+
+
+def poll_batch(base: str, api_key: str, batch_id: str, interval: float = 30, max_wait: float = 0) -> dict:
+    """轮询直到任务结束；max_wait 为 0 表示不限制，超时抛出异常（重新执行可继续轮询）"""
+    start = time.time()
+    wait = max(interval, 1)
+    last_status = None
+    while True:
+        try:
+            batch = _json_call("GET", f"{base}/batches/{batch_id}", api_key)
+        except HTTPStatusError as e:
+            if e.code == 429 or e.code >= 500:
+                retry_after = {k.lower(): v for k, v in e.headers.items()}.get("retry-after")
+                try:
+                    delay = float(retry_after) if retry_after else wait
+                except ValueError:
+                    delay = wait
+                _log(f"Poll HTTP {e.code}, retrying in {delay:.0f}s")
+                interruptible_sleep(delay)
+                wait = min(wait * _POLL_BACKOFF, _MAX_POLL_INTERVAL)
+                continue
+            raise
+        except (TimeoutError, ConnectionError) as e:
+            _log(f"Poll failed ({e}), retrying in {wait:.0f}s")
+        else:
+            status = batch.get("status")
+            counts = batch.get("request_counts") or {}
+            if status != last_status:
+                progress = f" ({counts.get('completed', 0)}/{counts['total']} done)" if counts.get("total") else ""
+                _log(f"Batch {batch_id}: {status}{progress}")
+                last_status = status
+            if status in _TERMINAL:
+                return batch
+
+        elapsed = time.time() - start
+        if max_wait and elapsed + wait > max_wait:
+            raise Exception(f"Batch {batch_id} still {last_status} after {elapsed:.0f}s, run again to resume polling")
+        interruptible_sleep(wait)
+        wait = min(wait * _POLL_BACKOFF, _MAX_POLL_INTERVAL)
+
+
+def _download_lines(base: str, api_key: str, file_id: str) -> list:
+    if not file_id:
+        return []
+    _, _, raw = send("GET", f"{base}/files/{file_id}/content", _auth(api_key), None, Timeouts(idle=300))
+    lines = []
+    for line in raw.decode().splitlines():
+        if line.strip():
+            try:
+                lines.append(json.loads(line))
+            except ValueError:
+                _log(f"Skipping malformed result line: {line[:80]}")
+    return lines
+
+
+def fetch_results(base: str, api_key: str, batch: dict, count: int, workflow: str = "") -> list:
+    """下载输出 / 错误文件，返回按条目顺序排列的 (response, error) 列表"""
+    results = [(None, "no result returned")] * count
+    lines = _download_lines(base, api_key, batch.get("output_file_id"))
+    lines += _download_lines(base, api_key, batch.get("error_file_id"))
+    for line in lines:
+        try:
+            index = int(str(line.get("custom_id", "")).rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            continue
+        if not 0 <= index < count:
+            continue
+        resp = line.get("response") or {}
+        body = resp.get("body") or {}
+        error = line.get("error") or body.get("error")
+        if error or resp.get("status_code", 200) >= 400:
+            msg = error.get("message") if isinstance(error, dict) else str(error or f"HTTP {resp.get('status_code')}")
+            results[index] = (None, msg)
+        else:
+            results[index] = (body, "")
+        record_call(f"{base}/batches", None, body, latency=0.0, workflow=workflow,
+                    error=results[index][1])
+    return results
+
+
+def run_batch(config: dict, payloads: list, poll_interval: float = 30, max_wait: float = 0,
+              batch_id: str = "") -> tuple:
+    """提交（或续接）批处理任务并等待结果，返回 (batch_id, [(response, error), ...])"""
+    base = (config.get("api_base") or "").strip().rstrip("/")
+    api_key = config.get("api_key")
+    model = config.get("model", "")
+    if not payloads:
+        raise Exception("Batch has no items")
+
+    jsonl = build_jsonl(payloads)
+    job_key = f"{base}|{content_hash(jsonl)}"
+    cache = _job_cache()
+    batch_id = (batch_id or "").strip() or cache.get(job_key) or ""
+    if batch_id:
+        _log(f"Resuming batch {batch_id} ({len(payloads)} items)")
+    else:
+        batch = submit_batch(base, api_key, model, jsonl, {"source": "comfyui", "items": str(len(payloads))})
+        batch_id = batch["id"]
+        cache.set(job_key, batch_id)
+
+    batch = poll_batch(base, api_key, batch_id, poll_interval, max_wait)
+    if batch.get("status") != "completed" and not batch.get("output_file_id"):
+        # 失败 / 过期的任务不再续接，下次执行重新提交
+        cache.set(job_key, None, ttl=1)
+        errors = (batch.get("errors") or {}).get("data") or []
+        detail = f": {errors[0].get('message')}" if errors else ""
+        raise Exception(f"Batch {batch_id} {batch.get('status')}{detail}")
+    return batch_id, fetch_results(base, api_key, batch, len(payloads), config.get("workflow_tag", ""))
@@ -0,0 +1,97 @@
+"""
+ComfyUI Gemini 本地缓存工具
+On-disk cache helpers shared by the node modules
+
+- 缓存目录：环境变量 LLM_NODES_CACHE_DIR > ComfyUI user 目录 > 插件目录下 .cache
+- TTLCache：带过期时间的键值缓存（内存 + JSON 文件持久化，线程安全）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+try:
+    import folder_paths  # ComfyUI 运行时提供
+except ImportError:
+    folder_paths = None
+
+
+def _log(msg: str):
+    print(f"[LLM-Cache] {msg}")
+
+
+def cache_dir(name: str) -> str:
+    """返回（并创建）缓存子目录"""
+    root = os.environ.get("LLM_NODES_CACHE_DIR", "")
+    if not root:
+        if folder_paths is not None and hasattr(folder_paths, "get_user_directory"):
+            root = os.path.join(folder_paths.get_user_directory(), "llm_nodes")
+        else:
+            root = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def content_hash(data: bytes) -> str:
+    """内容哈希（sha256 十六进制）"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_json_atomic(path: str, obj) -> None:
+    """原子写入 JSON 文件（先写临时文件再替换）"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class TTLCache:
+    """带过期时间的键值缓存（内存 + JSON 文件持久化）"""
+
+    def __init__(self, path: str, default_ttl: float):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self) -> dict:
+        if self._entries is None:
+            self._entries = {}
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                _log(f"Ignoring unreadable cache {self.path}: {e}")
+        return self._entries
+
+    def get(self, key: str):
+        """命中且未过期时返回值，否则返回 None"""
+        with self._lock:
+            entry = self._load().get(key)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.time():
+                del self._entries[key]
+                return None
+            return entry["value"]
+
+    def set(self, key: str, value, ttl: float = None, expires_at: float = None) -> None:
+        with self._lock:
+            now = time.time()
+            entries = self._load()
+            entries[key] = {
+                "value": value,
+                "expires_at": expires_at or now + (ttl or self.default_ttl),
+            }
+            # 写盘时顺带清理过期项
+            for k in [k for k, e in entries.items() if e["expires_at"] <= now]:
+                del entries[k]
+            try:
+                write_json_atomic(self.path, entries)
+            except Exception as e:
+                _log(f"Failed to persist cache {self.path}: {e}")
@@ -0,0 +1,302 @@
+"""
+ComfyUI Gemini 目录打标流水线
+Directory-to-JSONL captioning with bounded concurrency and checkpoint/resume
+
+- 按文件名顺序流式遍历目录，不预先加载整个数据集
+- PNG / JPEG / WebP 直接发送原始文件字节，不经过张量 → PNG 的往返；格式不支持或超出预算时才重新编码
+- 有界并发：在途请求不超过 workers * 2，内存占用与数据集大小无关
+- 每条结果立即追加写入 JSONL；重新运行时跳过已成功的条目，失败条目会重试
+
+命令行（OpenAI 兼容端点，如 LiteLLM）:
+    python llm_caption.py <dir> --api-base URL --api-key KEY --model MODEL [--output captions.jsonl]
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from io import BytesIO
+
+from PIL import Image
+
+try:
+    from .llm_payload import build_image_parts, budget_from_config, estimate_image_tokens, b64_size
+    from .llm_files import ReferenceUploader
+    from .llm_keys import key_pool
+    from .llm_http import timeouts_from_config, check_interrupt, DeadlineExceeded, HTTPStatusError, Interrupted
+    from .llm_http import CHAT_DEADLINE, RETRY_BACKOFF
+except ImportError:
+    from llm_payload import build_image_parts, budget_from_config, estimate_image_tokens, b64_size
+    from llm_files import ReferenceUploader
+    from llm_keys import key_pool
+    from llm_http import timeouts_from_config, check_interrupt, DeadlineExceeded, HTTPStatusError, Interrupted
+    from llm_http import CHAT_DEADLINE, RETRY_BACKOFF
+
+
+def _log(msg: str):
+    print(f"[LLM-Caption] {msg}")
+
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+
+# 可直接发送原始字节的格式
+_NATIVE_MIME = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}
+
+DEFAULT_OUTPUT = "captions.jsonl"
+DEFAULT_PROMPT = "Describe this image in one detailed paragraph."
+
+# 每完成多少条打印一次进度
+_PROGRESS_EVERY = 100
+
+
+def iter_images(directory: str, recursive: bool = True):
+    """按排序顺序逐个产出 (相对路径, 绝对路径)"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        if not recursive:
+            dirs.clear()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTS):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, directory).replace(os.sep, "/"), path
+
+
+def load_checkpoint(output: str) -> set:
+    """读取已成功的条目（相对路径）；损坏的行忽略"""
+    done = set()
+    try:
+        with open(output, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("path") and not record.get("error"):
+                    done.add(record["path"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def file_image_parts(path: str, config: dict, make_part, reserved_bytes: int = 0) -> list:
+    """原始文件 → 内容块；格式受支持且在预算内时原样发送，否则按预算重新编码"""
+    with open(path, "rb") as f:
+        data = f.read()
+    mime = _NATIVE_MIME.get(os.path.splitext(path)[1].lower())
+    max_bytes, max_tokens = budget_from_config(config)
+    with Image.open(BytesIO(data)) as img:
+        width, height = img.size
+        fits = (not max_bytes or b64_size(len(data)) <= max_bytes - reserved_bytes) and \
+               (not max_tokens or estimate_image_tokens(width, height) <= max_tokens)
+        if mime and fits:
+            return [make_part(data, mime)]
+        return build_image_parts([img.convert("RGB")], max_bytes, max_tokens, reserved_bytes, make_part)
+
+
+def _needs_newline(path: str) -> bool:
+    """上次中断可能留下不完整的最后一行"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+    except FileNotFoundError:
+        return False
+
+
+class CaptionPipeline:
+    """目录 → JSONL 打标
+
+    request(method, url, headers, payload, timeouts=, deadline=, workflow=) 为执行节点模块的 _request，
+    make_headers(api_key) / extra_payload 用于区分 LiteLLM 与 OpenRouter；多 key 时按轮换池选择。
+    """
+
+    def __init__(self, config: dict, request, make_headers, extra_payload: dict = None, max_retries: int = 3):
+        self.config = config
+        self.request = request
+        self.make_headers = make_headers
+        self.keys = key_pool(config)
+        self.extra_payload = extra_payload or {}
+        self.max_retries = max_retries
+        self.base = (config.get("api_base") or "").strip().rstrip("/")
+
+    def _payload(self, path: str, prompt: str, system: str, uploader: ReferenceUploader) -> dict:
+        msgs = [{"role": "system", "content": system.strip()}] if system.strip() else []
+        content = [{"type": "text", "text": prompt.strip() or DEFAULT_PROMPT}]
+        reserved = len(json.dumps(msgs + [content]).encode())
+        content.extend(file_image_parts(path, self.config, uploader.part, reserved))
+        msgs.append({"role": "user", "content": content})
+        return {
+            "model": self.config.get("model"),
+            "messages": msgs,
+            "temperature": self.config.get("temperature", 0.7),
+            "max_tokens": self.config.get("max_tokens", 2000),
+            **self.extra_payload,
+        }
+
+    def caption(self, rel: str, path: str, prompt: str, system: str = "") -> dict:
+        """处理单张图像，返回要写入 JSONL 的记录（失败时带 error 字段）"""
+        start = time.time()
+        timeouts, deadline = timeouts_from_config(self.config, CHAT_DEADLINE)
+        # 参考图像用第一次请求的 key 上传（files_api 文件归属于上传账号）
+        api_key = self.keys.acquire()
+        uploader = ReferenceUploader(self.config, api_key, timeouts, deadline)
+        try:
+            payload = self._payload(path, prompt, system, uploader)
+        except Interrupted:
+            raise
+        except Exception as e:
+            return {"path": rel, "error": f"encode: {e}"}
+
+        error = ""
+        for attempt in range(self.max_retries):
+            if attempt:
+                api_key = self.keys.acquire()
+                uploader.bind(api_key)
+            try:
+                res = self.request("POST", f"{self.base}/chat/completions", self.make_headers(api_key), payload,
+                                   timeouts=timeouts, deadline=deadline, workflow=self.config.get("workflow_tag", ""))
+                self.keys.report(api_key)
+                text = res.get("choices", [{}])[0].get("message", {}).get("content", "")
+                if not text:
+                    raise Exception("empty response")
+                return {"path": rel, "caption": text, "model": res.get("model") or payload["model"],
+                        "latency": round(time.time() - start, 3)}
+            except Interrupted:
+                raise
+            except DeadlineExceeded as e:
+                error = str(e)
+                break
+            except Exception as e:
+                error = str(e)
+                rotated = self.keys.report(api_key, e) and self.keys.available()
+                if "HTTP 413" in error or attempt == self.max_retries - 1:
+                    break
+                if rotated:
+                    continue
+                delay = RETRY_BACKOFF * (attempt + 1)
+                if isinstance(e, HTTPStatusError) and e.code == 429:
+                    retry_after = {k.lower(): v for k, v in e.headers.items()}.get("retry-after", "")
+                    delay = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else delay * 2
+                try:
+                    deadline.sleep(delay)
+                except DeadlineExceeded as de:
+                    error = str(de)
+                    break
+        return {"path": rel, "error": error[:500]}
+
+    def run(self, directory: str, output: str, prompt: str, system: str = "", workers: int = 4,
+            recursive: bool = True, limit: int = 0) -> dict:
+        """处理整个目录，返回 {done, failed, skipped}"""
+        if not os.path.isdir(directory):
+            raise Exception(f"Directory not found: {directory}")
+        done = load_checkpoint(output)
+        stats = {"done": 0, "failed": 0, "skipped": 0}
+        if done:
+            _log(f"Resuming: {len(done)} items already captioned in {output}")
+
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        start = time.time()
+        with open(output, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-caption") as pool:
+            if _needs_newline(output):
+                out.write("\n")
+
+            pending = set()
+
+            def drain():
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    pending.discard(future)
+                    record = future.result()
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    if record.get("error"):
+                        stats["failed"] += 1
+                        _log(f"Failed {record['path']}: {record['error'][:200]}")
+                    else:
+                        stats["done"] += 1
+                    finished_count = stats["done"] + stats["failed"]
+                    if finished_count % _PROGRESS_EVERY == 0:
+                        rate = finished_count / max(time.time() - start, 1e-6)
+                        _log(f"{finished_count} captioned ({stats['failed']} failed), {rate:.2f} img/s")
+
+            submitted = 0
+            try:
+                for rel, path in iter_images(directory, recursive):
+                    if rel in done:
+                        stats["skipped"] += 1
+                        continue
+                    if limit and submitted >= limit:
+                        break
+                    check_interrupt()
+                    # 在途请求数有上限，避免一次性提交整个数据集
+                    while len(pending) >= workers * 2:
+                        drain()
+                    pending.add(pool.submit(self.caption, rel, path, prompt, system))
+                    submitted += 1
+                while pending:
+                    drain()
+            except Interrupted:
+                # 用户取消：丢弃尚未开始的条目，已完成的结果都已写入，下次从断点继续
+                for future in pending:
+                    future.cancel()
+                _log(f"Interrupted after {stats['done']} captioned")
+                raise
+
+        _log(f"Finished in {time.time() - start:.1f}s: {stats['done']} captioned, "
+             f"{stats['failed']} failed, {stats['skipped']} skipped")
+        return stats
+
+
+def main(argv=None):
+    import argparse
+
+    try:
+        from .nodes import _request, _headers
+        from .llm_keys import resolve_keys
+    except ImportError:
+        from nodes import _request, _headers
+        from llm_keys import resolve_keys
+
+    parser = argparse.ArgumentParser(description="Caption a directory of images into JSONL")
+    parser.add_argument("directory")
+    parser.add_argument("--output", default="", help=f"JSONL path (default: <directory>/{DEFAULT_OUTPUT})")
+    parser.add_argument("--api-base", required=True)
+    parser.add_argument("--api-key", default=os.environ.get("LLM_API_KEY", ""), help="one or more keys, comma separated")
+    parser.add_argument("--api-key-env", default="", help="environment variable holding more keys")
+    parser.add_argument("--api-key-file", default="", help="file with one key per line")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--system", default="")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--no-recursive", action="store_true")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--max-payload-mb", type=float, default=20.0)
+    parser.add_argument("--max-image-tokens", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    keys = resolve_keys(args.api_key, args.api_key_env, args.api_key_file)
+    config = {
+        "api_base": args.api_base.strip().rstrip("/"),
+        "api_key": keys[0] if keys else "",
+        "api_keys": keys,
+        "model": args.model,
+        "temperature": args.temperature,
+        "max_tokens": args.max_tokens,
+        "max_payload_mb": args.max_payload_mb,
+        "max_image_tokens": args.max_image_tokens,
+    }
+    output = args.output or os.path.join(args.directory, DEFAULT_OUTPUT)
+    pipeline = CaptionPipeline(config, _request, _headers)
+    stats = pipeline.run(args.directory, output, args.prompt, args.system, args.workers,
+                         not args.no_recursive, args.limit)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,158 @@
+"""
+ComfyUI Gemini 录制 / 回放传输层
+Record/replay transport for deterministic offline performance testing
+
+环境变量:
+- LLM_NODES_TRANSPORT:      live（默认）/ record（真实请求并保存）/ replay（只回放，缺失即报错）/ auto（有则回放，否则录制）
+- LLM_NODES_CASSETTE_DIR:   cassette 目录，默认缓存目录下的 cassettes/
+- LLM_NODES_REPLAY_LATENCY: recorded（按录制时的耗时等待，默认）/ none / 固定秒数
+
+每个请求一个 gzip 压缩的 JSON 文件，文件名为 method + url + 请求体的 sha256（不含请求头，不保存 key）。
+请求体只记录哈希与长度；multipart 分隔符在计算哈希前被替换为固定值，保证同一上传可重复命中。
+流式请求体在录制 / 回放时先拼接完整再计算哈希；流式响应（on_chunk）回放时整段交给 on_chunk 一次。
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import time
+
+try:
+    from .llm_cache import cache_dir
+    from .llm_http import HTTPStatusError
+except ImportError:
+    from llm_cache import cache_dir
+    from llm_http import HTTPStatusError
+
+
+def _log(msg: str):
+    print(f"[LLM-Cassette] {msg}")
+
+
+# 不写入 cassette 的响应头
+_DROP_HEADERS = {"set-cookie", "date", "connection", "keep-alive", "transfer-encoding"}
+
+
+def _canonical_body(headers: dict, body: bytes) -> bytes:
+    if not body:
+        return b""
+    content_type = {k.lower(): v for k, v in (headers or {}).items()}.get("content-type", "")
+    if "multipart/form-data" in content_type and "boundary=" in content_type:
+        boundary = content_type.split("boundary=", 1)[1].strip().encode()
+        return body.replace(boundary, b"BOUNDARY")
+    if "json" in content_type:
+        try:
+            return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode()
+        except ValueError:
+            pass
+    return body
+
+
+def request_key(method: str, url: str, headers: dict, body: bytes) -> str:
+    """请求的内容哈希（method + url + 规范化请求体）"""
+    h = hashlib.sha256()
+    h.update(f"{method.upper()} {url}\n".encode())
+    h.update(_canonical_body(headers, body))
+    return h.hexdigest()
+
+
+class CassetteTransport:
+    """录制 / 回放传输层，接口同 llm_http.LiveTransport"""
+
+    def __init__(self, mode: str, directory: str = "", latency: str = "recorded", inner=None):
+        self.name = mode
+        self.mode = mode
+        self.directory = directory or cache_dir("cassettes")
+        self.latency = (latency or "recorded").strip().lower()
+        self.inner = inner
+        if self.latency not in ("recorded", "none"):
+            try:
+                float(self.latency)
+            except ValueError:
+                raise Exception(f"LLM_NODES_REPLAY_LATENCY must be recorded, none or seconds, got {latency}")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json.gz")
+
+    def _load(self, path: str):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            _log(f"Ignoring unreadable cassette {path}: {e}")
+            return None
+
+    def _save(self, path: str, method: str, url: str, body: bytes, status: int, headers: dict,
+              data: bytes, latency: float) -> None:
+        try:
+            text = data.decode("utf-8")
+            encoded = {"body": text}
+        except UnicodeDecodeError:
+            encoded = {"body_b64": base64.b64encode(data).decode()}
+        cassette = {
+            "request": {"method": method, "url": url, "body_sha256": hashlib.sha256(body or b"").hexdigest(),
+                        "body_bytes": len(body or b"")},
+            "status": status,
+            "headers": {k: v for k, v in (headers or {}).items() if k.lower() not in _DROP_HEADERS},
+            "latency": round(latency, 4),
+            "recorded_at": round(time.time(), 3),
+            **encoded,
+        }
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(cassette, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def _replay(self, cassette: dict, deadline, on_chunk=None) -> tuple:
+        if self.latency == "recorded":
+            delay = cassette.get("latency", 0)
+        elif self.latency == "none":
+            delay = 0
+        else:
+            delay = float(self.latency)
+        if delay > 0:
+            # 与真实请求一样受节点截止时间与中断约束
+            deadline.sleep(delay, "replay")
+
+        if "body_b64" in cassette:
+            data = base64.b64decode(cassette["body_b64"])
+        else:
+            data = cassette.get("body", "").encode("utf-8")
+        status = cassette.get("status", 200)
+        headers = dict(cassette.get("headers") or {})
+        if status >= 400:
+            raise HTTPStatusError(status, data.decode(errors="replace"), headers)
+        if on_chunk is not None:
+            on_chunk(data)
+        return status, headers, data
+
+    def send(self, method: str, url: str, headers: dict, body: bytes, timeouts, deadline, on_chunk=None) -> tuple:
+        if body is not None and not isinstance(body, (bytes, bytearray)):
+            # 流式请求体（分块上传）先拼接完整，保证与预先编码的请求体命中同一 cassette
+            body = b"".join(body)
+        key = request_key(method, url, headers, body)
+        path = self._path(key)
+
+        if self.mode in ("replay", "auto"):
+            cassette = self._load(path)
+            if cassette is not None:
+                return self._replay(cassette, deadline, on_chunk)
+            if self.mode == "replay":
+                raise Exception(f"No cassette for {method} {url} ({key[:12]}) in {self.directory}")
+
+        start = time.monotonic()
+        extra = {"on_chunk": on_chunk} if on_chunk is not None else {}
+        try:
+            status, resp_headers, data = self.inner.send(method, url, headers, body, timeouts, deadline, **extra)
+        except HTTPStatusError as e:
+            # 错误响应同样录制，回放时按相同状态码抛出
+            self._save(path, method, url, body, e.code, e.headers, e.body.encode("utf-8"), time.monotonic() - start)
+            raise
+        self._save(path, method, url, body, status, resp_headers, data, time.monotonic() - start)
+        return status, resp_headers, data
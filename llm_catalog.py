@@ -0,0 +1,168 @@
+"""
+ComfyUI Gemini 模型目录缓存与预检
+Cached /models catalogue + preflight validation before any encoding work
+
+- 每个 (api_base, key) 只拉取一次 /models，缓存在内存与磁盘（TTL），所有节点实例共享
+- 在编码参考图像之前校验模型名、输出模态（图像）与上下文 / 输出长度限制
+- 目录不可用或目录中找不到模型（别名 / 通配路由）时只记录日志，不阻塞请求
+"""
+
+import difflib
+import fnmatch
+import json
+import os
+import threading
+import time
+
+try:
+    from .llm_cache import TTLCache, cache_dir, content_hash
+    from .llm_http import send, Timeouts, Deadline
+except ImportError:
+    from llm_cache import TTLCache, cache_dir, content_hash
+    from llm_http import send, Timeouts, Deadline
+
+
+def _log(msg: str):
+    print(f"[LLM-Catalog] {msg}")
+
+
+_CATALOG_TTL = 6 * 3600
+# 拉取失败后在该时间内不再重试，避免每个节点都等一次超时
+_FAILURE_BACKOFF = 300
+# 模型未找到时，缓存早于该时间则强制刷新一次（可能是新上线的模型）
+_REFRESH_MIN_AGE = 60
+
+_memory = {}
+_failures = {}
+# 刷新后仍找不到的 (api_base, model)，目录 TTL 内不再为其刷新（别名 / 通配路由常不在目录中）
+_missing = {}
+_lock = threading.Lock()
+_key_locks = {}
+_disk = None
+
+
+def _disk_cache() -> TTLCache:
+    global _disk
+    if _disk is None:
+        _disk = TTLCache(os.path.join(cache_dir("catalog"), "models.json"), _CATALOG_TTL)
+    return _disk
+
+
+def _fetch(base: str, api_key: str) -> dict:
+    _, _, raw = send("GET", f"{base}/models", {
+        "Authorization": f"Bearer {(api_key or '').strip()}",
+        "User-Agent": "ComfyUI",
+    }, timeouts=Timeouts(connect=10, idle=15), deadline=Deadline(30))
+    res = json.loads(raw.decode())
+    items = res.get("data", res) if isinstance(res, dict) else res
+    catalog = {}
+    for item in items or []:
+        if isinstance(item, dict) and item.get("id"):
+            arch = item.get("architecture") or {}
+            top = item.get("top_provider") or {}
+            catalog[item["id"]] = {
+                "context_length": item.get("context_length") or top.get("context_length"),
+                "max_completion_tokens": top.get("max_completion_tokens"),
+                "output_modalities": arch.get("output_modalities"),
+            }
+    return catalog
+
+
+def get_catalog(api_base: str, api_key: str, refresh: bool = False) -> dict:
+    """返回 {model_id: info}；不可用时返回 None"""
+    base = (api_base or "").strip().rstrip("/")
+    key = f"{base}|{content_hash((api_key or '').strip().encode())[:12]}"
+
+    def cached():
+        entry = _memory.get(key)
+        if not entry or entry["expires_at"] <= time.time():
+            return None
+        if refresh and time.time() - entry["fetched_at"] > _REFRESH_MIN_AGE:
+            return None
+        return entry["catalog"]
+
+    with _lock:
+        catalog = cached()
+        if catalog is not None:
+            return catalog
+        if _failures.get(key, 0) > time.time():
+            return None
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # 同一端点并发请求只拉取一次
+    with key_lock:
+        with _lock:
+            catalog = cached()
+            if catalog is not None:
+                return catalog
+
+        disk = None if refresh else _disk_cache().get(key)
+        if disk is not None:
+            catalog, fetched_at = disk["catalog"], disk["fetched_at"]
+        else:
+            start = time.time()
+            try:
+                catalog = _fetch(base, api_key)
+            except Exception as e:
+                _log(f"Catalogue unavailable at {base}/models ({e}), skipping validation")
+                with _lock:
+                    _failures[key] = time.time() + _FAILURE_BACKOFF
+                return None
+            fetched_at = time.time()
+            _log(f"Fetched {len(catalog)} models from {base} in {fetched_at - start:.2f}s")
+            _disk_cache().set(key, {"catalog": catalog, "fetched_at": fetched_at})
+
+        with _lock:
+            _memory[key] = {
+                "catalog": catalog,
+                "fetched_at": fetched_at,
+                "expires_at": fetched_at + _CATALOG_TTL,
+            }
+        return catalog
+
+
+def _lookup(catalog: dict, model: str):
+    if model in catalog:
+        return catalog[model]
+    # LiteLLM 通配路由，如 "gemini/*"
+    for pattern, info in catalog.items():
+        if "*" in pattern and fnmatch.fnmatchcase(model, pattern):
+            return info
+    return None
+
+
+def check_model(config: dict, need_image: bool = False, max_tokens: int = None) -> None:
+    """按目录校验模型；能力不符时抛出异常，目录中找不到时只警告（LiteLLM 别名 / 通配路由不一定列在目录中），
+    目录不可用或未开启时直接返回"""
+    if not config.get("validate_model", False):
+        return
+    model = (config.get("model") or "").strip()
+    catalog = get_catalog(config.get("api_base"), config.get("api_key"))
+    if not catalog:
+        return
+
+    info = _lookup(catalog, model)
+    if info is None:
+        miss = ((config.get("api_base") or "").strip().rstrip("/"), model)
+        with _lock:
+            known = _missing.get(miss, 0) > time.time()
+        if not known:
+            catalog = get_catalog(config.get("api_base"), config.get("api_key"), refresh=True) or catalog
+            info = _lookup(catalog, model)
+            if info is None:
+                with _lock:
+                    _missing[miss] = time.time() + _CATALOG_TTL
+    if info is None:
+        close = difflib.get_close_matches(model, list(catalog), n=3, cutoff=0.5)
+        hint = f" Did you mean: {', '.join(close)}?" if close else ""
+        _log(f"Warning: model '{model}' not found in {config.get('api_base')}/models.{hint}")
+        return
+
+    modalities = info.get("output_modalities")
+    if need_image and modalities and "image" not in modalities:
+        raise Exception(f"Model '{model}' does not support image output (output modalities: {', '.join(modalities)})")
+
+    if max_tokens:
+        limit = info.get("max_completion_tokens") or info.get("context_length")
+        if limit and max_tokens > limit:
+            raise Exception(f"max_tokens={max_tokens} exceeds the limit of '{model}' ({limit})")
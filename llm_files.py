@@ -0,0 +1,183 @@
+"""
+ComfyUI Gemini 参考图像上传（一次上传，按内容哈希复用句柄）
+Upload-once reference handles instead of re-sending base64 on every call
+
+模式 (reference_upload):
+- inline:    默认，data:image/...;base64 内联
+- files_api: multipart 上传到 OpenAI 兼容 /files（如 LiteLLM → Gemini Files API）
+- url:       PUT 原始字节到 upload_url/<sha256>.<ext>（本地服务 / 对象存储），按 URL 引用
+
+句柄按 (上传地址, 内容哈希) 缓存在内存与磁盘，过期后重新上传；上传失败时回退为内联。
+上传经 llm_http.send 发送：受节点截止时间与中断约束，并走录制 / 回放传输层。
+files_api 文件归属于上传账号：使用发送请求的同一个 key 上传，重试换 key 时用 bind() 换成该 key 的句柄。
+"""
+
+import json
+import os
+import time
+import uuid
+
+try:
+    from .llm_cache import TTLCache, cache_dir, content_hash
+    from .llm_payload import image_part
+    from .llm_http import send, Timeouts, Deadline, HTTPStatusError, DeadlineExceeded, Interrupted
+except ImportError:
+    from llm_cache import TTLCache, cache_dir, content_hash
+    from llm_payload import image_part
+    from llm_http import send, Timeouts, Deadline, HTTPStatusError, DeadlineExceeded, Interrupted
+
+
+def _log(msg: str):
+    print(f"[LLM-Files] {msg}")
+
+
+UPLOAD_MODES = ["inline", "files_api", "url"]
+
+# Gemini Files API 文件保留 48 小时，留出余量
+_HANDLE_TTL = 46 * 3600
+
+# 未传入节点超时时的上传超时（秒）
+_UPLOAD_TIMEOUT = 120
+
+_EXT = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp", "image/gif": "gif"}
+
+_handles = None
+
+
+def _handle_cache() -> TTLCache:
+    global _handles
+    if _handles is None:
+        _handles = TTLCache(os.path.join(cache_dir("files"), "handles.json"), _HANDLE_TTL)
+    return _handles
+
+
+def multipart_body(fields: dict, filename: str, data: bytes, mime: str) -> tuple:
+    """构建 multipart/form-data 请求体"""
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, value in fields.items():
+        lines.append(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode())
+    lines.append(
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {mime}\r\n\r\n".encode()
+    )
+    lines.append(data)
+    lines.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(lines), f"multipart/form-data; boundary={boundary}"
+
+
+def _upload_files_api(url: str, api_key: str, model: str, data: bytes, mime: str, digest: str,
+                      timeouts: Timeouts, deadline: Deadline) -> tuple:
+    """上传到 OpenAI 兼容 /files，返回 (内容块, 过期时间)"""
+    fields = {"purpose": "user_data"}
+    # LiteLLM 需要 provider 前缀才能路由到对应的 Files API（如 gemini/...）
+    if "/" in (model or ""):
+        fields["custom_llm_provider"] = model.split("/", 1)[0]
+    body, content_type = multipart_body(fields, f"{digest[:16]}.{_EXT.get(mime, 'bin')}", data, mime)
+    headers = {
+        "Authorization": f"Bearer {(api_key or '').strip()}",
+        "Content-Type": content_type,
+        "User-Agent": "ComfyUI",
+    }
+    _, _, raw = send("POST", url, headers, body, timeouts, deadline)
+    res = json.loads(raw.decode())
+
+    expires_at = res.get("expires_at")
+    # Gemini 文件返回 URI 时按 URL 引用，否则按 file_id 引用
+    uri = res.get("uri") or res.get("url")
+    if uri:
+        part = {"type": "image_url", "image_url": {"url": uri}}
+    elif res.get("id"):
+        part = {"type": "file", "file": {"file_id": res["id"], "format": mime}}
+    else:
+        raise Exception(f"upload response has no id/uri: {str(res)[:200]}")
+    return part, expires_at
+
+
+def _upload_url(url: str, data: bytes, mime: str, digest: str, timeouts: Timeouts, deadline: Deadline) -> tuple:
+    """PUT 到本地服务 / 对象存储，返回 (内容块, 过期时间)"""
+    target = f"{url}/{digest}.{_EXT.get(mime, 'bin')}"
+    _, _, raw = send("PUT", target, {"Content-Type": mime, "User-Agent": "ComfyUI"}, data, timeouts, deadline)
+    # 服务端可返回 {"url": ...} 指定公开访问地址
+    try:
+        public = json.loads(raw.decode()).get("url") if raw else None
+    except Exception:
+        public = None
+    return {"type": "image_url", "image_url": {"url": public or target}}, None
+
+
+class ReferenceUploader:
+    """按配置把编码后的参考图像转为内容块（内联或上传句柄）
+
+    timeouts / deadline 为执行节点的超时与总截止时间，未传入时每次上传最长 _UPLOAD_TIMEOUT 秒。
+    """
+
+    def __init__(self, config: dict, api_key: str = None, timeouts: Timeouts = None, deadline: Deadline = None):
+        self.mode = config.get("reference_upload", "inline") or "inline"
+        self.api_key = api_key if api_key is not None else config.get("api_key", "")
+        self.timeouts = timeouts or Timeouts(first_byte=_UPLOAD_TIMEOUT, idle=_UPLOAD_TIMEOUT)
+        self.deadline = deadline or Deadline()
+        self.model = config.get("model", "")
+        upload_url = (config.get("upload_url") or "").strip().rstrip("/")
+        if self.mode == "files_api" and not upload_url:
+            upload_url = f"{(config.get('api_base') or '').rstrip('/')}/files"
+        self.upload_url = upload_url
+        if self.mode not in UPLOAD_MODES:
+            raise Exception(f"Unknown reference_upload mode: {self.mode}")
+        if self.mode == "url" and not upload_url:
+            raise Exception("reference_upload=url requires upload_url")
+        # 已返回的 files_api 内容块 (内容块, 图像字节, mime)，换 key 时原地替换
+        self._parts = []
+
+    def part(self, data: bytes, mime: str = "image/png") -> dict:
+        """返回该图像的内容块；同一内容只上传一次"""
+        if self.mode == "inline":
+            return image_part(data, mime)
+        # 复制一份，缓存中的句柄不会被 bind() 修改
+        part = dict(self._resolve(data, mime))
+        if self.mode == "files_api":
+            self._parts.append((part, data, mime))
+        return part
+
+    def bind(self, api_key: str) -> None:
+        """改用 api_key 发送请求：已生成的 files_api 内容块原地换成该 key 上传的句柄（命中缓存则不重新上传）"""
+        if api_key == self.api_key:
+            return
+        self.api_key = api_key
+        for part, data, mime in self._parts:
+            fresh = self._resolve(data, mime)
+            part.clear()
+            part.update(fresh)
+
+    def _resolve(self, data: bytes, mime: str) -> dict:
+        digest = content_hash(data)
+        key = f"{self.mode}|{self.upload_url}|{digest}"
+        if self.mode == "files_api":
+            # 文件归属于上传账号，不同 key 不共享句柄
+            key += f"|{content_hash(self.api_key.strip().encode())[:12]}"
+        cache = _handle_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        start = time.time()
+        try:
+            if self.mode == "files_api":
+                part, expires_at = _upload_files_api(self.upload_url, self.api_key, self.model, data, mime, digest,
+                                                     self.timeouts, self.deadline)
+            else:
+                part, expires_at = _upload_url(self.upload_url, data, mime, digest, self.timeouts, self.deadline)
+        except (DeadlineExceeded, Interrupted):
+            # 取消 / 超过截止时间时不再回退为内联，直接结束节点
+            raise
+        except HTTPStatusError as e:
+            _log(f"Upload failed (HTTP {e.code}: {e.body[:200]}), sending inline")
+            return image_part(data, mime)
+        except Exception as e:
+            _log(f"Upload failed ({e}), sending inline")
+            return image_part(data, mime)
+
+        _log(f"Uploaded {len(data)} bytes ({digest[:12]}) in {time.time() - start:.2f}s")
+        # 提前 5 分钟过期，避免引用即将失效的句柄
+        cache.set(key, part, expires_at=(expires_at - 300) if expires_at else None)
+        return part
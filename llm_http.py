@@ -0,0 +1,521 @@
+"""
+ComfyUI Gemini HTTP 传输层
+HTTP transport shared by both _request paths
+
+- 节点级总截止时间（Deadline），贯穿编码、请求、重试与退避
+- 分离的连接 / 首字节 / 读取空闲超时：失效端点几秒内失败，慢速返回的 4K 结果仍可读完
+- 仅使用标准库 http.client，支持 HTTP(S)_PROXY 环境变量
+- 请求期间轮询 ComfyUI 中断状态，用户取消时立即关闭套接字，跳过剩余重试
+- keep-alive 连接池；配置节点可选在后台预热连接（DNS + TCP + TLS）
+- 可替换的传输层：live（默认）/ record / replay / auto，见 llm_cassette
+"""
+
+import http.client
+import math
+import os
+import select
+import socket
+import threading
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+
+def _log(msg: str):
+    print(f"[LLM-HTTP] {msg}")
+
+
+_READ_CHUNK = 1 << 16
+
+# 默认总截止时间（秒）：聊天 / 按图片尺寸
+CHAT_DEADLINE = 180
+IMAGE_DEADLINES = {"1K": 300, "2K": 480, "4K": 900}
+
+# 默认超时（秒）；首字节超时为 0 表示等到截止时间
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+# 重试退避基数（秒），第 n 次重试前等待 n 倍
+RETRY_BACKOFF = 2.0
+
+
+class DeadlineExceeded(Exception):
+    """节点总截止时间已到"""
+
+
+# ComfyUI 中断：使用 ComfyUI 自己的异常类型，执行器会按“已取消”而不是报错处理
+try:
+    import comfy.model_management as _model_management
+    Interrupted = _model_management.InterruptProcessingException
+
+    def _interrupted() -> bool:
+        return _model_management.processing_interrupted()
+except ImportError:
+    _model_management = None
+
+    class Interrupted(Exception):
+        """用户取消了当前队列任务"""
+
+    def _interrupted() -> bool:
+        return False
+
+# 中断轮询间隔（秒）
+_INTERRUPT_POLL = 0.2
+
+
+def check_interrupt() -> None:
+    """用户已取消当前任务时抛出 Interrupted（不清除中断标志，由 ComfyUI 在下一个任务开始时重置）"""
+    if _interrupted():
+        raise Interrupted("Processing interrupted")
+
+
+def interruptible_sleep(seconds: float) -> None:
+    """分片等待，期间响应中断"""
+    end = time.monotonic() + max(seconds, 0)
+    while True:
+        check_interrupt()
+        left = end - time.monotonic()
+        if left <= 0:
+            return
+        time.sleep(min(left, _INTERRUPT_POLL))
+
+
+class HTTPStatusError(Exception):
+    """服务端返回 ≥400 状态码"""
+
+    def __init__(self, code: int, body: str, headers: dict = None):
+        super().__init__(f"HTTP {code}: {body}")
+        self.code = code
+        self.body = body
+        self.headers = headers or {}
+
+
+class Deadline:
+    """节点级总截止时间（0 表示不限制）"""
+
+    def __init__(self, seconds: float = 0):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds if seconds and seconds > 0 else None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def check(self, stage: str = "") -> None:
+        check_interrupt()
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            where = f" during {stage}" if stage else ""
+            raise DeadlineExceeded(f"Deadline of {self.seconds:.0f}s exceeded{where}")
+
+    def cap(self, timeout: float, stage: str = ""):
+        """把单步超时限制在剩余时间内；timeout 为 0 表示等到截止时间"""
+        self.check(stage)
+        limit = min(timeout, self.remaining()) if timeout else self.remaining()
+        return None if limit == math.inf else max(limit, 0.001)
+
+    def sleep(self, seconds: float, stage: str = "backoff") -> None:
+        """退避等待，不超过截止时间，期间响应中断"""
+        self.check(stage)
+        interruptible_sleep(min(seconds, self.remaining()))
+        self.check(stage)
+
+
+class Timeouts:
+    """分离的连接 / 首字节 / 读取空闲超时（秒）"""
+
+    def __init__(self, connect: float = DEFAULT_CONNECT_TIMEOUT, first_byte: float = 0,
+                 idle: float = DEFAULT_IDLE_TIMEOUT):
+        self.connect = connect
+        self.first_byte = first_byte
+        self.idle = idle
+
+    def __repr__(self):
+        return f"Timeouts(connect={self.connect}, first_byte={self.first_byte or 'deadline'}, idle={self.idle})"
+
+
+def timeouts_from_config(config: dict, default_deadline: float) -> tuple:
+    """从节点配置读取 (Timeouts, Deadline)；deadline 为 0 时使用默认值"""
+    timeouts = Timeouts(
+        connect=float(config.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT) or DEFAULT_CONNECT_TIMEOUT),
+        first_byte=float(config.get("first_byte_timeout", 0) or 0),
+        idle=float(config.get("idle_timeout", DEFAULT_IDLE_TIMEOUT) or DEFAULT_IDLE_TIMEOUT),
+    )
+    seconds = float(config.get("deadline", 0) or 0) or default_deadline
+    return timeouts, Deadline(seconds)
+
+
+def _proxy_for(parts) -> str:
+    proxy = urllib.request.getproxies().get(parts.scheme)
+    if proxy and not urllib.request.proxy_bypass(parts.hostname or ""):
+        return proxy
+    return ""
+
+
+def _target(parts) -> str:
+    """请求目标；经 HTTP 代理时使用绝对 URL"""
+    if parts.scheme != "https" and _proxy_for(parts):
+        return parts.geturl()
+    return (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+
+def _connection(parts, timeout):
+    """创建连接对象（尚未连接），返回 (conn, 请求目标)"""
+    https = parts.scheme == "https"
+    host = parts.hostname
+    port = parts.port or (443 if https else 80)
+    target = _target(parts)
+
+    proxy = _proxy_for(parts)
+    if proxy:
+        p = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+        if https:
+            conn = http.client.HTTPSConnection(p.hostname, p.port or 80, timeout=timeout)
+            conn.set_tunnel(host, port)
+            return conn, target
+        return http.client.HTTPConnection(p.hostname, p.port or 80, timeout=timeout), target
+
+    cls = http.client.HTTPSConnection if https else http.client.HTTPConnection
+    return cls(host, port, timeout=timeout), target
+
+
+# ============ 连接池 ============
+
+# 空闲连接超过该时间视为失效（多数服务端 keep-alive 超时在 60s 左右）
+_POOL_IDLE_TTL = 45
+_POOL_MAX_IDLE = 4
+
+_idle = {}
+_idle_lock = threading.Lock()
+
+
+# ============ 中断看门狗 ============
+
+class _Watch:
+    def __init__(self, sock):
+        self.sock = sock
+        self.aborted = False
+
+
+_watched = set()
+_watch_lock = threading.Lock()
+_watchdog = None
+
+
+def _watch_loop() -> None:
+    while True:
+        time.sleep(_INTERRUPT_POLL)
+        with _watch_lock:
+            watches = list(_watched)
+        if watches and _interrupted():
+            for w in watches:
+                if not w.aborted:
+                    w.aborted = True
+                    # 关闭套接字让阻塞中的发送 / 读取立即返回
+                    try:
+                        w.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+
+def _watch(sock):
+    """请求期间由后台线程轮询 ComfyUI 中断状态；不在 ComfyUI 中运行时不启动"""
+    global _watchdog
+    if _model_management is None:
+        return None
+    w = _Watch(sock)
+    with _watch_lock:
+        _watched.add(w)
+        if _watchdog is None:
+            _watchdog = threading.Thread(target=_watch_loop, name="llm-interrupt-watchdog", daemon=True)
+            _watchdog.start()
+    return w
+
+
+def _unwatch(w) -> None:
+    if w is not None:
+        with _watch_lock:
+            _watched.discard(w)
+
+
+def _raise_if_aborted(w) -> None:
+    if w is not None and w.aborted:
+        raise Interrupted("Processing interrupted, request aborted")
+
+
+class _StaleConnection(Exception):
+    """复用的空闲连接已被服务端关闭"""
+
+
+def _pool_key(parts) -> tuple:
+    return parts.scheme, parts.hostname, parts.port, _proxy_for(parts)
+
+
+def _alive(conn) -> bool:
+    """空闲连接可读意味着对端已关闭（或发来了意外数据），不能再复用"""
+    sock = conn.sock
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+
+def _checkout(key: tuple):
+    with _idle_lock:
+        conns = _idle.get(key) or []
+        while conns:
+            conn, since = conns.pop()
+            if time.monotonic() - since < _POOL_IDLE_TTL and _alive(conn):
+                return conn
+            conn.close()
+    return None
+
+
+def _checkin(key: tuple, conn) -> None:
+    with _idle_lock:
+        conns = _idle.setdefault(key, [])
+        if len(conns) < _POOL_MAX_IDLE:
+            conns.append((conn, time.monotonic()))
+            return
+    conn.close()
+
+
+# 请求体发送失败后等待服务端提前响应的时间（秒）
+_EARLY_RESPONSE_WAIT = 2
+
+
+def _early_response(conn):
+    try:
+        conn.sock.settimeout(_EARLY_RESPONSE_WAIT)
+        return conn.getresponse()
+    except (OSError, http.client.HTTPException):
+        return None
+
+
+def _exchange(conn, key: tuple, reused: bool, method: str, target: str, headers: dict, body: bytes,
+              timeouts: Timeouts, deadline: Deadline, on_chunk=None) -> tuple:
+    stage, limit = "connect", timeouts.connect
+    keep = False
+    watch = None
+    try:
+        if not reused:
+            conn.connect()
+        sock = conn.sock
+        watch = _watch(sock)
+
+        stage, limit = "send", timeouts.idle
+        sock.settimeout(deadline.cap(timeouts.idle, stage))
+        resp = None
+        early = False
+        try:
+            # 可迭代请求体没有 Content-Length，http.client 自动使用 Transfer-Encoding: chunked
+            conn.request(method, target, body=body, headers=headers)
+        except (BrokenPipeError, ConnectionResetError):
+            # 服务端可能未读完请求体就已响应并关闭（如 411 / 413），能读到该响应时按响应处理
+            resp = _early_response(conn)
+            if resp is None:
+                raise
+            early = True
+
+        if resp is None:
+            stage, limit = "first byte", timeouts.first_byte
+            sock.settimeout(deadline.cap(timeouts.first_byte, stage))
+            resp = conn.getresponse()
+
+        stage, limit = "read", timeouts.idle
+        chunks = []
+        # 流式响应：每收到一段就交给 on_chunk（read1 不等凑满整块）；on_chunk 抛出异常时立即断开连接
+        if on_chunk is not None and resp.status >= 400:
+            on_chunk = None
+        read = resp.read if on_chunk is None else resp.read1
+        # 响应读完后 http.client 会关闭 fp（Connection: close 时连同 socket），此时不能再设置超时
+        while not resp.isclosed():
+            sock.settimeout(deadline.cap(timeouts.idle, stage))
+            chunk = read(_READ_CHUNK)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if on_chunk is not None:
+                on_chunk(chunk)
+        _raise_if_aborted(watch)
+        keep = not resp.will_close and not early
+    except (socket.timeout, TimeoutError):
+        # 截止时间先到时报告截止，否则报告具体阶段的超时
+        _raise_if_aborted(watch)
+        deadline.check(stage)
+        raise TimeoutError(f"{stage} timed out after {limit or deadline.seconds}s")
+    except (OSError, http.client.HTTPException) as e:
+        _raise_if_aborted(watch)
+        # 复用连接在收到响应前断开：服务端已关闭空闲连接，换新连接重发
+        if reused and stage in ("send", "first byte") and isinstance(e, (ConnectionError, http.client.BadStatusLine)):
+            raise _StaleConnection(str(e))
+        raise
+    finally:
+        _unwatch(watch)
+        if keep:
+            _checkin(key, conn)
+        else:
+            conn.close()
+
+    data = b"".join(chunks)
+    resp_headers = dict(resp.getheaders())
+    if resp.status >= 400:
+        raise HTTPStatusError(resp.status, data.decode(errors="replace"), resp_headers)
+    return resp.status, resp_headers, data
+
+
+def _live_send(method: str, url: str, headers: dict, body: bytes, timeouts: Timeouts, deadline: Deadline,
+               on_chunk=None) -> tuple:
+    parts = urlsplit(url)
+    key = _pool_key(parts)
+    if key in _prewarm_hosts:
+        # 真实请求保持预热：配置节点缓存后不会再调用 prewarm_connections
+        _touch_prewarm(parts, key)
+    conn = _checkout(key)
+    if conn is not None:
+        try:
+            return _exchange(conn, key, True, method, _target(parts), headers, body, timeouts, deadline, on_chunk)
+        except _StaleConnection:
+            pass
+    conn, target = _connection(parts, deadline.cap(timeouts.connect, "connect"))
+    return _exchange(conn, key, False, method, target, headers, body, timeouts, deadline, on_chunk)
+
+
+# ============ 连接预热 ============
+
+# 预热后保持连接可用的时长（秒，每次真实请求都会续期）与刷新间隔
+_PREWARM_WINDOW = 600
+_PREWARM_REFRESH = 15
+
+_prewarmers = {}
+# 登记过预热的主机：配置节点被 ComfyUI 缓存不再执行时，由真实请求续期 / 重启预热
+_prewarm_hosts = set()
+_prewarm_lock = threading.Lock()
+
+
+def _ensure_warm(parts, key: tuple) -> float:
+    """保证池中至少有一个未临近过期的空闲连接；新建连接时返回耗时，否则返回 0"""
+    with _idle_lock:
+        now = time.monotonic()
+        keep, stale = [], []
+        for conn, since in _idle.get(key) or []:
+            fresh = now - since < _POOL_IDLE_TTL - _PREWARM_REFRESH and _alive(conn)
+            (keep if fresh else stale).append((conn, since))
+        _idle[key] = keep
+    for conn, _ in stale:
+        conn.close()
+    if keep:
+        return 0.0
+
+    start = time.monotonic()
+    conn, _ = _connection(parts, DEFAULT_CONNECT_TIMEOUT)
+    conn.connect()
+    _checkin(key, conn)
+    return time.monotonic() - start
+
+
+def _prewarm_loop(parts, key: tuple, entry: dict) -> None:
+    try:
+        while time.monotonic() - entry["touched"] < _PREWARM_WINDOW:
+            try:
+                elapsed = _ensure_warm(parts, key)
+                if elapsed and not entry.get("warm"):
+                    _log(f"Pre-warmed connection to {parts.hostname} in {elapsed:.2f}s")
+                entry["warm"] = True
+            except Exception as e:
+                _log(f"Pre-warm to {parts.hostname} failed: {e}")
+                return
+            time.sleep(_PREWARM_REFRESH)
+    finally:
+        with _prewarm_lock:
+            _prewarmers.pop(key, None)
+
+
+def prewarm_connections(url: str) -> bool:
+    """在后台预先完成到 url 主机的 DNS / TCP / TLS 建连并放入连接池，临近过期时自动刷新
+
+    立即返回；仅对真实网络传输生效。
+    """
+    if get_transport().name != "live":
+        return False
+    parts = urlsplit((url or "").strip())
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    key = _pool_key(parts)
+    with _prewarm_lock:
+        _prewarm_hosts.add(key)
+    _touch_prewarm(parts, key)
+    return True
+
+
+def _touch_prewarm(parts, key: tuple) -> None:
+    """续期预热窗口；预热线程已结束时重新启动"""
+    with _prewarm_lock:
+        entry = _prewarmers.get(key)
+        if entry is not None:
+            entry["touched"] = time.monotonic()
+            return
+        entry = _prewarmers[key] = {"touched": time.monotonic()}
+    threading.Thread(target=_prewarm_loop, args=(parts, key, entry), name="llm-prewarm", daemon=True).start()
+
+
+class LiveTransport:
+    """真实网络请求"""
+
+    name = "live"
+
+    def send(self, method: str, url: str, headers: dict, body: bytes, timeouts: Timeouts, deadline: Deadline,
+             on_chunk=None) -> tuple:
+        return _live_send(method, url, headers, body, timeouts, deadline, on_chunk)
+
+
+TRANSPORT_MODES = ["live", "record", "replay", "auto"]
+
+_transport = None
+
+
+def _transport_from_env():
+    """按环境变量选择传输层：LLM_NODES_TRANSPORT=live|record|replay|auto"""
+    mode = (os.environ.get("LLM_NODES_TRANSPORT") or "live").strip().lower()
+    if mode == "live":
+        return LiveTransport()
+    if mode not in TRANSPORT_MODES:
+        raise Exception(f"Unknown LLM_NODES_TRANSPORT: {mode} (expected one of {', '.join(TRANSPORT_MODES)})")
+    try:
+        from .llm_cassette import CassetteTransport
+    except ImportError:
+        from llm_cassette import CassetteTransport
+    transport = CassetteTransport(mode, os.environ.get("LLM_NODES_CASSETTE_DIR", ""),
+                                  os.environ.get("LLM_NODES_REPLAY_LATENCY", "recorded"), LiveTransport())
+    _log(f"Transport: {mode} ({transport.directory})")
+    return transport
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = _transport_from_env()
+    return _transport
+
+
+def set_transport(transport) -> None:
+    """替换传输层（None 表示按环境变量重新选择）"""
+    global _transport
+    _transport = transport
+
+
+def send(method: str, url: str, headers: dict, body: bytes = None,
+         timeouts: Timeouts = None, deadline: Deadline = None, on_chunk=None) -> tuple:
+    """发送请求，返回 (status, headers, body)；状态码 ≥400 时抛出 HTTPStatusError
+
+    body 可以是 bytes 或可重复迭代的分块序列（如 llm_payload.StreamingBody），后者以分块传输编码发送。
+    on_chunk(bytes) 在成功响应的每段数据到达时调用（如 SSE 流式解析），抛出异常即中止请求。
+    """
+    transport = get_transport()
+    if on_chunk is None:
+        return transport.send(method, url, headers, body, timeouts or Timeouts(), deadline or Deadline())
+    return transport.send(method, url, headers, body, timeouts or Timeouts(), deadline or Deadline(),
+                          on_chunk=on_chunk)
@@ -0,0 +1,179 @@
+"""
+ComfyUI Gemini 多 Key 轮换池
+Spread requests over several API keys to scale past per-key rate limits
+
+- Key 来源：api_key 输入（逗号 / 换行分隔多个）、环境变量、本地 key 文件（每行一个，# 开头为注释）
+- 选择策略：最久未被限流优先，同等条件下按最久未使用轮换（round-robin）
+- 429 按 Retry-After（否则指数递增）冷却，401 / 403 长时间冷却；冷却中的 key 不参与选择
+- 每个 key 的调用 / 限流 / 鉴权失败次数，以 safe_key 脱敏后在 Usage Stats 中展示
+"""
+
+import os
+import re
+import threading
+import time
+
+try:
+    from .llm_http import HTTPStatusError
+except ImportError:
+    from llm_http import HTTPStatusError
+
+
+def _log(msg: str):
+    print(f"[LLM-Keys] {msg}")
+
+
+def safe_key(key: str) -> str:
+    """脱敏显示 key（前后各 3 位）"""
+    k = key or ""
+    if len(k) <= 6:
+        return "***"
+    return f"{k[:3]}***{k[-3:]}"
+
+
+# 冷却时间（秒）：429 基数（连续限流时翻倍）与上限；401 / 403
+_RATE_COOLDOWN = 15
+_MAX_RATE_COOLDOWN = 300
+_AUTH_COOLDOWN = 600
+# 冷却结束后该时间内仍排在其他 key 之后，超过后重新平等参与轮换
+_LIMIT_MEMORY = 300
+
+_SPLIT = re.compile(r"[\s,;]+")
+
+
+def parse_keys(text: str) -> list:
+    """拆分多个 key（逗号 / 分号 / 空白分隔，忽略 # 注释行），保持顺序去重"""
+    keys = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        for k in _SPLIT.split(line):
+            if k and k not in keys:
+                keys.append(k)
+    return keys
+
+
+def resolve_keys(api_key: str = "", api_key_env: str = "", api_key_file: str = "") -> list:
+    """合并节点输入、环境变量与 key 文件中的全部 key"""
+    keys = parse_keys(api_key)
+    if api_key_env.strip():
+        value = os.environ.get(api_key_env.strip(), "")
+        if not value:
+            _log(f"Environment variable {api_key_env.strip()} is empty or not set")
+        keys += [k for k in parse_keys(value) if k not in keys]
+    if api_key_file.strip():
+        path = os.path.expanduser(api_key_file.strip())
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                keys += [k for k in parse_keys(f.read()) if k not in keys]
+        except OSError as e:
+            raise Exception(f"Cannot read key file {path}: {e}")
+    return keys
+
+
+class KeyPool:
+    """线程安全的 key 轮换池"""
+
+    def __init__(self, keys: list):
+        self.keys = list(keys)
+        self._lock = threading.Lock()
+        self._state = {k: {"cooldown_until": 0.0, "last_limited": 0.0, "last_used": 0.0, "streak": 0,
+                           "calls": 0, "rate_limited": 0, "auth_failed": 0} for k in self.keys}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def acquire(self) -> str:
+        """选出下一个 key；全部冷却中时返回最早恢复的那个"""
+        with self._lock:
+            now = time.time()
+            ready = [k for k in self.keys if self._state[k]["cooldown_until"] <= now]
+            if ready:
+                def order(k):
+                    state = self._state[k]
+                    limited = state["last_limited"] if now - state["last_limited"] < _LIMIT_MEMORY else 0.0
+                    return limited, state["last_used"]
+                key = min(ready, key=order)
+            else:
+                key = min(self.keys, key=lambda k: self._state[k]["cooldown_until"])
+                if len(self.keys) > 1:
+                    _log(f"All {len(self.keys)} keys cooling down, using {safe_key(key)} "
+                         f"(ready in {self._state[key]['cooldown_until'] - now:.0f}s)")
+            state = self._state[key]
+            state["last_used"] = now
+            state["calls"] += 1
+            return key
+
+    def available(self) -> bool:
+        """是否还有未冷却的 key"""
+        with self._lock:
+            now = time.time()
+            return any(s["cooldown_until"] <= now for s in self._state.values())
+
+    def report(self, key: str, error: Exception = None) -> bool:
+        """上报调用结果；key 被限流 / 鉴权失败时进入冷却并返回 True"""
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                return False
+            code = error.code if isinstance(error, HTTPStatusError) else None
+            if code == 429:
+                state["rate_limited"] += 1
+                state["streak"] += 1
+                retry_after = {k.lower(): v for k, v in error.headers.items()}.get("retry-after", "")
+                try:
+                    cooldown = float(retry_after)
+                except ValueError:
+                    cooldown = min(_RATE_COOLDOWN * 2 ** (state["streak"] - 1), _MAX_RATE_COOLDOWN)
+                state["last_limited"] = time.time()
+                state["cooldown_until"] = time.time() + cooldown
+                _log(f"Key {safe_key(key)} rate limited, cooling down {cooldown:.0f}s")
+                return True
+            if code in (401, 403):
+                state["auth_failed"] += 1
+                state["last_limited"] = time.time()
+                state["cooldown_until"] = time.time() + _AUTH_COOLDOWN
+                _log(f"Key {safe_key(key)} rejected (HTTP {code}), disabled for {_AUTH_COOLDOWN}s")
+                return True
+            if error is None:
+                state["streak"] = 0
+            return False
+
+    def stats(self) -> list:
+        """每个 key 的脱敏统计行"""
+        with self._lock:
+            now = time.time()
+            lines = []
+            for k in self.keys:
+                s = self._state[k]
+                cooling = s["cooldown_until"] - now
+                status = f"cooling {cooling:.0f}s" if cooling > 0 else "ready"
+                lines.append(f"{safe_key(k)}: calls={s['calls']} rate_limited={s['rate_limited']} "
+                             f"auth_failed={s['auth_failed']} {status}")
+            return lines
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def key_pool(config: dict) -> KeyPool:
+    """按 key 集合共享的轮换池（同一组 key 的所有节点共用冷却状态）"""
+    keys = config.get("api_keys") or parse_keys(config.get("api_key", ""))
+    with _pools_lock:
+        pool = _pools.get(tuple(keys))
+        if pool is None:
+            pool = _pools[tuple(keys)] = KeyPool(keys)
+        return pool
+
+
+def pool_report() -> str:
+    """全部多 key 池的统计文本；只有单个 key 时为空"""
+    with _pools_lock:
+        pools = [p for p in _pools.values() if len(p) > 1]
+    lines = []
+    for i, pool in enumerate(pools):
+        lines.append(f"key pool {i + 1} ({len(pool)} keys):")
+        lines += [f"  {line}" for line in pool.stats()]
+    return "\n".join(lines)
@@ -0,0 +1,166 @@
+"""
+ComfyUI Gemini 文件输出
+File-backed image outputs: write provider bytes to disk, decode to tensors only on demand
+
+- 响应中的 data URL 按块 base64 解码并直接写入输出目录，不经过 PIL / 张量，也不重新编码
+- 文件名沿用 ComfyUI SaveImage 的 <prefix>_<counter>_.<ext> 规则，prefix 可含子目录
+- ImageFiles 句柄只保存路径，下游需要像素时再按需加载为 [N,H,W,3] 张量
+"""
+
+import base64
+import os
+import re
+import threading
+
+import numpy as np
+import torch
+from PIL import Image
+
+try:
+    import folder_paths  # ComfyUI 运行时提供
+except ImportError:
+    folder_paths = None
+
+
+def _log(msg: str):
+    print(f"[LLM-Output] {msg}")
+
+
+# 每次解码的 base64 字符数（4 的倍数），峰值额外内存约为其 3/4
+_DECODE_CHUNK = 4 * (1 << 18)
+
+_EXTS = {"image/png": "png", "image/jpeg": "jpg", "image/jpg": "jpg", "image/webp": "webp", "image/gif": "gif"}
+
+_counter_lock = threading.Lock()
+
+
+def output_root() -> str:
+    """ComfyUI 输出目录；独立运行时为插件目录下 output/"""
+    if folder_paths is not None and hasattr(folder_paths, "get_output_directory"):
+        return folder_paths.get_output_directory()
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "output")
+
+
+def image_urls(res: dict) -> list:
+    """从 /chat/completions 响应中取出图像 URL（兼容字符串 / {url} / {image_url: {url}} 三种格式）"""
+    if "error" in res:
+        raise Exception(res.get("error", {}).get("message", "image generation failed"))
+    if not res.get("choices"):
+        raise Exception(f"empty response: {str(res)[:200]}")
+    message = res["choices"][0].get("message", {})
+    images = message.get("images", [])
+    if not images and message.get("content"):
+        raise Exception("Model returned text instead of image. Use simpler image description.")
+
+    urls = []
+    for item in images:
+        if isinstance(item, dict):
+            item = item.get("url") or item.get("image_url", "")
+            if isinstance(item, dict):
+                item = item.get("url", "")
+        if isinstance(item, str) and item.startswith("data:image/"):
+            urls.append(item)
+    return urls
+
+
+def _split_data_url(url: str) -> tuple:
+    header, _, b64 = url.partition(",")
+    mime = header[5:].split(";", 1)[0].lower()
+    return mime, b64
+
+
+def _next_counter(directory: str, name: str) -> int:
+    pattern = re.compile(rf"^{re.escape(name)}_(\d+)_\.")
+    counter = 0
+    for entry in os.listdir(directory):
+        m = pattern.match(entry)
+        if m:
+            counter = max(counter, int(m.group(1)))
+    return counter + 1
+
+
+def output_dir(prefix: str) -> tuple:
+    """解析 filename_prefix，返回 (目录, 文件名前缀, 子目录)；不允许跳出输出目录"""
+    root = os.path.abspath(output_root())
+    subfolder, name = os.path.split(os.path.normpath(prefix or "LLM"))
+    directory = os.path.abspath(os.path.join(root, subfolder))
+    if not name or os.path.commonpath([directory, root]) != root:
+        raise Exception(f"filename_prefix must stay inside the output directory: {prefix}")
+    return directory, name, subfolder
+
+
+def _open_output(prefix: str, ext: str) -> tuple:
+    """按 ComfyUI 命名规则独占创建下一个输出文件，返回 (文件对象, 路径, 子目录)"""
+    directory, name, subfolder = output_dir(prefix)
+    os.makedirs(directory, exist_ok=True)
+    with _counter_lock:
+        counter = _next_counter(directory, name)
+        while True:
+            path = os.path.join(directory, f"{name}_{counter:05}_.{ext}")
+            try:
+                return open(path, "xb"), path, subfolder
+            except FileExistsError:
+                counter += 1
+
+
+def write_data_url(url: str, prefix: str) -> tuple:
+    """data URL → 输出文件（分块解码写入，原始编码字节不变），返回 (路径, 子目录)"""
+    mime, b64 = _split_data_url(url)
+    if any(c in b64[:1024] for c in "\r\n "):
+        b64 = "".join(b64.split())
+    f, path, subfolder = _open_output(prefix, _EXTS.get(mime, mime.split("/")[-1] or "bin"))
+    try:
+        with f:
+            for start in range(0, len(b64), _DECODE_CHUNK):
+                f.write(base64.b64decode(b64[start:start + _DECODE_CHUNK]))
+    except Exception:
+        os.remove(path)
+        raise
+    return path, subfolder
+
+
+class ImageFiles:
+    """文件形式的图像批次（LLM_IMAGE_FILES），按需解码为张量"""
+
+    def __init__(self, paths: list, subfolders: list = None):
+        self.paths = list(paths)
+        self.subfolders = list(subfolders or [""] * len(self.paths))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def ui(self) -> list:
+        """ComfyUI 预览条目（去重，n > 1 的重复项只显示一次）"""
+        seen, items = set(), []
+        for path, subfolder in zip(self.paths, self.subfolders):
+            if path not in seen:
+                seen.add(path)
+                items.append({"filename": os.path.basename(path), "subfolder": subfolder, "type": "output"})
+        return items
+
+    def load(self, index: int = -1):
+        """解码为 [N,H,W,3] float 张量；index ≥ 0 时只加载该张"""
+        paths = self.paths if index < 0 else [self.paths[index % len(self.paths)]]
+        frames = []
+        for path in paths:
+            with Image.open(path) as img:
+                frames.append(torch.from_numpy(np.array(img.convert("RGB"))))
+        if len({f.shape for f in frames}) > 1:
+            raise Exception("Images have different sizes, load them one at a time with index")
+        return torch.stack(frames).float().div_(255.0)
+
+
+def save_response_images(res: dict, prefix: str, n: int = 1) -> ImageFiles:
+    """把响应中的图像写入输出目录（n > 1 时重复引用第一张，与张量输出一致）"""
+    paths, subfolders = [], []
+    for url in image_urls(res):
+        path, subfolder = write_data_url(url, prefix)
+        paths.append(path)
+        subfolders.append(subfolder)
+    if not paths:
+        raise Exception("Failed to process any images")
+    for _ in range(n - 1):
+        paths.append(paths[0])
+        subfolders.append(subfolders[0])
+    _log(f"Saved {len(set(paths))} image(s) to {os.path.dirname(paths[0])}")
+    return ImageFiles(paths, subfolders)
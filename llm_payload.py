@@ -0,0 +1,432 @@
+"""
+ComfyUI Gemini 参考图像编码与载荷预算
+Reference image encoding + preflight payload budgeting (shared by LiteLLM / OpenRouter nodes)
+
+- 收集多路图像输入（批次逐张展开）
+- 发送前估算编码后大小与图像 token 开销
+- 超出预算时逐步降采样 / JPEG 重压缩，预算无法满足时立即失败
+- 长图像批次（视频帧）按数量 / 步长 / 场景切换采样，并用批量 dHash 去除近似重复帧
+- 流式上传：图像在后台并行编码，请求体以分块传输逐段发送，上传第 k 张的同时编码第 k+1 张
+"""
+
+import base64
+import json
+import math
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+try:
+    from .llm_http import check_interrupt
+except ImportError:
+    from llm_http import check_interrupt
+
+
+def _log(msg: str):
+    print(f"[LLM-Payload] {msg}")
+
+
+# Gemini 图像 token 估算：两边均 ≤384 计 258 tokens，否则按 768x768 分块，每块 258 tokens
+_TOKENS_PER_TILE = 258
+_TILE = 768
+_SMALL_SIDE = 384
+
+# 降采样下限（最短边像素），低于此值视为预算无法满足
+_MIN_SIDE = 256
+_SCALE_STEP = 0.75
+_JPEG_QUALITIES = (90, 80, 70)
+
+# 每个 image_url 内容块的 JSON 包装开销（估算）
+_PART_OVERHEAD = 64
+
+FRAME_SAMPLING_MODES = ["all", "count", "stride", "scene_change"]
+
+# 场景切换判定：与上一保留帧的 dHash 汉明距离（64 位）超过该值
+_SCENE_DISTANCE = 12
+# 计算 dHash 时每批处理的帧数（限制灰度图中间结果的显存/内存占用）
+_HASH_CHUNK = 16
+
+
+def collect_images(image_inputs) -> list:
+    """收集多路图像输入，批次逐张展开"""
+    image_list = []
+    for img in image_inputs:
+        if img is None:
+            continue
+        if len(img.shape) == 3:
+            image_list.append(img)
+        else:
+            for i in range(img.shape[0]):
+                image_list.append(img[i])
+    return image_list
+
+
+def tensor_to_pil(img_tensor) -> Image.Image:
+    """[H,W,C] float 张量 → PIL 图像"""
+    img_np = (img_tensor.cpu().numpy() * 255).astype(np.uint8)
+    return Image.fromarray(img_np)
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """估算单张图像的输入 token 数"""
+    if width <= _SMALL_SIDE and height <= _SMALL_SIDE:
+        return _TOKENS_PER_TILE
+    return math.ceil(width / _TILE) * math.ceil(height / _TILE) * _TOKENS_PER_TILE
+
+
+def b64_size(n: int) -> int:
+    """n 字节数据 base64 编码后的长度"""
+    return 4 * ((n + 2) // 3)
+
+
+def encode_image(pil_img: Image.Image, fmt: str = "PNG", quality: int = 90) -> bytes:
+    """编码为 PNG / JPEG 字节（每次编码前响应中断，取消后跳过剩余图像）"""
+    check_interrupt()
+    buffered = BytesIO()
+    if fmt == "JPEG":
+        if pil_img.mode != "RGB":
+            pil_img = pil_img.convert("RGB")
+        pil_img.save(buffered, format="JPEG", quality=quality)
+    else:
+        pil_img.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def image_part(data: bytes, mime: str = "image/png") -> dict:
+    """生成 image_url 内容块（data URL）"""
+    img_b64 = base64.b64encode(data).decode()
+    return {
+        "type": "image_url",
+        "image_url": {"url": f"data:{mime};base64,{img_b64}"}
+    }
+
+
+def _scaled(pil_img: Image.Image, scale: float) -> Image.Image:
+    if scale >= 1.0:
+        return pil_img
+    w, h = pil_img.size
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return pil_img.resize(size, Image.LANCZOS)
+
+
+def _scaled_dims(pil_img: Image.Image, scale: float) -> tuple:
+    w, h = pil_img.size
+    s = min(scale, 1.0)
+    return max(1, round(w * s)), max(1, round(h * s))
+
+
+def _total_tokens(pils: list, scale: float) -> int:
+    return sum(estimate_image_tokens(*_scaled_dims(p, scale)) for p in pils)
+
+
+def _min_side(pils: list, scale: float) -> int:
+    return min(min(_scaled_dims(p, scale)) for p in pils)
+
+
+def _impossible(reason: str, pils: list):
+    sizes = ", ".join(f"{p.size[0]}x{p.size[1]}" for p in pils)
+    raise Exception(
+        f"Payload budget cannot be met: {reason} "
+        f"({len(pils)} reference image(s): {sizes}; min side {_MIN_SIDE}px). "
+        f"Raise max_payload_mb / max_image_tokens or attach fewer references."
+    )
+
+
+def _token_scale(pils: list, max_tokens: int) -> float:
+    """token 预算只取决于尺寸，无需编码即可确定缩放比例"""
+    n_small = len(pils) * _TOKENS_PER_TILE
+    if n_small > max_tokens:
+        _impossible(f"{len(pils)} images need at least {n_small} tokens > max_image_tokens={max_tokens}", pils)
+    scale = 1.0
+    while _total_tokens(pils, scale) > max_tokens:
+        scale *= _SCALE_STEP
+        if _min_side(pils, scale) < _MIN_SIDE:
+            _impossible(f"image tokens exceed max_image_tokens={max_tokens}", pils)
+    if scale < 1.0:
+        _log(f"Token budget: scaled references to {scale:.2f}x ({_total_tokens(pils, scale)} tokens)")
+    return scale
+
+
+def build_image_parts(image_list: list, max_bytes: int = 0, max_tokens: int = 0,
+                      reserved_bytes: int = 0, make_part=image_part) -> list:
+    """编码参考图像为内容块（发送前预算检查）
+
+    max_bytes / max_tokens 为 0 表示不限制。先按 token 预算统一缩放，
+    再依次尝试 PNG、JPEG 90/80/70，仍超出则按面积比例继续降采样。
+    make_part(data, mime) 决定内容块形式（默认 data URL 内联）。
+    image_list 可以是 [H,W,C] 张量或 PIL 图像。
+    """
+    if not image_list:
+        return []
+
+    pils = [t if isinstance(t, Image.Image) else tensor_to_pil(t) for t in image_list]
+    scale = 1.0
+
+    if max_tokens:
+        scale = _token_scale(pils, max_tokens)
+
+    if not max_bytes:
+        return [make_part(encode_image(_scaled(p, scale)), "image/png") for p in pils]
+
+    budget = max_bytes - reserved_bytes
+    if budget <= len(pils) * _PART_OVERHEAD:
+        _impossible(f"text alone uses {reserved_bytes} of {max_bytes} bytes", pils)
+
+    candidates = [("PNG", None)] + [("JPEG", q) for q in _JPEG_QUALITIES]
+    while True:
+        resized = [_scaled(p, scale) for p in pils]
+        total = 0
+        for fmt, quality in candidates:
+            encoded = [encode_image(r, fmt, quality) for r in resized]
+            total = sum(b64_size(len(e)) + _PART_OVERHEAD for e in encoded)
+            if total <= budget:
+                if fmt != "PNG" or scale < 1.0:
+                    _log(f"Byte budget: {fmt}{'' if quality is None else f' q{quality}'} "
+                         f"at {scale:.2f}x, {total} / {budget} bytes")
+                mime = "image/jpeg" if fmt == "JPEG" else "image/png"
+                return [make_part(e, mime) for e in encoded]
+
+        # 编码大小近似与面积成正比，按比例估算下一级缩放
+        scale *= min(_SCALE_STEP, math.sqrt(budget / total) * 0.95)
+        candidates = [("JPEG", _JPEG_QUALITIES[0]), ("JPEG", _JPEG_QUALITIES[-1])]
+        if _min_side(pils, scale) < _MIN_SIDE:
+            _impossible(f"encoded size {total} bytes exceeds budget {budget} bytes", pils)
+
+
+def budget_from_config(config: dict) -> tuple:
+    """从节点配置读取 (max_bytes, max_tokens) 预算，0 表示不限制
+
+    参考图像经 files_api / url 上传时不在请求体内，只保留 token 预算，不再为字节预算重压缩。
+    """
+    inline = (config.get("reference_upload", "inline") or "inline") == "inline"
+    max_mb = float(config.get("max_payload_mb", 0) or 0) if inline else 0
+    return int(max_mb * 1024 * 1024), int(config.get("max_image_tokens", 0) or 0)
+
+
+# ============ 流式上传 ============
+
+# 后台编码线程数（PNG 编码主要耗时在 zlib，会释放 GIL）
+_ENCODE_WORKERS = min(4, os.cpu_count() or 1)
+# 每个分块的原始字节数（3 的倍数，分段 base64 可直接拼接）
+_STREAM_CHUNK = 3 * (1 << 16)
+# 等待编码结果时检查中断 / 截止时间的间隔（秒）
+_STREAM_POLL = 0.2
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def _encode_pool() -> ThreadPoolExecutor:
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = ThreadPoolExecutor(max_workers=_ENCODE_WORKERS, thread_name_prefix="llm-encode")
+        return _encoder
+
+
+class PayloadOverflow(Exception):
+    """流式发送途中编码结果超出字节预算（调用方改用预先编码的请求体重试）"""
+
+
+class PendingImage:
+    """后台编码中的参考图像，在请求体中占据一个 data URL 的位置"""
+
+    def __init__(self, pil_img: Image.Image, max_bytes: int = 0):
+        self.pil = pil_img
+        self.max_bytes = max_bytes
+        self.future = _encode_pool().submit(encode_image, pil_img)
+
+    def result(self, deadline=None) -> bytes:
+        while not wait([self.future], timeout=_STREAM_POLL).done:
+            check_interrupt()
+            if deadline is not None:
+                deadline.check("encoding")
+        return self.future.result()
+
+    def cancel(self) -> None:
+        self.future.cancel()
+
+
+def stream_image_parts(image_list: list, max_bytes: int = 0, max_tokens: int = 0) -> list:
+    """参考图像 → 内容块，编码在后台进行，不等待结果
+
+    token 预算照常预先缩放；字节预算在发送时逐张检查（编码前无法得知大小），
+    超出时抛出 PayloadOverflow。只用于 inline 模式的 PNG data URL。
+    """
+    if not image_list:
+        return []
+    pils = [t if isinstance(t, Image.Image) else tensor_to_pil(t) for t in image_list]
+    scale = _token_scale(pils, max_tokens) if max_tokens else 1.0
+    return [{"type": "image_url", "image_url": {"url": PendingImage(_scaled(p, scale), max_bytes)}}
+            for p in pils]
+
+
+class StreamingBody:
+    """分块传输的请求体：JSON 片段与图像 base64 交替产出，每张图像编码完成即可发送
+
+    可重复迭代（编码结果已缓存），复用连接失效时可以重发。
+    """
+
+    _PREFIX = b"data:image/png;base64,"
+
+    def __init__(self, segments: list, images: list, deadline=None):
+        self.segments = segments
+        self.images = images
+        self.deadline = deadline
+        self.max_bytes = min((i.max_bytes for i in images if i.max_bytes), default=0)
+
+    def __iter__(self):
+        sent = 0
+        tail = sum(len(s) for s in self.segments)
+        for i, segment in enumerate(self.segments):
+            sent += len(segment)
+            tail -= len(segment)
+            yield segment
+            if i == len(self.images):
+                break
+            data = self.images[i].result(self.deadline)
+            size = len(self._PREFIX) + b64_size(len(data))
+            if self.max_bytes and sent + size + tail > self.max_bytes:
+                for image in self.images[i + 1:]:
+                    image.cancel()
+                raise PayloadOverflow(f"streamed body exceeds {self.max_bytes} bytes at image {i + 1}")
+            sent += size
+            yield self._PREFIX
+            for start in range(0, len(data), _STREAM_CHUNK):
+                yield base64.b64encode(data[start:start + _STREAM_CHUNK])
+
+
+def settle_payload(data: dict) -> int:
+    """流式上传失败（超出字节预算 / 端点不接受分块）后改为预先编码
+
+    原地把 PendingImage 内容块替换为按字节预算编码的 data URL（token 缩放已生效），
+    返回替换的图像数；没有待编码图像时返回 0。
+    """
+    slots = []
+    for msg in data.get("messages", []):
+        for part in msg.get("content") if isinstance(msg.get("content"), list) else []:
+            if isinstance(part, dict) and isinstance((part.get("image_url") or {}).get("url"), PendingImage):
+                slots.append(part)
+    if not slots:
+        return 0
+    pending = [part["image_url"]["url"] for part in slots]
+    for image in pending:
+        image.cancel()
+    max_bytes = min((i.max_bytes for i in pending if i.max_bytes), default=0)
+    reserved = len(json.dumps(data, default=lambda o: "").encode())
+    parts = build_image_parts([i.pil for i in pending], max_bytes, 0, reserved)
+    for slot, part in zip(slots, parts):
+        slot.clear()
+        slot.update(part)
+    return len(slots)
+
+
+def encode_body(data: dict, deadline=None):
+    """请求体序列化：含 PendingImage 时返回 StreamingBody（分块传输），否则返回 bytes"""
+    if not data:
+        return None
+    images = []
+    token = uuid.uuid4().hex
+
+    def placeholder(obj):
+        if isinstance(obj, PendingImage):
+            images.append(obj)
+            return token
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    text = json.dumps(data, default=placeholder)
+    if not images:
+        return text.encode()
+    # 占位符位于 JSON 字符串引号之间，按占位符切分后在各段之间插入 data URL
+    return StreamingBody([s.encode() for s in text.split(token)], images, deadline)
+
+
+def dhash_batch(batch) -> np.ndarray:
+    """批量 dHash：[N,H,W,C] 张量 → [N,64] bool，在张量所在设备上向量化计算"""
+    out = []
+    for start in range(0, batch.shape[0], _HASH_CHUNK):
+        chunk = batch[start:start + _HASH_CHUNK, :, :, :3].float()
+        gray = chunk.mean(dim=-1)[:, None]
+        small = F.interpolate(gray, size=(8, 9), mode="area")[:, 0]
+        bits = small[:, :, 1:] > small[:, :, :-1]
+        out.append(bits.reshape(bits.shape[0], -1).cpu().numpy())
+    return np.concatenate(out)
+
+
+def _even(idx: np.ndarray, n: int) -> np.ndarray:
+    """从 idx 中均匀取 n 个"""
+    if n <= 0 or len(idx) <= n:
+        return idx
+    return idx[np.unique(np.linspace(0, len(idx) - 1, n).round().astype(int))]
+
+
+def select_frames(image_inputs, mode: str = "all", max_frames: int = 0, stride: int = 1,
+                  dedup_distance: int = 0) -> list:
+    """选出需要发送的最少图像集合
+
+    - 同一图像接入多个 image_N 时只保留一份
+    - mode: all / count（均匀取 max_frames 帧）/ stride（每 stride 帧取一帧）/ scene_change
+    - dedup_distance > 0 时丢弃与已保留帧 dHash 距离 ≤ 该值的近似重复帧
+    - max_frames > 0 时最终结果再均匀截断到该数量
+    """
+    batches = []
+    for img in image_inputs:
+        if img is None:
+            continue
+        if len(img.shape) == 3:
+            img = img[None]
+        if any(b is img or (b.shape == img.shape and torch.equal(b, img)) for b in batches):
+            _log("Skipped duplicate image input")
+            continue
+        batches.append(img)
+    if not batches:
+        return []
+
+    frames = [b[i] for b in batches for i in range(b.shape[0])]
+    total = len(frames)
+    if mode == "all" and not dedup_distance and not max_frames:
+        return frames
+
+    idx = np.arange(total)
+    if mode == "stride":
+        idx = idx[::max(1, stride)]
+    elif mode == "count":
+        idx = _even(idx, max_frames)
+
+    if mode == "scene_change" or dedup_distance > 0:
+        hashes = np.concatenate([dhash_batch(b) for b in batches])[idx]
+        keep = []
+        for i in range(len(idx)):
+            if not keep:
+                keep.append(i)
+                continue
+            if mode == "scene_change" and np.count_nonzero(hashes[i] != hashes[keep[-1]]) <= _SCENE_DISTANCE:
+                continue
+            if dedup_distance > 0:
+                # 与所有已保留帧一次性比较
+                dist = np.count_nonzero(hashes[keep] != hashes[i], axis=1)
+                if dist.min() <= dedup_distance:
+                    continue
+            keep.append(i)
+        idx = idx[keep]
+
+    idx = _even(idx, max_frames)
+    if len(idx) < total:
+        _log(f"Frame selection ({mode}): {total} → {len(idx)} image(s)")
+    return [frames[i] for i in idx]
+
+
+def frame_options_from_config(config: dict) -> dict:
+    """从节点配置读取帧采样参数"""
+    return {
+        "mode": config.get("frame_sampling", "all") or "all",
+        "max_frames": int(config.get("max_frames", 0) or 0),
+        "stride": int(config.get("frame_stride", 1) or 1),
+        "dedup_distance": int(config.get("dedup_distance", 0) or 0),
+    }
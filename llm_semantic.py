@@ -0,0 +1,297 @@
+"""
+ComfyUI Gemini 语义响应缓存
+Semantic response cache for near-duplicate text-only chat prompts
+
+- 提示词向量化：端点的 /embeddings（embedding_model），按相似度阈值复用回答
+- 未设置 embedding_model 时只复用规范化后（大小写 / 空白）完全相同的提示词：本地哈希 n-gram 向量只反映字面重合，
+  “Do NOT write …” 与 “Write …” 相似度也很高，不能用来判断语义相同
+- 命名空间：api_base + model + 采样参数 + 输出格式 + system + 向量模型，只在完全相同的调用配置内复用回答
+- 每个命名空间一个 float16 向量矩阵（.npy）+ 条目元数据（JSON），查询为一次向量化余弦相似度计算
+- 超过条目上限时按最久未命中淘汰，长期未命中的条目过期；命中率等统计在 Usage Stats 中展示
+- 只缓存纯文本请求（带参考图像的请求直接跳过）
+"""
+
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+try:
+    from .llm_cache import cache_dir, content_hash, write_json_atomic
+    from .llm_http import send, Timeouts, Deadline, DeadlineExceeded, Interrupted
+    from .llm_keys import key_pool
+    from .llm_usage import record_call
+except ImportError:
+    from llm_cache import cache_dir, content_hash, write_json_atomic
+    from llm_http import send, Timeouts, Deadline, DeadlineExceeded, Interrupted
+    from llm_keys import key_pool
+    from llm_usage import record_call
+
+
+def _log(msg: str):
+    print(f"[LLM-Semantic] {msg}")
+
+
+DEFAULT_THRESHOLD = 0.92
+
+# 本地向量维度
+_LOCAL_DIM = 512
+# 每个命名空间的条目上限与过期时间（按最后命中 / 写入时间）
+_MAX_ENTRIES = 5000
+_ENTRY_TTL = 14 * 86400
+# 命中后元数据（命中次数 / 时间）最多每隔该时间写盘一次
+_SAVE_INTERVAL = 30
+
+# 决定回答是否可复用的调用参数
+_NAMESPACE_KEYS = ("api_base", "model", "temperature", "max_tokens", "response_format", "json_schema")
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0, "errors": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _stats_lock:
+        _stats[name] += n
+
+
+def normalize_prompt(text: str) -> str:
+    """小写 + 合并空白，只有空白 / 大小写不同的提示词视为完全相同"""
+    return " ".join((text or "").lower().split())
+
+
+def local_embedding(text: str) -> np.ndarray:
+    """本地哈希 n-gram 向量（词、相邻词对、字符 3-gram，带符号哈希到固定维度后 L2 归一化）
+
+    只反映字面重合，不代表语义；未设置 embedding_model 时仅用于存储，查询为精确匹配。
+    """
+    words = _WORD.findall(normalize_prompt(text))
+    joined = f" {' '.join(words)} "
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    grams = [joined[i:i + 3] for i in range(len(joined) - 2)]
+    vec = np.zeros(_LOCAL_DIM, dtype=np.float32)
+    for weight, items in ((1.0, features), (0.5, grams)):
+        for item in items:
+            h = zlib.crc32(item.encode("utf-8"))
+            vec[h % _LOCAL_DIM] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def remote_embedding(config: dict, model: str, text: str, timeouts: Timeouts = None,
+                     deadline: Deadline = None) -> np.ndarray:
+    """调用端点的 /embeddings，返回 L2 归一化向量（计入节点的截止时间，key 从轮换池中取用并上报结果）"""
+    base = (config.get("api_base") or "").strip().rstrip("/")
+    url = f"{base}/embeddings"
+    payload = {"model": model, "input": [normalize_prompt(text)]}
+    keys = key_pool(config)
+    api_key = keys.acquire()
+    headers = {
+        "Authorization": f"Bearer {(api_key or '').strip()}",
+        "Content-Type": "application/json",
+        "User-Agent": "ComfyUI",
+    }
+    start = time.time()
+    try:
+        _, resp_headers, raw = send("POST", url, headers, json.dumps(payload).encode(),
+                                    timeouts or Timeouts(connect=10, idle=30), deadline or Deadline(60))
+    except Exception as e:
+        keys.report(api_key, e)
+        raise
+    keys.report(api_key)
+    res = json.loads(raw.decode())
+    record_call(url, payload, res, resp_headers, time.time() - start, config.get("workflow_tag", ""))
+    vec = np.asarray(res["data"][0]["embedding"], dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class SemanticIndex:
+    """单个命名空间的向量索引（线程安全，懒加载，原子写盘）"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._entries = None
+        self._saved_at = 0.0
+
+    def _paths(self) -> tuple:
+        return os.path.join(self.directory, "vectors.npy"), os.path.join(self.directory, "entries.json")
+
+    def _load(self) -> None:
+        if self._entries is not None:
+            return
+        vectors_path, entries_path = self._paths()
+        self._vectors, self._entries = None, []
+        try:
+            with open(entries_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            vectors = np.load(vectors_path)
+            if len(entries) == vectors.shape[0]:
+                self._vectors, self._entries = vectors, entries
+            else:
+                _log(f"Index {self.directory} is inconsistent, starting empty")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            _log(f"Ignoring unreadable index {self.directory}: {e}")
+        # 清理过期条目
+        now = time.time()
+        keep = [i for i, e in enumerate(self._entries) if now - e.get("last_used", 0) < _ENTRY_TTL]
+        if len(keep) < len(self._entries):
+            _count("evicted", len(self._entries) - len(keep))
+            self._take(keep)
+
+    def _take(self, keep: list) -> None:
+        self._entries = [self._entries[i] for i in keep]
+        self._vectors = self._vectors[keep] if self._entries else None
+
+    def _save(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        vectors_path, entries_path = self._paths()
+        if self._vectors is not None:
+            tmp = f"{vectors_path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, self._vectors)
+            os.replace(tmp, vectors_path)
+        write_json_atomic(entries_path, self._entries)
+        self._saved_at = time.time()
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def search(self, vec: np.ndarray, normalized: str, threshold: float, exact: bool = False):
+        """返回 (回答, 相似度)；未达到阈值时回答为 None；exact 时只匹配规范化后完全相同的提示词"""
+        with self._lock:
+            self._load()
+            if not self._entries:
+                return None, 0.0
+            if exact:
+                matches = [i for i, e in enumerate(self._entries) if e.get("normalized") == normalized]
+                if not matches:
+                    return None, 0.0
+                entry, score = self._entries[matches[-1]], 1.0
+            else:
+                if self._vectors.shape[1] != vec.shape[0]:
+                    return None, 0.0
+                sims = self._vectors.astype(np.float32) @ vec
+                best = int(np.argmax(sims))
+                score = float(sims[best])
+                entry = self._entries[best]
+                if entry.get("normalized") == normalized:
+                    score = 1.0
+                if score < threshold:
+                    return None, score
+            entry["hits"] = entry.get("hits", 0) + 1
+            entry["last_used"] = time.time()
+            if time.time() - self._saved_at > _SAVE_INTERVAL:
+                self._save()
+            return entry["answer"], score
+
+    def add(self, vec: np.ndarray, prompt: str, answer: str) -> None:
+        with self._lock:
+            self._load()
+            if self._vectors is not None and self._vectors.shape[1] != vec.shape[0]:
+                # 向量维度变化（换了向量模型但命名空间相同），旧索引作废
+                self._vectors, self._entries = None, []
+            if len(self._entries) >= _MAX_ENTRIES:
+                order = np.argsort([e.get("last_used", 0) for e in self._entries])
+                drop = len(self._entries) - _MAX_ENTRIES + 1
+                _count("evicted", drop)
+                self._take(sorted(order[drop:].tolist()))
+            now = time.time()
+            self._entries.append({"prompt": prompt, "normalized": normalize_prompt(prompt), "answer": answer,
+                                  "created": now, "last_used": now, "hits": 0})
+            row = vec.astype(np.float16)[None]
+            self._vectors = row if self._vectors is None else np.concatenate([self._vectors, row])
+            self._save()
+
+
+def _index(namespace: str) -> SemanticIndex:
+    with _indexes_lock:
+        index = _indexes.get(namespace)
+        if index is None:
+            index = _indexes[namespace] = SemanticIndex(os.path.join(cache_dir("semantic"), namespace))
+        return index
+
+
+def namespace_of(config: dict, system: str = "") -> str:
+    """同一命名空间内的回答可互相复用"""
+    parts = [config.get(k) for k in _NAMESPACE_KEYS]
+    parts += [(system or "").strip(), config.get("embedding_model", "") or "local"]
+    return content_hash(json.dumps(parts, sort_keys=True, default=str).encode())[:24]
+
+
+class CacheProbe:
+    """一次调用的缓存查询结果；answer 为 None 表示未命中，成功后调用 store 写入"""
+
+    def __init__(self, config: dict, prompt: str, system: str = "", timeouts: Timeouts = None,
+                 deadline: Deadline = None):
+        self.config = config
+        self.prompt = prompt
+        self.threshold = float(config.get("semantic_threshold", DEFAULT_THRESHOLD) or DEFAULT_THRESHOLD)
+        self.index = _index(namespace_of(config, system))
+        self.answer = None
+        self.vector = None
+        model = (config.get("embedding_model") or "").strip()
+        try:
+            self.vector = remote_embedding(config, model, prompt, timeouts, deadline) if model else local_embedding(prompt)
+        except (DeadlineExceeded, Interrupted):
+            raise
+        except Exception as e:
+            # 向量化失败时本次不使用缓存，请求照常发送
+            _count("errors")
+            _log(f"Embedding failed, bypassing cache: {e}")
+            return
+        # 本地向量不代表语义，只做精确匹配
+        self.answer, score = self.index.search(self.vector, normalize_prompt(prompt), self.threshold, exact=not model)
+        if self.answer is not None:
+            _count("hits")
+            _log(f"Cache hit (similarity {score:.3f} >= {self.threshold})")
+        else:
+            _count("misses")
+
+    def store(self, answer: str) -> None:
+        if self.vector is None or not answer:
+            return
+        try:
+            self.index.add(self.vector, self.prompt, answer)
+            _count("stored")
+        except Exception as e:
+            _count("errors")
+            _log(f"Failed to store cache entry: {e}")
+
+
+def semantic_probe(config: dict, prompt: str, system: str = "", images=(), timeouts: Timeouts = None,
+                   deadline: Deadline = None):
+    """按配置查询语义缓存；未开启、提示词为空或带参考图像时返回 None"""
+    if not config.get("semantic_cache") or not (prompt or "").strip():
+        return None
+    if any(img is not None for img in images):
+        return None
+    return CacheProbe(config, prompt, system, timeouts, deadline)
+
+
+def semantic_report() -> str:
+    """本进程的语义缓存统计；未使用时为空"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    if not lookups and not stats["errors"]:
+        return ""
+    with _indexes_lock:
+        indexes = list(_indexes.values())
+    entries = sum(len(i) for i in indexes)
+    return (f"semantic cache: hits={stats['hits']} misses={stats['misses']} "
+            f"hit_rate={stats['hits'] / max(lookups, 1):.1%} stored={stats['stored']} evicted={stats['evicted']} "
+            f"entries={entries} ({len(indexes)} namespaces) errors={stats['errors']}")
@@ -0,0 +1,427 @@
+"""
+ComfyUI Gemini 结构化输出
+Structured JSON output: response_format, incremental parsing of streamed answers, local repair and schema validation
+
+- response_format: text（默认）/ json_object / json_schema（json_schema 为 JSON Schema 文本）
+- JSON 模式默认以 SSE 流式请求，边接收边扫描：顶层字段一完成即解析并按 schema 校验，
+  回答不是 JSON、结构错乱或字段不符合 schema 时立即断开连接（不再为剩余 token 付费），由重试机制重新请求
+- 回答完成后先在本地修复常见问题（代码围栏、前后说明文字、尾随逗号、max_tokens 截断）再整体校验，修复成功则不重新请求
+- 端点忽略 stream 直接返回完整 JSON 时按普通响应处理
+"""
+
+import json
+import re
+
+RESPONSE_FORMATS = ["text", "json_object", "json_schema"]
+
+# JSON 开始前允许的说明文字 / 代码围栏长度（字符），超过即判定回答不是 JSON
+_MAX_PREAMBLE = 300
+# 字符串之外允许出现的字符
+_VALUE_CHARS = frozenset(" \t\r\n{}[],:\"-+.0123456789eEtrufalsn")
+_CLOSERS = {"}": "{", "]": "["}
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SCHEMA_NAME = re.compile(r"[^a-zA-Z0-9_-]+")
+
+_TYPES = {"object": dict, "array": list, "string": str, "boolean": bool, "null": type(None)}
+
+
+def _log(msg: str):
+    print(f"[LLM-Structured] {msg}")
+
+
+class StructuredOutputError(Exception):
+    """回答不是合法 JSON / 不符合 schema"""
+
+
+# ============ Schema ============
+
+def parse_schema(text: str):
+    """json_schema 输入 → dict；为空时返回 None"""
+    if isinstance(text, dict):
+        return text
+    if not (text or "").strip():
+        return None
+    try:
+        schema = json.loads(text)
+    except ValueError as e:
+        raise Exception(f"json_schema is not valid JSON: {e}")
+    if not isinstance(schema, dict):
+        raise Exception("json_schema must be a JSON object")
+    return schema
+
+
+def _type_name(value) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    for name, t in _TYPES.items():
+        if isinstance(value, t):
+            return name
+    return type(value).__name__
+
+
+def _type_ok(value, name: str) -> bool:
+    if name == "integer":
+        return (isinstance(value, int) and not isinstance(value, bool)) or \
+               (isinstance(value, float) and value.is_integer())
+    if name == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    t = _TYPES.get(name)
+    return t is None or isinstance(value, t)
+
+
+def member_errors(schema: dict, name: str, value, path: str = "$") -> list:
+    """对象中单个字段的校验（properties / additionalProperties）"""
+    props = schema.get("properties") or {}
+    if name in props:
+        return validate(value, props[name], f"{path}.{name}")
+    extra = schema.get("additionalProperties", True)
+    if extra is False:
+        return [f"{path}: unexpected field {name!r}"]
+    if isinstance(extra, dict):
+        return validate(value, extra, f"{path}.{name}")
+    return []
+
+
+def validate(value, schema: dict, path: str = "$") -> list:
+    """最小 JSON Schema 校验，返回错误列表
+
+    支持 type / enum / const / anyOf / oneOf / allOf / properties / required / additionalProperties /
+    items / minItems / maxItems / minLength / maxLength / pattern / minimum / maximum；其余关键字忽略。
+    """
+    if not isinstance(schema, dict):
+        return []
+    types = schema.get("type")
+    if types is not None:
+        names = types if isinstance(types, list) else [types]
+        if not any(_type_ok(value, t) for t in names):
+            return [f"{path}: expected {'/'.join(names)}, got {_type_name(value)}"]
+
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if "const" in schema and value != schema["const"]:
+        errors.append(f"{path}: expected {schema['const']!r}")
+    for key in ("anyOf", "oneOf"):
+        if key in schema and all(validate(value, option, path) for option in schema[key]):
+            errors.append(f"{path}: does not match any {key} option")
+    for option in schema.get("allOf") or []:
+        errors += validate(value, option, path)
+
+    if isinstance(value, dict):
+        for name in schema.get("required") or []:
+            if name not in value:
+                errors.append(f"{path}: missing required field {name!r}")
+        for name, item in value.items():
+            errors += member_errors(schema, name, item, path)
+    elif isinstance(value, list):
+        items = schema.get("items")
+        if isinstance(items, dict):
+            for i, item in enumerate(value):
+                errors += validate(item, items, f"{path}[{i}]")
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: fewer than {schema['minItems']} items")
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: more than {schema['maxItems']} items")
+    elif isinstance(value, str):
+        if len(value) < schema.get("minLength", 0):
+            errors.append(f"{path}: shorter than {schema['minLength']} characters")
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            errors.append(f"{path}: longer than {schema['maxLength']} characters")
+        if "pattern" in schema and not re.search(schema["pattern"], value):
+            errors.append(f"{path}: does not match pattern {schema['pattern']!r}")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        if "minimum" in schema and value < schema["minimum"]:
+            errors.append(f"{path}: {value} < minimum {schema['minimum']}")
+        if "maximum" in schema and value > schema["maximum"]:
+            errors.append(f"{path}: {value} > maximum {schema['maximum']}")
+    return errors
+
+
+def _expects_object(mode: str, schema) -> bool:
+    if mode == "json_object":
+        return True
+    return isinstance(schema, dict) and (schema.get("type") == "object" or "properties" in schema)
+
+
+# ============ 增量解析 ============
+
+class IncrementalJSON:
+    """增量 JSON 扫描：跳过代码围栏 / 前置说明，跟踪嵌套结构，顶层字段一完成即解析到 fields 并按 schema 校验
+
+    feed() 在确定回答不可能是合法 JSON 时抛出 StructuredOutputError；complete 表示顶层值已结束。
+    """
+
+    def __init__(self, schema: dict = None, expect_object: bool = False):
+        self.schema = schema
+        self.fields = {}
+        self.complete = False
+        self.raw = ""
+        self.start = -1
+        self.end = -1
+        # 最后一个完整顶层字段之后的位置（截断修复用）
+        self.last_member_end = -1
+        self._openers = "{" if expect_object else "{["
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._member = -1
+
+    def feed(self, text: str) -> None:
+        self.raw += text
+        if self.complete:
+            return
+        if self.start < 0 and not self._find_start():
+            return
+        self._scan()
+
+    def _find_start(self) -> bool:
+        raw = self.raw
+        for i in range(self._pos, len(raw)):
+            if raw[i] in self._openers:
+                self.start = self._pos = i
+                return True
+        self._pos = len(raw)
+        if len(raw.strip()) > _MAX_PREAMBLE:
+            raise StructuredOutputError(f"response does not start with JSON: {raw.strip()[:80]!r}")
+        return False
+
+    def _scan(self) -> None:
+        raw, stack = self.raw, self._stack
+        for i in range(self._pos, len(raw)):
+            c = raw[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                continue
+            if len(stack) == 1 and stack[0] == "{" and self._member < 0 and c not in " \t\r\n,}":
+                self._member = i
+            if c == '"':
+                self._in_string = True
+            elif c in "{[":
+                stack.append(c)
+            elif c in "}]":
+                if not stack or stack[-1] != _CLOSERS[c]:
+                    raise StructuredOutputError(f"mismatched {c!r} at offset {i - self.start}")
+                if len(stack) == 1 and c == "}":
+                    self._close_member(i)
+                stack.pop()
+                if not stack:
+                    self.complete = True
+                    self.end = self._pos = i + 1
+                    return
+            elif c == "," and len(stack) == 1 and stack[0] == "{":
+                self._close_member(i)
+            elif c not in _VALUE_CHARS:
+                raise StructuredOutputError(f"unexpected {c!r} at offset {i - self.start}")
+        self._pos = len(raw)
+
+    def _close_member(self, end: int) -> None:
+        if self._member < 0:
+            return
+        fragment = self.raw[self._member:end]
+        self._member = -1
+        try:
+            member = json.loads("{" + fragment + "}")
+        except ValueError as e:
+            raise StructuredOutputError(f"invalid JSON field {fragment[:60]!r}: {e}")
+        for name, value in member.items():
+            if self.schema:
+                errors = member_errors(self.schema, name, value)
+                if errors:
+                    raise StructuredOutputError("; ".join(errors[:3]))
+            self.fields[name] = value
+        self.last_member_end = end
+
+
+def parse_structured(text: str, expect_object: bool = False) -> tuple:
+    """完整回答 → (值, 修复说明)；不能直接解析时在本地修复（围栏 / 说明文字 / 尾随逗号 / 截断）"""
+    try:
+        return json.loads(text), ""
+    except ValueError:
+        pass
+    scanner = IncrementalJSON(expect_object=expect_object)
+    scanner.feed(text or "")
+    if scanner.start < 0:
+        raise StructuredOutputError(f"no JSON found in response: {(text or '').strip()[:80]!r}")
+    fixes = []
+    if scanner.complete:
+        candidate = text[scanner.start:scanner.end]
+        if text[:scanner.start].strip() or text[scanner.end:].strip():
+            fixes.append("stripped surrounding text")
+    elif scanner.raw[scanner.start] == "{" and scanner.last_member_end > 0:
+        # 输出被截断（如达到 max_tokens）：保留已完整的顶层字段
+        candidate = text[scanner.start:scanner.last_member_end] + "}"
+        fixes.append(f"truncated output, kept {len(scanner.fields)} complete field(s)")
+    else:
+        raise StructuredOutputError("response ended before the JSON value was complete")
+    try:
+        return json.loads(candidate), ", ".join(fixes)
+    except ValueError:
+        pass
+    try:
+        value = json.loads(_TRAILING_COMMA.sub(r"\1", candidate))
+    except ValueError as e:
+        raise StructuredOutputError(f"response is not valid JSON: {e}")
+    return value, ", ".join(fixes + ["removed trailing commas"])
+
+
+# ============ 请求 / 响应 ============
+
+def structured_mode(config: dict) -> str:
+    mode = config.get("response_format") or "text"
+    if mode not in RESPONSE_FORMATS:
+        raise Exception(f"Unknown response_format: {mode} (expected one of {', '.join(RESPONSE_FORMATS)})")
+    return mode
+
+
+def response_format_payload(config: dict):
+    """请求体中的 response_format；text 模式返回 None"""
+    mode = structured_mode(config)
+    if mode == "json_object":
+        return {"type": "json_object"}
+    if mode == "json_schema":
+        schema = parse_schema(config.get("json_schema", ""))
+        if schema is None:
+            raise Exception("response_format json_schema requires a json_schema")
+        name = _SCHEMA_NAME.sub("_", str(schema.get("title") or "output"))[:64] or "output"
+        return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+    return None
+
+
+class StructuredStream:
+    """SSE 流式回答的增量解析器，作为 llm_http.send 的 on_chunk 使用
+
+    每个 content 增量送入 IncrementalJSON，回答确定无效时抛出 StructuredOutputError 中止请求；
+    结束后 result() 把事件组装为普通 /chat/completions 响应（含最后一个事件中的 usage）。
+    """
+
+    def __init__(self, schema: dict = None, expect_object: bool = False):
+        self.parser = IncrementalJSON(schema, expect_object)
+        self.content = []
+        self.model = ""
+        self.usage = None
+        self.finish_reason = None
+        self._buffer = b""
+        self._sse = None
+        self._announced = 0
+
+    def feed(self, chunk: bytes) -> None:
+        self._buffer += chunk
+        if self._sse is None:
+            head = self._buffer.lstrip()
+            if not head:
+                return
+            # 端点忽略 stream 时直接返回完整 JSON，结束后整体解析
+            self._sse = not head.startswith(b"{")
+        if not self._sse:
+            self._buffer = b""
+            return
+        lines = self._buffer.split(b"\n")
+        self._buffer = lines.pop()
+        for line in lines:
+            self._event(line.strip())
+
+    def _event(self, line: bytes) -> None:
+        # 只处理 data: 行（忽略注释 / keep-alive 与 event: / id: 行）
+        if not line.startswith(b"data:"):
+            return
+        data = line[5:].strip()
+        if not data or data == b"[DONE]":
+            return
+        try:
+            event = json.loads(data)
+        except ValueError:
+            raise StructuredOutputError(f"malformed stream event: {data[:80]!r}")
+        if event.get("error"):
+            error = event["error"]
+            raise Exception(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+        self.model = event.get("model") or self.model
+        if event.get("usage"):
+            self.usage = event["usage"]
+        for choice in event.get("choices") or []:
+            if choice.get("index", 0) != 0:
+                continue
+            text = (choice.get("delta") or {}).get("content")
+            if text:
+                self.content.append(text)
+                self._parse(text)
+            if choice.get("finish_reason"):
+                self.finish_reason = choice["finish_reason"]
+
+    def _parse(self, text: str) -> None:
+        try:
+            self.parser.feed(text)
+        except StructuredOutputError as e:
+            _log(f"Aborting stream after {len(self.parser.raw)} chars: {e}")
+            raise
+        fields = list(self.parser.fields)
+        if len(fields) > self._announced:
+            _log(f"Fields ready: {', '.join(fields[self._announced:])}")
+            self._announced = len(fields)
+
+    def result(self, raw: bytes) -> dict:
+        if not self._sse:
+            return json.loads(raw.decode())
+        if self._buffer.strip():
+            self._event(self._buffer.strip())
+            self._buffer = b""
+        res = {
+            "object": "chat.completion",
+            "model": self.model,
+            "choices": [{"index": 0, "finish_reason": self.finish_reason,
+                         "message": {"role": "assistant", "content": "".join(self.content)}}],
+        }
+        if self.usage:
+            res["usage"] = self.usage
+        return res
+
+
+def streams_json(config: dict) -> bool:
+    """JSON 模式且开启 stream_json 时以 SSE 流式请求"""
+    return structured_mode(config) != "text" and bool(config.get("stream_json", True))
+
+
+def structured_stream(config: dict):
+    """streams_json 时返回新的 StructuredStream（每次请求一个），否则返回 None"""
+    if not streams_json(config):
+        return None
+    mode = structured_mode(config)
+    schema = parse_schema(config.get("json_schema", "")) if mode == "json_schema" else None
+    return StructuredStream(schema, _expects_object(mode, schema))
+
+
+def structured_result(text: str, config: dict) -> str:
+    """完整回答 → 规范化 JSON 文本；本地修复后仍无效或不符合 schema 时抛出 StructuredOutputError"""
+    mode = structured_mode(config)
+    schema = parse_schema(config.get("json_schema", "")) if mode == "json_schema" else None
+    value, fixes = parse_structured(text, _expects_object(mode, schema))
+    if fixes:
+        _log(f"Repaired JSON locally ({fixes}), no re-request needed")
+    if schema:
+        errors = validate(value, schema)
+        if errors:
+            raise StructuredOutputError(f"JSON does not match schema: {'; '.join(errors[:5])}")
+    elif _expects_object(mode, schema) and not isinstance(value, dict):
+        raise StructuredOutputError(f"expected a JSON object, got {_type_name(value)}")
+    return json.dumps(value, ensure_ascii=False, indent=2)
+
+
+def json_field(value, path: str):
+    """按点号路径取值（如 meta.tags.0），不存在时返回 None"""
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part)
+        elif isinstance(value, list) and part.lstrip("-").isdigit() and -len(value) <= int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
@@ -0,0 +1,214 @@
+"""
+ComfyUI Gemini 用量与成本统计
+Usage / cost / latency accounting shared by both _request paths
+
+- 每次调用记录 prompt / completion / cached / image tokens、服务端上报成本与延迟
+- 进程内线程安全聚合（按 model / endpoint / workflow）
+- 后台线程定期追加写入本地 JSONL（append-only），跨进程重启可重新汇总
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    from .llm_cache import cache_dir
+except ImportError:
+    from llm_cache import cache_dir
+
+
+def _log(msg: str):
+    print(f"[LLM-Usage] {msg}")
+
+
+# 定期落盘间隔（秒）
+_FLUSH_INTERVAL = 30
+
+GROUP_KEYS = ["model", "endpoint", "workflow"]
+
+_COUNTERS = ("calls", "errors", "prompt_tokens", "completion_tokens", "cached_tokens",
+             "image_tokens", "cost", "latency")
+
+
+def _int(v) -> int:
+    try:
+        return int(v or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _float(v) -> float:
+    try:
+        return float(v or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def endpoint_of(url: str) -> str:
+    """host + path，不含查询参数"""
+    parts = urlsplit(url or "")
+    return f"{parts.netloc}{parts.path}"
+
+
+def extract_usage(response: dict, headers: dict) -> dict:
+    """从响应 usage 块与响应头提取 token / 成本"""
+    usage = (response or {}).get("usage") or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    completion_details = usage.get("completion_tokens_details") or {}
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    # OpenRouter: usage.cost；LiteLLM: x-litellm-response-cost 响应头
+    cost = usage.get("cost")
+    if cost is None:
+        cost = headers.get("x-litellm-response-cost")
+    return {
+        "prompt_tokens": _int(usage.get("prompt_tokens")),
+        "completion_tokens": _int(usage.get("completion_tokens")),
+        "cached_tokens": _int(prompt_details.get("cached_tokens") or usage.get("cache_read_input_tokens")),
+        "image_tokens": _int(completion_details.get("image_tokens")) + _int(prompt_details.get("image_tokens")),
+        "cost": _float(cost),
+    }
+
+
+def _empty() -> dict:
+    return {k: 0 for k in _COUNTERS}
+
+
+class UsageStore:
+    """线程安全的用量聚合 + 定期追加写文件"""
+
+    def __init__(self, path: str, flush_interval: float = _FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = []
+        self._totals = {}
+        self._flusher = None
+
+    def record(self, entry: dict) -> None:
+        key = tuple(entry.get(k, "") for k in GROUP_KEYS)
+        with self._lock:
+            agg = self._totals.setdefault(key, _empty())
+            _accumulate(agg, entry)
+            self._pending.append(entry)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="llm-usage-flush", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in pending))
+        except Exception as e:
+            _log(f"Failed to write {self.path}: {e}")
+            with self._lock:
+                self._pending[:0] = pending
+
+    def totals(self) -> dict:
+        """本进程内的聚合结果 {(model, endpoint, workflow): counters}"""
+        with self._lock:
+            return {k: dict(v) for k, v in self._totals.items()}
+
+    def history_totals(self) -> dict:
+        """从 JSONL 文件重新汇总（包含以往进程的记录）"""
+        self.flush()
+        totals = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    key = tuple(entry.get(k, "") for k in GROUP_KEYS)
+                    _accumulate(totals.setdefault(key, _empty()), entry)
+        except FileNotFoundError:
+            pass
+        return totals
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals = {}
+
+
+def _accumulate(agg: dict, entry: dict) -> None:
+    agg["calls"] += 1
+    agg["errors"] += 1 if entry.get("error") else 0
+    for k in _COUNTERS[2:]:
+        agg[k] += entry.get(k, 0) or 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> UsageStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UsageStore(os.path.join(cache_dir("usage"), "usage.jsonl"))
+            atexit.register(_store.flush)
+        return _store
+
+
+def record_call(url: str, payload: dict, response: dict = None, headers: dict = None,
+                latency: float = 0.0, workflow: str = "", error: str = "") -> None:
+    """记录一次调用（成功或失败）；统计失败不影响请求本身"""
+    try:
+        entry = {
+            "ts": round(time.time(), 3),
+            "model": (response or {}).get("model") or (payload or {}).get("model", ""),
+            "endpoint": endpoint_of(url),
+            "workflow": workflow or "",
+            "latency": round(latency, 3),
+        }
+        if error:
+            entry["error"] = error[:200]
+        entry.update(extract_usage(response, headers))
+        get_store().record(entry)
+    except Exception as e:
+        _log(f"Failed to record usage: {e}")
+
+
+def format_report(totals: dict, group_by: list) -> str:
+    """按指定维度汇总并格式化为文本表格"""
+    grouped = {}
+    for key, agg in totals.items():
+        sub = tuple(v for k, v in zip(GROUP_KEYS, key) if k in group_by)
+        _merge(grouped.setdefault(sub, _empty()), agg)
+
+    total = _empty()
+    lines = []
+    for sub, agg in sorted(grouped.items(), key=lambda kv: -kv[1]["cost"]):
+        _merge(total, agg)
+        label = " | ".join(v or "-" for v in sub) or "all"
+        lines.append(_format_row(label, agg))
+    lines.append(_format_row("TOTAL", total))
+    header = f"group by: {', '.join(group_by) or 'none'}"
+    return "\n".join([header] + lines)
+
+
+def _merge(dst: dict, src: dict) -> None:
+    for k in _COUNTERS:
+        dst[k] += src.get(k, 0)
+
+
+def _format_row(label: str, agg: dict) -> str:
+    calls = agg["calls"] or 1
+    return (
+        f"{label}: calls={agg['calls']} errors={agg['errors']} "
+        f"prompt={agg['prompt_tokens']} completion={agg['completion_tokens']} "
+        f"cached={agg['cached_tokens']} image={agg['image_tokens']} "
+        f"cost=${agg['cost']:.4f} avg_latency={agg['latency'] / calls:.2f}s"
+    )
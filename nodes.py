@@ -3,9 +3,9 @@ ComfyUI Gemini LiteLLM Nodes
 Gemini 3 聊天和图片生成（通过 LiteLLM）
 
 Architecture:
-- Execution Nodes: LLMChatGenerate, LLMImageGenerate
+- Execution Nodes: LLMChatGenerate, LLMImageGenerate, LLMImageGenerateFiles
 - Config Nodes: LLMBaseConfig, ChatParams, GeminiImageParams
-- Zero external dependencies (urllib only)
+- Zero external dependencies (standard library only)
 
 Author: ZUENS2020
 Version: 3.0.0
@@ -15,25 +15,47 @@ Date: 2026-01-02
 import json
 import base64
 import urllib.request
-import urllib.error
+import time
 from typing import Any
 from io import BytesIO
 import numpy as np
 import torch
 from PIL import Image
 
+try:
+    from .llm_payload import collect_images, build_image_parts, budget_from_config
+    from .llm_payload import stream_image_parts, settle_payload, encode_body, PayloadOverflow
+    from .llm_payload import select_frames, frame_options_from_config, FRAME_SAMPLING_MODES
+    from .llm_files import ReferenceUploader, UPLOAD_MODES
+    from .llm_usage import record_call
+    from .llm_catalog import check_model
+    from .llm_http import send, timeouts_from_config, DeadlineExceeded, HTTPStatusError, Interrupted, prewarm_connections
+    from .llm_http import CHAT_DEADLINE, IMAGE_DEADLINES, RETRY_BACKOFF
+    from .llm_keys import key_pool, resolve_keys
+    from .llm_output import save_response_images, output_dir, image_urls
+    from .llm_semantic import semantic_probe, DEFAULT_THRESHOLD
+    from .llm_structured import response_format_payload, streams_json, structured_stream, structured_result
+    from .llm_structured import RESPONSE_FORMATS
+except ImportError:
+    from llm_payload import collect_images, build_image_parts, budget_from_config
+    from llm_payload import stream_image_parts, settle_payload, encode_body, PayloadOverflow
+    from llm_payload import select_frames, frame_options_from_config, FRAME_SAMPLING_MODES
+    from llm_files import ReferenceUploader, UPLOAD_MODES
+    from llm_usage import record_call
+    from llm_catalog import check_model
+    from llm_http import send, timeouts_from_config, DeadlineExceeded, HTTPStatusError, Interrupted, prewarm_connections
+    from llm_http import CHAT_DEADLINE, IMAGE_DEADLINES, RETRY_BACKOFF
+    from llm_keys import key_pool, resolve_keys
+    from llm_output import save_response_images, output_dir, image_urls
+    from llm_semantic import semantic_probe, DEFAULT_THRESHOLD
+    from llm_structured import response_format_payload, streams_json, structured_stream, structured_result
+    from llm_structured import RESPONSE_FORMATS
+
 
 def _log(msg: str):
     print(f"[LLM-Custom] {msg}")
 
 
-def _safe_key(key: str) -> str:
-    k = key or ""
-    if len(k) <= 6:
-        return "***"
-    return f"{k[:3]}***{k[-3:]}"
-
-
 def _normalize_url(url: str) -> str:
     """标准化 URL"""
     return (url or "").strip().rstrip("/")
@@ -48,20 +70,27 @@ def _headers(key: str) -> dict:
     }
 
 
-def _request(method: str, url: str, headers: dict, data: dict = None, timeout: int = 120) -> Any:
-    """HTTP 请求"""
-    body = json.dumps(data).encode() if data else None
-    req = urllib.request.Request(url, body, headers, method=method)
+def _request(method: str, url: str, headers: dict, data: dict = None, timeouts=None, deadline=None,
+             workflow: str = "", stream=None) -> Any:
+    """HTTP 请求（分离的连接/首字节/空闲超时，受节点截止时间约束；同时记录用量 / 成本 / 延迟）
+
+    stream 为 llm_structured.StructuredStream 时按 SSE 增量解析响应，返回组装后的完整响应。
+    """
+    start = time.time()
+    # 含后台编码中的参考图像时为流式请求体（分块上传）
+    body = encode_body(data, deadline)
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            return json.loads(r.read().decode())
-    except urllib.error.HTTPError as e:
-        try:
-            err = e.read().decode()
-        except:
-            err = str(e.reason)
-        raise Exception(f"HTTP {e.code}: {err}")
+        _, resp_headers, raw = send(method, url, headers, body, timeouts, deadline,
+                                    on_chunk=stream.feed if stream is not None else None)
+        result = stream.result(raw) if stream is not None else json.loads(raw.decode())
+        record_call(url, data, result, resp_headers, time.time() - start, workflow)
+        return result
+    except (HTTPStatusError, DeadlineExceeded, Interrupted, PayloadOverflow) as e:
+        record_call(url, data, latency=time.time() - start, workflow=workflow,
+                    error=f"HTTP {e.code}" if isinstance(e, HTTPStatusError) else str(e))
+        raise
     except Exception as e:
+        record_call(url, data, latency=time.time() - start, workflow=workflow, error=str(e))
         raise Exception(str(e))
 
 
@@ -98,30 +127,15 @@ class LLMChatGenerate:
     FUNCTION = "run"
     CATEGORY = "Gemini-LiteLLM"
 
-    def run(self, config, prompt, system="", image_1=None, image_2=None, image_3=None, image_4=None, image_5=None):
-        api_base = config.get("api_base")
-        api_key = config.get("api_key")
-        model = config.get("model")
-        temperature = config.get("temperature", 0.7)
-        max_tokens = config.get("max_tokens", 2000)
-        
-        base = _normalize_url(api_base)
-        if not base or not api_key or not model:
-            _log("Chat error: missing base/key/model")
-            return ("Error: Missing parameters",)
-        
-        # 收集多路图像输入
-        image_inputs = [image_1, image_2, image_3, image_4, image_5]
-        image_list = []
-        for img in image_inputs:
-            if img is None:
-                continue
-            if len(img.shape) == 3:
-                image_list.append(img)
-            else:
-                # 若是批次，逐张展开加入列表
-                for i in range(img.shape[0]):
-                    image_list.append(img[i])
+    def build_payload(self, config, prompt, system="", image_1=None, image_2=None, image_3=None, image_4=None, image_5=None,
+                      stream=False, uploader=None) -> dict:
+        """构建 /chat/completions 请求体（帧采样、预算检查、参考图像编码/上传）
+
+        stream=True 且为 inline 模式时参考图像在后台编码，请求体由 _request 分块上传。
+        uploader 为空时按配置中的 api_key 上传参考图像。
+        """
+        # 收集多路图像输入（帧采样 + 去重，只发送最少的不同图像）
+        image_list = select_frames([image_1, image_2, image_3, image_4, image_5], **frame_options_from_config(config))
         
         msgs = []
         if system.strip():
@@ -132,18 +146,17 @@ class LLMChatGenerate:
         if prompt.strip():
             user_content.append({"type": "text", "text": prompt.strip()})
         
-        # 添加参考图像
-        if image_list:
-            for img_tensor in image_list:
-                img_np = (img_tensor.cpu().numpy() * 255).astype(np.uint8)
-                pil_img = Image.fromarray(img_np)
-                buffered = BytesIO()
-                pil_img.save(buffered, format="PNG")
-                img_b64 = base64.b64encode(buffered.getvalue()).decode()
-                user_content.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                })
+        # 添加参考图像（发送前预算检查，超出时自动降采样/重压缩）
+        max_bytes, max_image_tokens = budget_from_config(config)
+        uploader = uploader or ReferenceUploader(config)
+        if stream and uploader.mode == "inline":
+            user_content.extend(stream_image_parts(image_list, max_bytes, max_image_tokens))
+        else:
+            user_content.extend(build_image_parts(
+                image_list, max_bytes, max_image_tokens,
+                make_part=uploader.part,
+                reserved_bytes=len(json.dumps(msgs + [user_content]).encode()),
+            ))
         
         # 如果没有内容，使用默认提示词（保持为列表格式）
         if not user_content:
@@ -151,27 +164,104 @@ class LLMChatGenerate:
         
         msgs.append({"role": "user", "content": user_content})
         
-        # 重试机制
+        payload = {
+            "model": config.get("model"),
+            "messages": msgs,
+            "temperature": config.get("temperature", 0.7),
+            "max_tokens": config.get("max_tokens", 2000)
+        }
+        # 结构化输出（json_object / json_schema）
+        response_format = response_format_payload(config)
+        if response_format:
+            payload["response_format"] = response_format
+        return payload
+
+    @staticmethod
+    def parse_response(res: dict) -> str:
+        """从响应中提取文本"""
+        txt = res.get("choices", [{}])[0].get("message", {}).get("content", "")
+        return txt or "No response from model"
+
+    def run(self, config, prompt, system="", image_1=None, image_2=None, image_3=None, image_4=None, image_5=None):
+        api_base = config.get("api_base")
+        api_key = config.get("api_key")
+        model = config.get("model")
+        max_tokens = config.get("max_tokens", 2000)
+        
+        base = _normalize_url(api_base)
+        if not base or not api_key or not model:
+            _log("Chat error: missing base/key/model")
+            return ("Error: Missing parameters",)
+        
+        # 节点总截止时间：贯穿编码、请求、重试与退避
+        timeouts, deadline = timeouts_from_config(config, CHAT_DEADLINE)
+        
+        # 编码前按缓存的模型目录预检（模型名 / 输出长度）
+        check_model(config, max_tokens=max_tokens)
+        
+        # 语义缓存：纯文本提示词与已缓存的近似时直接返回，不发送请求
+        probe = semantic_probe(config, prompt, system, [image_1, image_2, image_3, image_4, image_5],
+                               timeouts, deadline)
+        if probe is not None and probe.answer is not None:
+            return (probe.answer,)
+        
+        # 参考图像用第一次请求的 key 上传（files_api 文件归属于上传账号）
+        keys = key_pool(config)
+        api_key = keys.acquire()
+        uploader = ReferenceUploader(config, api_key, timeouts, deadline)
+        payload = self.build_payload(config, prompt, system, image_1, image_2, image_3, image_4, image_5,
+                                     stream=config.get("stream_upload", False), uploader=uploader)
+        
+        # JSON 模式：流式接收并增量解析，回答无效时提前中止
+        structured = "response_format" in payload
+        if streams_json(config):
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        
+        deadline.check("encoding")
+        
+        # 重试机制（退避等待同样受截止时间约束；多 key 时被限流的 key 立即换下一个）
+        # 常规失败共 2 次尝试；只有限流 / 鉴权失败的 key 被换下时才追加一次（最多每个 key 一次）
         max_retries = 2
-        for attempt in range(max_retries):
+        for attempt in range(1 + max(len(keys), 1)):
+            if attempt:
+                api_key = keys.acquire()
+                uploader.bind(api_key)
             try:
-                payload = {
-                    "model": model,
-                    "messages": msgs,
-                    "temperature": temperature,
-                    "max_tokens": max_tokens
-                }
-                res = _request("POST", f"{base}/chat/completions", _headers(api_key), payload, timeout=120)
-                txt = res.get("choices", [{}])[0].get("message", {}).get("content", "")
-                if txt:
-                    return (txt,)
-                return ("No response from model",)
+                res = _request("POST", f"{base}/chat/completions", _headers(api_key), payload,
+                               timeouts=timeouts, deadline=deadline, workflow=config.get("workflow_tag", ""),
+                               stream=structured_stream(config))
+                keys.report(api_key)
+                content = res.get("choices", [{}])[0].get("message", {}).get("content")
+                # 结构化输出先在本地修复 / 校验，无法修复时才重新请求
+                text = structured_result(content or "", config) if structured else self.parse_response(res)
+                if probe is not None and content:
+                    probe.store(text)
+                return (text,)
             except Exception as e:
+                if isinstance(e, PayloadOverflow) or "HTTP 411" in str(e):
+                    # 流式上传超出字节预算 / 端点不接受分块上传：改为预先编码后立即重发
+                    if settle_payload(payload):
+                        _log(f"Streaming upload failed ({e}), resending pre-encoded body")
+                        if attempt < max_retries - 1:
+                            continue
+                rotated = keys.report(api_key, e) and keys.available()
+                if rotated:
+                    max_retries = min(max_retries + 1, 1 + len(keys))
+                if isinstance(e, (DeadlineExceeded, Interrupted)):
+                    _log(f"{e}, giving up")
+                    raise
+                if "HTTP 413" in str(e):
+                    # 同一载荷重发必然再次失败
+                    _log(f"Payload too large: {e}")
+                    raise Exception(f"Request body too large for endpoint (HTTP 413), lower max_payload_mb: {e}")
                 if attempt == max_retries - 1:
                     _log(f"Chat error (final): {e}")
                     raise Exception(f"Failed to get response after {max_retries} attempts: {e}")
                 else:
                     _log(f"Chat retry {attempt + 1}/{max_retries} due to: {e}")
+                    if not rotated:
+                        deadline.sleep(RETRY_BACKOFF * (attempt + 1))
 
 
 class LLMImageGenerate:
@@ -199,12 +289,86 @@ class LLMImageGenerate:
     FUNCTION = "run"
     CATEGORY = "Gemini-LiteLLM"
 
-    def run(self, config, prompt, n, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, additional_text=""):
+    def build_payload(self, config, prompt, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, additional_text="",
+                      stream=False, uploader=None) -> dict:
+        """构建 /chat/completions 图片生成请求体（预算检查、参考图像编码/上传；stream 同 LLMChatGenerate）"""
+        # 收集多路图像输入
+        image_list = collect_images([image_1, image_2, image_3, image_4, image_5])
+        
+        # 构建多模态消息内容
+        content = []
+        if prompt.strip():
+            content.append({"type": "text", "text": prompt.strip()})
+        
+        # 参考图像只编码一次（发送前预算检查，超出时自动降采样/重压缩）
+        text_parts = [{"type": "text", "text": additional_text.strip()}] if additional_text.strip() else []
+        max_bytes, max_image_tokens = budget_from_config(config)
+        uploader = uploader or ReferenceUploader(config)
+        if stream and uploader.mode == "inline":
+            content.extend(stream_image_parts(image_list, max_bytes, max_image_tokens))
+        else:
+            content.extend(build_image_parts(
+                image_list, max_bytes, max_image_tokens,
+                make_part=uploader.part,
+                reserved_bytes=len(json.dumps(content + text_parts).encode()),
+            ))
+        content.extend(text_parts)
+        
+        # 如果没有内容，使用默认提示词（保持为列表格式）
+        if not content:
+            content = [{"type": "text", "text": "Generate a beautiful landscape"}]
+        
+        return {
+            "model": config.get("model"),
+            "messages": [{"role": "user", "content": content}],
+            "temperature": config.get("temperature", 1.0),
+            "image_config": {
+                "image_size": config.get("image_size"),
+                "aspect_ratio": config.get("aspect_ratio")
+            }
+        }
+
+    @staticmethod
+    def parse_response(res: dict, n: int = 1):
+        """从响应中解码图像，返回 [N,H,W,3] 张量（n > 1 时复制第一张）"""
+        if "error" in res:
+            raise Exception(res.get("error", {}).get("message", "image generation failed"))
+        if not res.get("choices"):
+            raise Exception(f"empty response: {res}")
+        
+        imgs = []
+        message = res["choices"][0].get("message", {})
+        images = message.get("images", [])
+        
+        if not images and message.get("content"):
+            raise Exception("Gemini returned text instead of image. Use simpler image description.")
+        
+        for img_item in images:
+            img_url = img_item.get("image_url", {}).get("url", "")
+            if img_url.startswith("data:image/"):
+                b64_data = img_url.split(",", 1)[1] if "," in img_url else img_url
+                data = base64.b64decode(b64_data)
+                pil = Image.open(BytesIO(data)).convert("RGB")
+                arr = np.array(pil).astype(np.float32) / 255.0
+                imgs.append(torch.from_numpy(arr))
+        
+        if not imgs:
+            raise Exception("Failed to process any images")
+        result = torch.stack(imgs)
+        for _ in range(n - 1):
+            result = torch.cat([result, result[:1]], dim=0)
+        return result
+
+    def _result(self, res: dict, n: int, filename_prefix: str = ""):
+        """成功响应 → 节点输出（文件输出节点覆盖此方法，按 filename_prefix 写入输出目录）"""
+        return (self.parse_response(res, n),)
+
+    def run(self, config, prompt, n, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, additional_text="",
+            filename_prefix=""):
         api_base = config.get("api_base")
         api_key = config.get("api_key")
         model = config.get("model")
         use_gemini_image = config.get("use_gemini_image", False)
-        temperature = config.get("temperature", 1.0)
         
         # Gemini 参数
         aspect_ratio = config.get("aspect_ratio")
@@ -215,93 +379,92 @@ class LLMImageGenerate:
             _log("Image error: missing base/key/model")
             raise Exception("Missing API configuration")
         
-        # 重试机制
+        if not (use_gemini_image and aspect_ratio and image_size):
+            _log("Image error: Gemini config required")
+            raise Exception("Gemini config required")
+        
+        # 节点总截止时间：贯穿编码、请求、重试与退避
+        timeouts, deadline = timeouts_from_config(config, IMAGE_DEADLINES.get(image_size, IMAGE_DEADLINES["1K"]))
+        
+        # 编码前按缓存的模型目录预检（模型名 / 图像输出）
+        check_model(config, need_image=True)
+        
+        # 参考图像用第一次请求的 key 上传（files_api 文件归属于上传账号）
+        keys = key_pool(config)
+        api_key = keys.acquire()
+        uploader = ReferenceUploader(config, api_key, timeouts, deadline)
+        payload = self.build_payload(config, prompt, image_1, image_2, image_3, image_4, image_5, additional_text,
+                                     stream=config.get("stream_upload", False), uploader=uploader)
+        
+        deadline.check("encoding")
+        
+        # 重试机制（退避等待同样受截止时间约束；多 key 时被限流的 key 立即换下一个）
+        # 常规失败共 2 次尝试；只有限流 / 鉴权失败的 key 被换下时才追加一次（最多每个 key 一次）
         max_retries = 2
-        for attempt in range(max_retries):
+        for attempt in range(1 + max(len(keys), 1)):
+            if attempt:
+                api_key = keys.acquire()
+                uploader.bind(api_key)
             try:
-                if use_gemini_image and aspect_ratio and image_size:
-                    # 收集多路图像输入
-                    image_inputs = [image_1, image_2, image_3, image_4, image_5]
-                    image_list = []
-                    for img in image_inputs:
-                        if img is None:
-                            continue
-                        if len(img.shape) == 3:
-                            image_list.append(img)
-                        else:
-                            for i in range(img.shape[0]):
-                                image_list.append(img[i])
-                    
-                    # 构建多模态消息内容
-                    content = []
-                    if prompt.strip():
-                        content.append({"type": "text", "text": prompt.strip()})
-                    
-                    if image_list:
-                        for img_tensor in image_list:
-                            img_np = (img_tensor.cpu().numpy() * 255).astype(np.uint8)
-                            pil_img = Image.fromarray(img_np)
-                            buffered = BytesIO()
-                            pil_img.save(buffered, format="PNG")
-                            img_b64 = base64.b64encode(buffered.getvalue()).decode()
-                            content.append({
-                                "type": "image_url",
-                                "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                            })
-                    
-                    if additional_text.strip():
-                        content.append({"type": "text", "text": additional_text.strip()})
-                    
-                    # 如果没有内容，使用默认提示词（保持为列表格式）
-                    if not content:
-                        content = [{"type": "text", "text": "Generate a beautiful landscape"}]
-                    
-                    payload = {
-                        "model": model,
-                        "messages": [{"role": "user", "content": content}],
-                        "temperature": temperature,
-                        "image_config": {
-                            "image_size": image_size,
-                            "aspect_ratio": aspect_ratio
-                        }
-                    }
-                    
-                    res = _request("POST", f"{base}/chat/completions", _headers(api_key), payload, timeout=180)
-                    
-                    if "error" in res:
-                        raise Exception(res.get("error", {}).get("message", "image generation failed"))
-                    if not res.get("choices"):
-                        raise Exception(f"empty response: {res}")
-                    
-                    imgs = []
-                    message = res["choices"][0].get("message", {})
-                    images = message.get("images", [])
-                    
-                    if not images and message.get("content"):
-                        raise Exception("Gemini returned text instead of image. Use simpler image description.")
-                    
-                    for img_item in images:
-                        img_url = img_item.get("image_url", {}).get("url", "")
-                        if img_url.startswith("data:image/"):
-                            b64_data = img_url.split(",", 1)[1] if "," in img_url else img_url
-                            data = base64.b64decode(b64_data)
-                            pil = Image.open(BytesIO(data)).convert("RGB")
-                            arr = np.array(pil).astype(np.float32) / 255.0
-                            imgs.append(torch.from_numpy(arr))
-                    
-                    if imgs:
-                        result = torch.stack(imgs)
-                        for _ in range(n - 1):
-                            result = torch.cat([result, result[:1]], dim=0)
-                        return (result,)
-                else:
-                    raise Exception("Gemini config required")
+                res = _request("POST", f"{base}/chat/completions", _headers(api_key), payload,
+                               timeouts=timeouts, deadline=deadline, workflow=config.get("workflow_tag", ""))
+                keys.report(api_key)
+                # 响应里没有图像时照常重试；解码 / 写盘在重试之外，本地错误不会触发再次付费生成
+                if not image_urls(res):
+                    raise Exception("Failed to process any images")
+                break
             except Exception as e:
+                if isinstance(e, PayloadOverflow) or "HTTP 411" in str(e):
+                    # 流式上传超出字节预算 / 端点不接受分块上传：改为预先编码后立即重发
+                    if settle_payload(payload):
+                        _log(f"Streaming upload failed ({e}), resending pre-encoded body")
+                        if attempt < max_retries - 1:
+                            continue
+                rotated = keys.report(api_key, e) and keys.available()
+                if rotated:
+                    max_retries = min(max_retries + 1, 1 + len(keys))
+                if isinstance(e, (DeadlineExceeded, Interrupted)):
+                    _log(f"{e}, giving up")
+                    raise
+                if "HTTP 413" in str(e):
+                    # 同一载荷重发必然再次失败
+                    _log(f"Payload too large: {e}")
+                    raise Exception(f"Request body too large for endpoint (HTTP 413), lower max_payload_mb: {e}")
                 if attempt == max_retries - 1:
                     _log(f"Image error (final): {e}")
                     raise Exception(f"Image generation failed after {max_retries} attempts: {e}")
                 else:
                     _log(f"Image retry {attempt + 1}/{max_retries} due to: {e}")
+                    if not rotated:
+                        deadline.sleep(RETRY_BACKOFF * (attempt + 1))
+        
+        return self._result(res, n, filename_prefix)
+
+
+class LLMImageGenerateFiles(LLMImageGenerate):
+    """图片生成节点（文件输出）：原始图像字节直接写入输出目录，不解码为张量"""
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        types = super().INPUT_TYPES()
+        # 与 SaveImage 相同：<prefix>_<counter>_.<ext>，可含子目录
+        types["optional"]["filename_prefix"] = ("STRING", {"default": "LLM", "multiline": False})
+        return types
+    
+    RETURN_TYPES = ("LLM_IMAGE_FILES", "STRING")
+    RETURN_NAMES = ("files", "paths")
+    OUTPUT_NODE = True
+    
+    def _result(self, res: dict, n: int, filename_prefix: str = ""):
+        files = save_response_images(res, filename_prefix, n)
+        return {"ui": {"images": files.ui()}, "result": (files, "\n".join(files.paths))}
+    
+    def run(self, config, prompt, n, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, additional_text="",
+            filename_prefix="LLM"):
+        # 请求前先校验输出路径
+        output_dir(filename_prefix)
+        return super().run(config, prompt, n, image_1, image_2, image_3, image_4, image_5, additional_text,
+                           filename_prefix)
 
 
 # ============ 配置节点 ============
@@ -316,6 +479,22 @@ class LLMBaseConfig:
                 "api_base": ("STRING", {"default": "https://your-litellm-server.com/v1"}),
                 "api_key": ("STRING", {"default": ""}),
                 "model": ("STRING", {"default": "gemini/gemini-3-pro-image-preview"}),
+            },
+            "optional": {
+                # 参考图像上传方式：inline 内联 / files_api 上传到 /files / url 上传到 upload_url
+                "reference_upload": (UPLOAD_MODES, ),
+                "upload_url": ("STRING", {"default": "", "multiline": False}),
+                # 用量统计分组标签
+                "workflow_tag": ("STRING", {"default": "", "multiline": False}),
+                # 用缓存的 /models 目录预检模型
+                "validate_model": ("BOOLEAN", {"default": False}),
+                # 多 key 轮换：api_key 可填多个（逗号 / 换行分隔），另可从环境变量或 key 文件读取
+                "api_key_env": ("STRING", {"default": "", "multiline": False}),
+                "api_key_file": ("STRING", {"default": "", "multiline": False}),
+                # 配置节点执行时就在后台建立到 api_base 的连接，省去首次请求的 DNS / TCP / TLS 开销
+                "prewarm": ("BOOLEAN", {"default": False}),
+                # 分块上传请求体：inline 参考图像边编码边发送（端点 / 代理需支持 chunked 请求体）
+                "stream_upload": ("BOOLEAN", {"default": False}),
             }
         }
     
@@ -324,11 +503,21 @@ class LLMBaseConfig:
     FUNCTION = "run"
     CATEGORY = "Gemini-LiteLLM/Config"
     
-    def run(self, api_base, api_key, model):
+    def run(self, api_base, api_key, model, reference_upload="inline", upload_url="", workflow_tag="",
+            validate_model=False, api_key_env="", api_key_file="", prewarm=False, stream_upload=False):
+        keys = resolve_keys(api_key, api_key_env, api_key_file)
+        if prewarm:
+            prewarm_connections(api_base)
         return ({
             "api_base": _normalize_url(api_base),
-            "api_key": api_key,
+            "api_key": keys[0] if keys else "",
+            "api_keys": keys,
             "model": model,
+            "reference_upload": reference_upload,
+            "upload_url": upload_url,
+            "workflow_tag": workflow_tag,
+            "validate_model": validate_model,
+            "stream_upload": stream_upload,
         },)
 
 
@@ -342,6 +531,30 @@ class ChatParams:
                 "base_config": ("LLM_BASE_CONFIG",),
                 "temperature": ("FLOAT", {"default": 0.7, "min": 0, "max": 2, "step": 0.1}),
                 "max_tokens": ("INT", {"default": 2000, "min": 1, "max": 128000}),
+            },
+            "optional": {
+                # 请求体预算（0 = 不限制），超出时自动降采样/重压缩参考图像
+                "max_payload_mb": ("FLOAT", {"default": 20.0, "min": 0, "max": 500, "step": 0.5}),
+                "max_image_tokens": ("INT", {"default": 0, "min": 0, "max": 1000000}),
+                # 节点总截止时间（0 = 默认：聊天 180s，图片按尺寸 300/480/900s）与分离超时
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 7200}),
+                "connect_timeout": ("FLOAT", {"default": 10.0, "min": 1, "max": 120, "step": 1}),
+                "first_byte_timeout": ("FLOAT", {"default": 0.0, "min": 0, "max": 7200, "step": 1}),
+                "idle_timeout": ("FLOAT", {"default": 60.0, "min": 1, "max": 600, "step": 1}),
+                # 图像批次（视频帧）采样与去重
+                "frame_sampling": (FRAME_SAMPLING_MODES, ),
+                "max_frames": ("INT", {"default": 0, "min": 0, "max": 1000}),
+                "frame_stride": ("INT", {"default": 1, "min": 1, "max": 1000}),
+                "dedup_distance": ("INT", {"default": 0, "min": 0, "max": 32}),
+                # 语义缓存（仅纯文本请求）：相似度 ≥ 阈值且模型 / 参数 / system 相同时直接返回缓存回答
+                "semantic_cache": ("BOOLEAN", {"default": False}),
+                "semantic_threshold": ("FLOAT", {"default": DEFAULT_THRESHOLD, "min": 0.5, "max": 1.0, "step": 0.01}),
+                # 端点 /embeddings 的向量模型（按阈值复用近似提示词）；为空时只复用规范化后完全相同的提示词
+                "embedding_model": ("STRING", {"default": "", "multiline": False}),
+                # 结构化输出：json_object / json_schema（JSON Schema 文本），stream_json 时流式增量解析
+                "response_format": (RESPONSE_FORMATS, ),
+                "json_schema": ("STRING", {"default": "", "multiline": True}),
+                "stream_json": ("BOOLEAN", {"default": True}),
             }
         }
     
@@ -350,11 +563,31 @@ class ChatParams:
     FUNCTION = "run"
     CATEGORY = "Gemini-LiteLLM/Config"
     
-    def run(self, base_config, temperature, max_tokens):
+    def run(self, base_config, temperature, max_tokens, max_payload_mb=20.0, max_image_tokens=0,
+            frame_sampling="all", max_frames=0, frame_stride=1, dedup_distance=0,
+            deadline=0, connect_timeout=10.0, first_byte_timeout=0.0, idle_timeout=60.0,
+            semantic_cache=False, semantic_threshold=DEFAULT_THRESHOLD, embedding_model="",
+            response_format="text", json_schema="", stream_json=True):
         return ({
             **base_config,
             "temperature": temperature,
             "max_tokens": max_tokens,
+            "max_payload_mb": max_payload_mb,
+            "max_image_tokens": max_image_tokens,
+            "deadline": deadline,
+            "connect_timeout": connect_timeout,
+            "first_byte_timeout": first_byte_timeout,
+            "idle_timeout": idle_timeout,
+            "frame_sampling": frame_sampling,
+            "max_frames": max_frames,
+            "frame_stride": frame_stride,
+            "dedup_distance": dedup_distance,
+            "semantic_cache": semantic_cache,
+            "semantic_threshold": semantic_threshold,
+            "embedding_model": embedding_model,
+            "response_format": response_format,
+            "json_schema": json_schema,
+            "stream_json": stream_json,
         },)
 
 
@@ -371,6 +604,16 @@ class GeminiImageParams:
                 "aspect_ratio": (["1:1", "16:9", "4:3", "9:16", "3:4"], ),
                 "image_size": (["1K", "2K", "4K"], ),
                 "temperature": ("FLOAT", {"default": 1.0, "min": 0, "max": 1, "step": 0.05}),
+            },
+            "optional": {
+                # 请求体预算（0 = 不限制），超出时自动降采样/重压缩参考图像
+                "max_payload_mb": ("FLOAT", {"default": 20.0, "min": 0, "max": 500, "step": 0.5}),
+                "max_image_tokens": ("INT", {"default": 0, "min": 0, "max": 1000000}),
+                # 节点总截止时间（0 = 默认：聊天 180s，图片按尺寸 300/480/900s）与分离超时
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 7200}),
+                "connect_timeout": ("FLOAT", {"default": 10.0, "min": 1, "max": 120, "step": 1}),
+                "first_byte_timeout": ("FLOAT", {"default": 0.0, "min": 0, "max": 7200, "step": 1}),
+                "idle_timeout": ("FLOAT", {"default": 60.0, "min": 1, "max": 600, "step": 1}),
             }
         }
     
@@ -379,12 +622,19 @@ class GeminiImageParams:
     FUNCTION = "run"
     CATEGORY = "Gemini-LiteLLM/Config"
     
-    def run(self, base_config, aspect_ratio, image_size, temperature):
+    def run(self, base_config, aspect_ratio, image_size, temperature, max_payload_mb=20.0, max_image_tokens=0,
+            deadline=0, connect_timeout=10.0, first_byte_timeout=0.0, idle_timeout=60.0):
         return ({
             **base_config,
             "aspect_ratio": aspect_ratio,
             "image_size": image_size,
             "temperature": temperature,
+            "max_payload_mb": max_payload_mb,
+            "max_image_tokens": max_image_tokens,
+            "deadline": deadline,
+            "connect_timeout": connect_timeout,
+            "first_byte_timeout": first_byte_timeout,
+            "idle_timeout": idle_timeout,
             "use_gemini_image": True,  # 标记使用 Gemini 图片生成
         },)
 
@@ -393,6 +643,7 @@ NODE_CLASS_MAPPINGS = {
     # 执行节点
     "LLMChatGenerate": LLMChatGenerate,
     "LLMImageGenerate": LLMImageGenerate,
+    "LLMImageGenerateFiles": LLMImageGenerateFiles,
     
     # 配置节点
     "LLMBaseConfig": LLMBaseConfig,
@@ -404,6 +655,7 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     # 执行节点
     "LLMChatGenerate": "Chat",
     "LLMImageGenerate": "Image",
+    "LLMImageGenerateFiles": "Image Files",
     
     # 配置节点
     "LLMBaseConfig": "Base Config",
@@ -0,0 +1,228 @@
+"""
+ComfyUI Gemini Async Nodes
+Submit / Await 节点对：在后台发起 LLM 请求，让下游 GPU 采样与网络等待并行
+
+Architecture:
+- Submit Nodes: LLMChatSubmit, LLMImageSubmit, ORChatSubmit, ORImageSubmit
+  输入与对应执行节点完全相同，立即返回轻量句柄（编码 + 请求 + 重试均在后台线程完成）
+  ComfyUI 会缓存 Submit 的输出：失败 / 取消的句柄在之后的队列运行中由 Await 重新提交
+- Await Nodes: LLMAwaitText, LLMAwaitImage
+  在图中靠后的位置把句柄解析为 STRING / IMAGE
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    from .nodes import LLMChatGenerate, LLMImageGenerate
+    from .nodes_openrouter import ORChatGenerate, ORImageGenerate
+    from .llm_http import check_interrupt, Interrupted
+except ImportError:
+    from nodes import LLMChatGenerate, LLMImageGenerate
+    from nodes_openrouter import ORChatGenerate, ORImageGenerate
+    from llm_http import check_interrupt, Interrupted
+
+
+def _log(msg: str):
+    print(f"[LLM-Async] {msg}")
+
+
+# 并发上限：同时在途的后台请求数
+_MAX_WORKERS = 4
+# Await 节点检查中断的间隔（秒）
+_AWAIT_POLL = 0.2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_MAX_WORKERS, thread_name_prefix="llm-submit")
+        return _executor
+
+
+class LLMHandle:
+    """后台请求句柄（Future + 结果类型 + 重新提交所需的节点与参数）"""
+
+    def __init__(self, node_cls, kwargs: dict):
+        self.node_cls = node_cls
+        self.kwargs = kwargs
+        self.kind = node_cls.RETURN_TYPES[0]
+        self.label = node_cls.__name__
+        # 失败已经报告给某个 Await（之后的运行需要重新提交）
+        self.reported = False
+        self._lock = threading.Lock()
+        self.start()
+
+    def start(self) -> None:
+        """在后台线程执行 node_cls().run(**kwargs)"""
+        node_cls, kwargs, label = self.node_cls, self.kwargs, self.label
+
+        def task():
+            start = time.time()
+            try:
+                return node_cls().run(**kwargs)[0]
+            finally:
+                _log(f"{label} finished in {time.time() - start:.2f}s")
+
+        self.submitted_at = time.time()
+        self.reported = False
+        self.future = _get_executor().submit(task)
+
+    def refresh(self) -> None:
+        """上次请求失败（已报告）或被取消时重新提交：Submit 的输出被缓存，不会重新执行"""
+        with self._lock:
+            if not self.future.done() or self.future.cancelled():
+                return
+            error = self.future.exception()
+            if error is not None and (self.reported or isinstance(error, Interrupted)):
+                _log(f"Resubmitting {self.label} after previous failure: {error}")
+                self.start()
+
+    def __repr__(self):
+        state = "done" if self.future.done() else "pending"
+        return f"<LLMHandle {self.label} {self.kind} {state}>"
+
+
+def _submit(node_cls, kwargs: dict) -> LLMHandle:
+    return LLMHandle(node_cls, kwargs)
+
+
+def _resolve(handle, kind: str):
+    if not isinstance(handle, LLMHandle):
+        raise Exception(f"Expected LLM_HANDLE, got {type(handle).__name__}")
+    if handle.kind != kind:
+        raise Exception(f"Handle from {handle.label} yields {handle.kind}, not {kind}")
+    handle.refresh()
+    future = handle.future
+    if not future.done():
+        _log(f"Waiting for {handle.label}...")
+    start = time.time()
+    try:
+        # 分段等待，用户取消时立即返回（后台请求本身也会响应中断）
+        while not wait([future], timeout=_AWAIT_POLL).done:
+            check_interrupt()
+        result = future.result()
+    except BaseException:
+        # 本次运行已报告失败 / 取消，下次运行时重新提交而不是重复同一个错误
+        handle.reported = True
+        raise
+    waited = time.time() - start
+    if waited > 0.01:
+        _log(f"{handle.label} resolved after waiting {waited:.2f}s")
+    return result
+
+
+# ============ Submit 节点 ============
+
+class LLMChatSubmit(LLMChatGenerate):
+    """后台聊天请求（输入同 Chat）"""
+
+    RETURN_TYPES = ("LLM_HANDLE",)
+    RETURN_NAMES = ("handle",)
+    CATEGORY = "Gemini-Async"
+
+    def run(self, **kwargs):
+        return (_submit(LLMChatGenerate, kwargs),)
+
+
+class LLMImageSubmit(LLMImageGenerate):
+    """后台图片请求（输入同 Image）"""
+
+    RETURN_TYPES = ("LLM_HANDLE",)
+    RETURN_NAMES = ("handle",)
+    CATEGORY = "Gemini-Async"
+
+    def run(self, **kwargs):
+        return (_submit(LLMImageGenerate, kwargs),)
+
+
+class ORChatSubmit(ORChatGenerate):
+    """后台 OpenRouter 聊天请求（输入同 Chat (OpenRouter)）"""
+
+    RETURN_TYPES = ("LLM_HANDLE",)
+    RETURN_NAMES = ("handle",)
+    CATEGORY = "Gemini-Async"
+
+    def run(self, **kwargs):
+        return (_submit(ORChatGenerate, kwargs),)
+
+
+class ORImageSubmit(ORImageGenerate):
+    """后台 OpenRouter 图片请求（输入同 Image (OpenRouter)）"""
+
+    RETURN_TYPES = ("LLM_HANDLE",)
+    RETURN_NAMES = ("handle",)
+    CATEGORY = "Gemini-Async"
+
+    def run(self, **kwargs):
+        return (_submit(ORImageGenerate, kwargs),)
+
+
+# ============ Await 节点 ============
+
+class LLMAwaitText:
+    """等待句柄并输出文本"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "handle": ("LLM_HANDLE",),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Async"
+
+    def run(self, handle):
+        return (_resolve(handle, "STRING"),)
+
+
+class LLMAwaitImage:
+    """等待句柄并输出图像"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "handle": ("LLM_HANDLE",),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Async"
+
+    def run(self, handle):
+        return (_resolve(handle, "IMAGE"),)
+
+
+NODE_CLASS_MAPPINGS = {
+    # Submit 节点
+    "LLMChatSubmit": LLMChatSubmit,
+    "LLMImageSubmit": LLMImageSubmit,
+    "ORChatSubmit": ORChatSubmit,
+    "ORImageSubmit": ORImageSubmit,
+
+    # Await 节点
+    "LLMAwaitText": LLMAwaitText,
+    "LLMAwaitImage": LLMAwaitImage,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    # Submit 节点
+    "LLMChatSubmit": "Chat Submit",
+    "LLMImageSubmit": "Image Submit",
+    "ORChatSubmit": "Chat Submit (OpenRouter)",
+    "ORImageSubmit": "Image Submit (OpenRouter)",
+
+    # Await 节点
+    "LLMAwaitText": "Await Text",
+    "LLMAwaitImage": "Await Image",
+}
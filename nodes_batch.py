@@ -0,0 +1,254 @@
+"""
+ComfyUI Gemini Batch Nodes
+离线批处理节点：大批量打标 / 生成任务走 Batch API，不追求交互延迟，换取吞吐与成本
+
+Architecture:
+- Batch Nodes: LLMBatchChat, LLMBatchImage
+  请求体与 Chat / Image 节点完全相同（复用 build_payload），一次提交、轮询、按条目输出列表
+- Caption Nodes: LLMCaptionDirectory, ORCaptionDirectory
+  目录 → JSONL 打标，有界并发 + 断点续跑（也可命令行运行 llm_caption.py）
+"""
+
+import os
+
+import torch
+
+try:
+    from . import nodes as llm_nodes
+    from . import nodes_openrouter as or_nodes
+    from .nodes import LLMChatGenerate, LLMImageGenerate, _normalize_url
+    from .llm_batch import run_batch
+    from .llm_caption import CaptionPipeline, DEFAULT_OUTPUT, DEFAULT_PROMPT
+    from .llm_catalog import check_model
+    from .llm_structured import structured_result
+except ImportError:
+    import nodes as llm_nodes
+    import nodes_openrouter as or_nodes
+    from nodes import LLMChatGenerate, LLMImageGenerate, _normalize_url
+    from llm_batch import run_batch
+    from llm_caption import CaptionPipeline, DEFAULT_OUTPUT, DEFAULT_PROMPT
+    from llm_catalog import check_model
+    from llm_structured import structured_result
+
+
+def _log(msg: str):
+    print(f"[LLM-Batch] {msg}")
+
+
+def _items(prompts: str, images=None) -> list:
+    """按行拆分提示词并与图像批次配对，返回 [(prompt, image), ...]"""
+    lines = [p.strip() for p in (prompts or "").splitlines() if p.strip()]
+    if images is None:
+        return [(p, None) for p in lines]
+    frames = [images[i:i + 1] for i in range(images.shape[0])]
+    # 单个提示词：对每张图像使用同一提示词（打标）；否则逐行一一对应
+    if len(lines) <= 1:
+        return [(lines[0] if lines else "", f) for f in frames]
+    if len(lines) != len(frames):
+        raise Exception(f"Got {len(lines)} prompts for {len(frames)} images; use one prompt or one per image")
+    return list(zip(lines, frames))
+
+
+def _check_config(config: dict):
+    if not _normalize_url(config.get("api_base")) or not config.get("api_key") or not config.get("model"):
+        raise Exception("Missing API configuration")
+
+
+_BATCH_INPUTS = {
+    # 轮询起始间隔（秒），之后按倍数退避
+    "poll_interval": ("INT", {"default": 30, "min": 5, "max": 600}),
+    # 本次执行最长等待（秒），超时后重新执行会继续轮询同一任务；默认 1 小时，避免长时间占用 ComfyUI 执行队列
+    "max_wait": ("INT", {"default": 3600, "min": 60, "max": 172800}),
+    # 指定已有任务 ID（为空时按请求内容自动续接）
+    "batch_id": ("STRING", {"default": "", "multiline": False}),
+}
+
+
+# ============ 批处理节点 ============
+
+class LLMBatchChat:
+    """批量聊天（每行一个提示词，可与图像批次一一配对）"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "config": ("LLM_CHAT_CONFIG",),
+                "prompts": ("STRING", {"default": "Describe this image.", "multiline": True}),
+            },
+            "optional": {
+                "system": ("STRING", {"default": "", "multiline": True}),
+                "images": ("IMAGE",),
+                **_BATCH_INPUTS,
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("texts", "batch_id")
+    OUTPUT_IS_LIST = (True, False)
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Batch"
+
+    def run(self, config, prompts, system="", images=None, poll_interval=30, max_wait=3600, batch_id=""):
+        _check_config(config)
+        check_model(config, max_tokens=config.get("max_tokens", 2000))
+
+        node = LLMChatGenerate()
+        items = _items(prompts, images)
+        payloads = [node.build_payload(config, prompt, system, image) for prompt, image in items]
+        _log(f"Built {len(payloads)} chat requests")
+
+        batch_id, results = run_batch(config, payloads, poll_interval, max_wait, batch_id)
+        structured = bool(payloads) and "response_format" in payloads[0]
+        texts = []
+        for response, error in results:
+            if not error and structured:
+                # 结构化输出与 Chat 节点相同：本地修复 + schema 校验，不合格的条目输出错误
+                content = response.get("choices", [{}])[0].get("message", {}).get("content") or ""
+                try:
+                    texts.append(structured_result(content, config))
+                except Exception as e:
+                    texts.append(f"Error: {e}")
+                continue
+            texts.append(f"Error: {error}" if error else node.parse_response(response))
+        return (texts, batch_id)
+
+
+class LLMBatchImage:
+    """批量图片生成（每行一个提示词，可与参考图像批次一一配对）"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "config": ("LLM_IMAGE_CONFIG",),
+                "prompts": ("STRING", {"default": "A beautiful landscape", "multiline": True}),
+            },
+            "optional": {
+                "images": ("IMAGE",),
+                "additional_text": ("STRING", {"default": "", "multiline": True}),
+                **_BATCH_INPUTS,
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE", "STRING", "STRING")
+    RETURN_NAMES = ("images", "status", "batch_id")
+    OUTPUT_IS_LIST = (True, True, False)
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Batch"
+
+    def run(self, config, prompts, images=None, additional_text="", poll_interval=30, max_wait=3600, batch_id=""):
+        _check_config(config)
+        if not (config.get("use_gemini_image") and config.get("aspect_ratio") and config.get("image_size")):
+            raise Exception("Gemini config required")
+        check_model(config, need_image=True)
+
+        node = LLMImageGenerate()
+        items = _items(prompts, images)
+        payloads = [node.build_payload(config, prompt, image, additional_text=additional_text)
+                    for prompt, image in items]
+        _log(f"Built {len(payloads)} image requests")
+
+        batch_id, results = run_batch(config, payloads, poll_interval, max_wait, batch_id)
+        out_images, status = [], []
+        for response, error in results:
+            if not error:
+                try:
+                    out_images.append(node.parse_response(response))
+                    status.append("ok")
+                    continue
+                except Exception as e:
+                    error = str(e)
+            # 失败条目输出占位黑图，保持与输入顺序一一对应
+            out_images.append(torch.zeros((1, 64, 64, 3), dtype=torch.float32))
+            status.append(f"error: {error}")
+        failed = sum(1 for s in status if s != "ok")
+        if failed:
+            _log(f"{failed}/{len(status)} items failed")
+        return (out_images, status, batch_id)
+
+
+# ============ 打标节点 ============
+
+class LLMCaptionDirectory:
+    """目录批量打标，结果追加写入 JSONL（重新执行时跳过已完成的图像）"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "config": ("LLM_CHAT_CONFIG",),
+                "directory": ("STRING", {"default": "", "multiline": False}),
+                "prompt": ("STRING", {"default": DEFAULT_PROMPT, "multiline": True}),
+            },
+            "optional": {
+                "system": ("STRING", {"default": "", "multiline": True}),
+                # 为空时写入 <directory>/captions.jsonl
+                "output_file": ("STRING", {"default": "", "multiline": False}),
+                "workers": ("INT", {"default": 4, "min": 1, "max": 32}),
+                "recursive": ("BOOLEAN", {"default": True}),
+                # 本次最多处理的新图像数，0 表示全部
+                "limit": ("INT", {"default": 0, "min": 0, "max": 10000000}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("report", "output_file")
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Batch"
+    OUTPUT_NODE = True
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # 目录内容可能变化，每次都执行（已完成的条目会被跳过）
+        return float("nan")
+
+    def _pipeline(self, config):
+        return CaptionPipeline(config, llm_nodes._request, llm_nodes._headers)
+
+    def run(self, config, directory, prompt, system="", output_file="", workers=4, recursive=True, limit=0):
+        _check_config(config)
+        check_model(config, max_tokens=config.get("max_tokens", 2000))
+        directory = os.path.expanduser(directory.strip())
+        output = os.path.expanduser(output_file.strip()) or os.path.join(directory, DEFAULT_OUTPUT)
+
+        stats = self._pipeline(config).run(directory, output, prompt, system, workers, recursive, limit)
+        report = (f"{stats['done']} captioned, {stats['failed']} failed, "
+                  f"{stats['skipped']} already done -> {output}")
+        return {"ui": {"text": [report]}, "result": (report, output)}
+
+
+class ORCaptionDirectory(LLMCaptionDirectory):
+    """目录批量打标（OpenRouter）"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        types = super().INPUT_TYPES()
+        types["required"]["config"] = ("OR_CHAT_CONFIG",)
+        return types
+
+    def _pipeline(self, config):
+        def make_headers(api_key):
+            return or_nodes._headers(api_key, config.get("site_url", ""), config.get("site_name", ""))
+        return CaptionPipeline(config, or_nodes._request, make_headers, {"usage": {"include": True}})
+
+
+NODE_CLASS_MAPPINGS = {
+    # 批处理节点
+    "LLMBatchChat": LLMBatchChat,
+    "LLMBatchImage": LLMBatchImage,
+
+    # 打标节点
+    "LLMCaptionDirectory": LLMCaptionDirectory,
+    "ORCaptionDirectory": ORCaptionDirectory,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    # 批处理节点
+    "LLMBatchChat": "Batch Chat",
+    "LLMBatchImage": "Batch Image",
+
+    # 打标节点
+    "LLMCaptionDirectory": "Caption Directory",
+    "ORCaptionDirectory": "Caption Directory (OpenRouter)",
+}
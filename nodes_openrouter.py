@@ -3,9 +3,9 @@ ComfyUI Gemini OpenRouter Nodes
 Gemini 3 聊天和图片生成（通过 OpenRouter API）
 
 Architecture:
-- Execution Nodes: ORChatGenerate, ORImageGenerate
+- Execution Nodes: ORChatGenerate, ORImageGenerate, ORImageGenerateFiles
 - Config Nodes: ORBaseConfig, ORChatParams, ORImageParams
-- Zero external dependencies (urllib only)
+- Zero external dependencies (standard library only)
 
 Author: ZUENS2020
 Version: 1.0.0
@@ -15,7 +15,6 @@ Date: 2026-01-28
 import json
 import base64
 import urllib.request
-import urllib.error
 from typing import Any
 from io import BytesIO
 import numpy as np
@@ -23,6 +22,35 @@ import torch
 from PIL import Image
 import time
 
+try:
+    from .llm_payload import collect_images, build_image_parts, budget_from_config
+    from .llm_payload import stream_image_parts, settle_payload, encode_body, PayloadOverflow
+    from .llm_payload import select_frames, frame_options_from_config, FRAME_SAMPLING_MODES
+    from .llm_files import ReferenceUploader, UPLOAD_MODES
+    from .llm_usage import record_call
+    from .llm_catalog import check_model
+    from .llm_http import send, timeouts_from_config, DeadlineExceeded, HTTPStatusError, Interrupted, prewarm_connections
+    from .llm_http import CHAT_DEADLINE, IMAGE_DEADLINES, RETRY_BACKOFF
+    from .llm_keys import key_pool, resolve_keys
+    from .llm_output import save_response_images, output_dir, image_urls
+    from .llm_semantic import semantic_probe, DEFAULT_THRESHOLD
+    from .llm_structured import response_format_payload, streams_json, structured_stream, structured_result
+    from .llm_structured import RESPONSE_FORMATS
+except ImportError:
+    from llm_payload import collect_images, build_image_parts, budget_from_config
+    from llm_payload import stream_image_parts, settle_payload, encode_body, PayloadOverflow
+    from llm_payload import select_frames, frame_options_from_config, FRAME_SAMPLING_MODES
+    from llm_files import ReferenceUploader, UPLOAD_MODES
+    from llm_usage import record_call
+    from llm_catalog import check_model
+    from llm_http import send, timeouts_from_config, DeadlineExceeded, HTTPStatusError, Interrupted, prewarm_connections
+    from llm_http import CHAT_DEADLINE, IMAGE_DEADLINES, RETRY_BACKOFF
+    from llm_keys import key_pool, resolve_keys
+    from llm_output import save_response_images, output_dir, image_urls
+    from llm_semantic import semantic_probe, DEFAULT_THRESHOLD
+    from llm_structured import response_format_payload, streams_json, structured_stream, structured_result
+    from llm_structured import RESPONSE_FORMATS
+
 
 def _log(msg: str):
     """打印详细日志"""
@@ -44,13 +72,6 @@ def _log_step(step: str, details: str = ""):
         print(f"[OpenRouter STEP] {step}")
 
 
-def _safe_key(key: str) -> str:
-    k = key or ""
-    if len(k) <= 6:
-        return "***"
-    return f"{k[:3]}***{k[-3:]}"
-
-
 def _normalize_url(url: str) -> str:
     """标准化 URL"""
     return (url or "").strip().rstrip("/")
@@ -69,66 +90,66 @@ def _headers(key: str, site_url: str = "", site_name: str = "") -> dict:
     return {k: v for k, v in headers.items() if v}
 
 
-def _request(method: str, url: str, headers: dict, data: dict = None, timeout: int = 120) -> Any:
-    """HTTP 请求"""
+def _request(method: str, url: str, headers: dict, data: dict = None, timeouts=None, deadline=None,
+             workflow: str = "", stream=None) -> Any:
+    """HTTP 请求（分离的连接/首字节/空闲超时，受节点截止时间约束；同时记录用量 / 成本 / 延迟）
+
+    stream 为 llm_structured.StructuredStream 时按 SSE 增量解析响应，返回组装后的完整响应。
+    """
     start_time = time.time()
     _log_debug(f"_request called: {method} {url}")
-    _log_debug(f"Timeout: {timeout}s")
+    _log_debug(f"{timeouts}, deadline remaining: {deadline.remaining() if deadline else 'none'}")
 
-    body = json.dumps(data).encode() if data else None
-    if body:
+    # 含后台编码中的参考图像时为流式请求体（分块上传）
+    body = encode_body(data, deadline)
+    if isinstance(body, bytes):
         _log_debug(f"Request body size: {len(body)} bytes")
-
-    req = urllib.request.Request(url, body, headers, method=method)
-    _log_debug("Request object created")
+    elif body is not None:
+        _log_debug(f"Streaming request body ({len(body.images)} image(s) encoding in background)")
 
     try:
         _log_debug(f"Opening connection to {url}...")
-        connection_start = time.time()
+        _, resp_headers, response_body = send(method, url, headers, body, timeouts, deadline,
+                                              on_chunk=stream.feed if stream is not None else None)
+        _log_debug(f"Response received in {time.time() - start_time:.2f}s")
+        _log_debug(f"Response headers: {resp_headers}")
+        _log_debug(f"Response body size: {len(response_body)} bytes")
 
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            connection_time = time.time() - connection_start
-            _log_debug(f"Connection established in {connection_time:.2f}s")
-            _log_debug(f"Response received, status code: {r.status}")
-            _log_debug(f"Response headers: {dict(r.headers)}")
+        _log_debug("Parsing JSON response...")
+        parse_start = time.time()
+        result = stream.result(response_body) if stream is not None else json.loads(response_body.decode())
+        parse_time = time.time() - parse_start
+        _log_debug(f"JSON parsed successfully in {parse_time:.2f}s")
 
-            read_start = time.time()
-            response_body = r.read()
-            read_time = time.time() - read_start
-            _log_debug(f"Response body size: {len(response_body)} bytes (read in {read_time:.2f}s)")
+        total_time = time.time() - start_time
+        _log_debug(f"Total request time: {total_time:.2f}s")
 
-            _log_debug("Parsing JSON response...")
-            parse_start = time.time()
-            result = json.loads(response_body.decode())
-            parse_time = time.time() - parse_start
-            _log_debug(f"JSON parsed successfully in {parse_time:.2f}s")
+        record_call(url, data, result, resp_headers, total_time, workflow)
+        return result
 
-            total_time = time.time() - start_time
-            _log_debug(f"Total request time: {total_time:.2f}s")
+    except HTTPStatusError as e:
+        _log_error(f"HTTP Error {e.code}")
+        _log_error(f"Error body: {e.body[:500]}")
+        record_call(url, data, latency=time.time() - start_time, workflow=workflow, error=f"HTTP {e.code}")
+        raise
 
-            return result
+    except (DeadlineExceeded, Interrupted, PayloadOverflow) as e:
+        elapsed = time.time() - start_time
+        _log_error(f"{e} (request ran {elapsed:.2f}s)")
+        record_call(url, data, latency=elapsed, workflow=workflow, error=str(e))
+        raise
 
-    except urllib.error.HTTPError as e:
-        _log_error(f"HTTP Error {e.code}")
-        try:
-            err_body = e.read().decode()
-            _log_error(f"Error body: {err_body[:500]}")
-        except:
-            err_body = str(e.reason)
-            _log_error(f"Error reason: {err_body}")
-        raise Exception(f"HTTP {e.code}: {err_body}")
-
-    except urllib.error.URLError as e:
+    except (TimeoutError, OSError) as e:
         elapsed = time.time() - start_time
-        _log_error(f"URL Error after {elapsed:.2f}s: {e.reason}")
-        if isinstance(e.reason, TimeoutError):
-            _log_error(f"Request timed out after {timeout}s")
-        raise Exception(f"Connection failed: {e.reason}")
+        _log_error(f"Connection error after {elapsed:.2f}s: {e}")
+        record_call(url, data, latency=elapsed, workflow=workflow, error=str(e))
+        raise Exception(f"Connection failed: {e}")
 
     except Exception as e:
         elapsed = time.time() - start_time
         _log_error(f"Request failed after {elapsed:.2f}s: {type(e).__name__}")
         _log_error(f"Error message: {str(e)}")
+        record_call(url, data, latency=elapsed, workflow=workflow, error=str(e))
         raise Exception(str(e))
 
 
@@ -177,18 +198,20 @@ class ORChatGenerate:
             _log("Chat error: missing base/key/model")
             return ("Error: Missing parameters",)
 
-        # 收集多路图像输入
-        image_inputs = [image_1, image_2, image_3, image_4, image_5]
-        image_list = []
-        for img in image_inputs:
-            if img is None:
-                continue
-            if len(img.shape) == 3:
-                image_list.append(img)
-            else:
-                # 若是批次，逐张展开加入列表
-                for i in range(img.shape[0]):
-                    image_list.append(img[i])
+        # 节点总截止时间：贯穿编码、请求、重试与退避
+        timeouts, deadline = timeouts_from_config(config, CHAT_DEADLINE)
+
+        # 编码前按缓存的模型目录预检（模型名 / 输出长度）
+        check_model(config, max_tokens=max_tokens)
+
+        # 语义缓存：纯文本提示词与已缓存的近似时直接返回，不发送请求
+        probe = semantic_probe(config, prompt, system, [image_1, image_2, image_3, image_4, image_5],
+                               timeouts, deadline)
+        if probe is not None and probe.answer is not None:
+            return (probe.answer,)
+
+        # 收集多路图像输入（帧采样 + 去重，只发送最少的不同图像）
+        image_list = select_frames([image_1, image_2, image_3, image_4, image_5], **frame_options_from_config(config))
 
         msgs = []
         if system.strip():
@@ -199,18 +222,20 @@ class ORChatGenerate:
         if prompt.strip():
             user_content.append({"type": "text", "text": prompt.strip()})
 
-        # 添加参考图像
-        if image_list:
-            for img_tensor in image_list:
-                img_np = (img_tensor.cpu().numpy() * 255).astype(np.uint8)
-                pil_img = Image.fromarray(img_np)
-                buffered = BytesIO()
-                pil_img.save(buffered, format="PNG")
-                img_b64 = base64.b64encode(buffered.getvalue()).decode()
-                user_content.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                })
+        # 添加参考图像（发送前预算检查，超出时自动降采样/重压缩；stream_upload 时后台编码、分块上传）
+        max_bytes, max_image_tokens = budget_from_config(config)
+        # 参考图像用第一次请求的 key 上传（files_api 文件归属于上传账号）
+        keys = key_pool(config)
+        api_key = keys.acquire()
+        uploader = ReferenceUploader(config, api_key, timeouts, deadline)
+        if config.get("stream_upload", False) and uploader.mode == "inline":
+            user_content.extend(stream_image_parts(image_list, max_bytes, max_image_tokens))
+        else:
+            user_content.extend(build_image_parts(
+                image_list, max_bytes, max_image_tokens,
+                make_part=uploader.part,
+                reserved_bytes=len(json.dumps(msgs + [user_content]).encode()),
+            ))
 
         # 如果没有内容，使用默认提示词（保持为列表格式）
         if not user_content:
@@ -218,29 +243,69 @@ class ORChatGenerate:
 
         msgs.append({"role": "user", "content": user_content})
 
-        # 重试机制
+        # 结构化输出（json_object / json_schema）；流式时 usage 在最后一个事件中返回
+        response_format = response_format_payload(config)
+        stream_json = streams_json(config)
+
+        deadline.check("encoding")
+
+        # 重试机制（退避等待同样受截止时间约束；多 key 时被限流的 key 立即换下一个）
+        # 常规失败共 2 次尝试；只有限流 / 鉴权失败的 key 被换下时才追加一次（最多每个 key 一次）
         max_retries = 2
-        for attempt in range(max_retries):
+        for attempt in range(1 + max(len(keys), 1)):
+            if attempt:
+                api_key = keys.acquire()
+                uploader.bind(api_key)
             try:
                 payload = {
                     "model": model,
                     "messages": msgs,
                     "temperature": temperature,
-                    "max_tokens": max_tokens
+                    "max_tokens": max_tokens,
+                    # 返回 usage.cost 等用量信息
+                    "usage": {"include": True}
                 }
+                if response_format:
+                    payload["response_format"] = response_format
+                    payload["stream"] = stream_json
                 res = _request("POST", f"{base}/chat/completions",
                              _headers(api_key, config.get("site_url", ""), config.get("site_name", "")),
-                             payload, timeout=120)
+                             payload, timeouts=timeouts, deadline=deadline, workflow=config.get("workflow_tag", ""),
+                             stream=structured_stream(config))
+                keys.report(api_key)
                 txt = res.get("choices", [{}])[0].get("message", {}).get("content", "")
+                if response_format:
+                    # 结构化输出先在本地修复 / 校验，无法修复时才重新请求
+                    txt = structured_result(txt or "", config)
                 if txt:
+                    if probe is not None:
+                        probe.store(txt)
                     return (txt,)
                 return ("No response from model",)
             except Exception as e:
+                if isinstance(e, PayloadOverflow) or "HTTP 411" in str(e):
+                    # 流式上传超出字节预算 / 端点不接受分块上传：改为预先编码后立即重发
+                    if settle_payload(payload):
+                        _log(f"Streaming upload failed ({e}), resending pre-encoded body")
+                        if attempt < max_retries - 1:
+                            continue
+                rotated = keys.report(api_key, e) and keys.available()
+                if rotated:
+                    max_retries = min(max_retries + 1, 1 + len(keys))
+                if isinstance(e, (DeadlineExceeded, Interrupted)):
+                    _log_error(f"{e}, giving up")
+                    raise
+                if "HTTP 413" in str(e):
+                    # 同一载荷重发必然再次失败
+                    _log_error(f"Payload too large: {e}")
+                    raise Exception(f"Request body too large for endpoint (HTTP 413), lower max_payload_mb: {e}")
                 if attempt == max_retries - 1:
                     _log(f"Chat error (final): {e}")
                     raise Exception(f"Failed to get response after {max_retries} attempts: {e}")
                 else:
                     _log(f"Chat retry {attempt + 1}/{max_retries} due to: {e}")
+                    if not rotated:
+                        deadline.sleep(RETRY_BACKOFF * (attempt + 1))
 
 
 class ORImageGenerate:
@@ -268,7 +333,113 @@ class ORImageGenerate:
     FUNCTION = "run"
     CATEGORY = "Gemini-OpenRouter"
 
-    def run(self, config, prompt, n, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, additional_text=""):
+    def _result(self, res: dict, n: int, filename_prefix: str = ""):
+        """解码响应中的图像，返回 ([N,H,W,3] 张量,)（n > 1 时复制第一张；filename_prefix 供文件输出节点使用）"""
+        if "error" in res:
+            err_msg = res.get("error", {}).get("message", "image generation failed")
+            _log_error(f"API returned error: {err_msg}")
+            raise Exception(err_msg)
+
+        if not res.get("choices"):
+            _log_error(f"Empty response: {str(res)[:200]}")
+            raise Exception(f"empty response: {res}")
+
+        _log_debug(f"Choices in response: {len(res.get('choices', []))}")
+
+        imgs = []
+        message = res["choices"][0].get("message", {})
+        images = message.get("images", [])
+
+        _log_step("Images in response", f"Count: {len(images)}")
+
+        if not images and message.get("content"):
+            _log_error("Model returned text instead of image")
+            _log_debug(f"Text content: {message.get('content', '')[:200]}")
+            raise Exception("Model returned text instead of image. Use simpler image description.")
+
+        _log_step("Processing images", f"Processing {len(images)} image(s)")
+
+        for i, img_item in enumerate(images):
+            _log_debug(f"\nImage {i+1}:")
+            _log_debug(f"  Type: {type(img_item)}")
+
+            # OpenRouter 返回格式:
+            # 1. 字符串: "data:image/png;base64,..."
+            # 2. 对象: {"type": "image_url", "image_url": {"url": "data:image/png;base64,..."}}
+
+            if isinstance(img_item, str):
+                # 格式 1: 直接的 data URL 字符串
+                img_url = img_item
+                _log_debug(f"  Format: String (data URL)")
+            elif isinstance(img_item, dict):
+                # 格式 2: 对象格式
+                if "url" in img_item:
+                    img_url = img_item["url"]
+                    _log_debug(f"  Format: Dict with 'url' key")
+                elif "image_url" in img_item:
+                    image_url_obj = img_item["image_url"]
+                    if isinstance(image_url_obj, dict):
+                        img_url = image_url_obj.get("url", "")
+                        _log_debug(f"  Format: Dict with nested 'image_url.url'")
+                    else:
+                        img_url = image_url_obj
+                        _log_debug(f"  Format: Dict with 'image_url' as string")
+                else:
+                    img_url = ""
+                    _log_debug(f"  Format: Unknown dict structure")
+                    _log_debug(f"  Keys: {list(img_item.keys())}")
+            else:
+                _log_debug(f"  Format: Unsupported type")
+                continue
+
+            if img_url and img_url.startswith("data:image/"):
+                _log_debug(f"  URL prefix: {img_url[:60]}...")
+                b64_data = img_url.split(",", 1)[1] if "," in img_url else img_url
+                _log_debug(f"  Base64 length: {len(b64_data)} chars")
+
+                try:
+                    data = base64.b64decode(b64_data)
+                    _log_debug(f"  Decoded size: {len(data)} bytes")
+                    _log_debug(f"  Decoded successfully")
+
+                    pil = Image.open(BytesIO(data)).convert("RGB")
+                    _log_debug(f"  PIL Image size: {pil.size}")
+
+                    arr = np.array(pil).astype(np.float32) / 255.0
+                    _log_debug(f"  Numpy array shape: {arr.shape}")
+                    _log_debug(f"  Numpy array dtype: {arr.dtype}")
+                    _log_debug(f"  Value range: [{arr.min():.3f}, {arr.max():.3f}]")
+
+                    imgs.append(torch.from_numpy(arr))
+                    _log_debug(f"  Converted to tensor successfully")
+
+                except Exception as e:
+                    _log_error(f"Failed to decode image {i+1}: {e}")
+                    raise
+            else:
+                _log_error(f"Invalid data URL format")
+                if not img_url:
+                    _log_debug("Reason: Empty URL")
+                else:
+                    _log_debug(f"Reason: {img_url[:100]}")
+
+        if imgs:
+            result = torch.stack(imgs)
+            _log_step("Stacking images", f"Result shape: {result.shape}")
+
+            # 如果 n > 1，复制第一张图像
+            for _ in range(n - 1):
+                result = torch.cat([result, result[:1]], dim=0)
+            _log_step("Final result", f"Shape: {result.shape}, n={n}")
+
+            _log_step("SUCCESS", f"Generated {len(imgs)} image(s)")
+            return (result,)
+        else:
+            _log_error("No images were processed successfully")
+            raise Exception("Failed to process any images")
+
+    def run(self, config, prompt, n, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, additional_text="",
+            filename_prefix=""):
         _log_step("START", "ORImageGenerate.run() called")
         _log_debug(f"prompt: {prompt[:100]}...")
         _log_debug(f"n: {n}")
@@ -295,216 +466,172 @@ class ORImageGenerate:
 
         _log_step("Config check", "All required parameters present")
 
-        # 重试机制
-        max_retries = 2
-        for attempt in range(max_retries):
-            try:
-                _log_step(f"Attempt {attempt + 1}/{max_retries}")
+        # 节点总截止时间：贯穿编码、请求、重试与退避（默认按图像尺寸 1K/2K/4K: 5/8/15 分钟）
+        timeouts, deadline = timeouts_from_config(config, IMAGE_DEADLINES.get(image_size, IMAGE_DEADLINES["1K"]))
+        _log_debug(f"{timeouts}, deadline: {deadline.seconds:.0f}s")
 
-                # 收集多路图像输入
-                image_inputs = [image_1, image_2, image_3, image_4, image_5]
-                image_list = []
-                for i, img in enumerate(image_inputs):
-                    if img is None:
-                        continue
-                    _log_debug(f"Processing reference image {i+1}")
-                    if len(img.shape) == 3:
-                        image_list.append(img)
-                        _log_debug(f"  Added as single image, shape: {img.shape}")
-                    else:
-                        # 若是批次，逐张展开加入列表
-                        for j in range(img.shape[0]):
-                            image_list.append(img[j])
-                        _log_debug(f"  Expanded batch, added {img.shape[0]} images")
-
-                _log_step("Reference images", f"Total: {len(image_list)}")
-
-                # 构建多模态消息内容
-                content = []
-                if prompt.strip():
-                    content.append({"type": "text", "text": prompt.strip()})
-                    _log_debug(f"Added prompt text: {len(prompt.strip())} chars")
-
-                if image_list:
-                    _log_step("Encoding reference images", f"Count: {len(image_list)}")
-                    for i, img_tensor in enumerate(image_list):
-                        _log_debug(f"  Encoding image {i+1}/{len(image_list)}")
-                        img_np = (img_tensor.cpu().numpy() * 255).astype(np.uint8)
-                        pil_img = Image.fromarray(img_np)
-                        buffered = BytesIO()
-                        pil_img.save(buffered, format="PNG")
-                        img_b64 = base64.b64encode(buffered.getvalue()).decode()
-                        _log_debug(f"    Base64 size: {len(img_b64)} chars")
-                        content.append({
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/png;base64,{img_b64}"}
-                        })
-                        _log_debug(f"    Image {i+1} encoded successfully")
-
-                if additional_text.strip():
-                    content.append({"type": "text", "text": additional_text.strip()})
-                    _log_debug(f"Added additional text: {len(additional_text.strip())} chars")
-
-                # 如果没有内容，使用默认提示词（保持为列表格式）
-                if not content:
-                    content = [{"type": "text", "text": "Generate a beautiful landscape"}]
-                    _log_debug("Using default prompt")
-
-                _log_step("Content built", f"Items: {len(content)}")
-
-                # 构建基础 payload
-                payload = {
-                    "model": model,
-                    "messages": [{"role": "user", "content": content}],
-                    "temperature": temperature
-                }
+        # 编码前按缓存的模型目录预检（模型名 / 图像输出）
+        check_model(config, need_image=True)
+        _log_step("Model check", "Passed")
 
-                # 添加 modalities 参数（用于图像生成）
-                payload["modalities"] = ["image", "text"]
-                _log_debug(f"modalities: {payload['modalities']}")
+        # 收集多路图像输入
+        image_list = []
+        for i, img in enumerate([image_1, image_2, image_3, image_4, image_5]):
+            if img is None:
+                continue
+            _log_debug(f"Processing reference image {i+1}, shape: {img.shape}")
+            image_list.extend(collect_images([img]))
 
-                # 添加 Gemini image_config
-                if aspect_ratio:
-                    payload["image_config"] = payload.get("image_config", {})
-                    payload["image_config"]["aspect_ratio"] = aspect_ratio
-                    _log_debug(f"aspect_ratio: {aspect_ratio}")
+        _log_step("Reference images", f"Total: {len(image_list)}")
 
-                if image_size:
-                    payload["image_config"] = payload.get("image_config", {})
-                    payload["image_config"]["image_size"] = image_size
-                    _log_debug(f"image_size: {image_size}")
+        # 构建多模态消息内容
+        content = []
+        if prompt.strip():
+            content.append({"type": "text", "text": prompt.strip()})
+            _log_debug(f"Added prompt text: {len(prompt.strip())} chars")
 
-                _log_step("Sending request", f"URL: {base}/chat/completions")
-                _log_debug(f"Payload size: {len(json.dumps(payload))} bytes")
+        text_parts = []
+        if additional_text.strip():
+            text_parts.append({"type": "text", "text": additional_text.strip()})
+            _log_debug(f"Added additional text: {len(additional_text.strip())} chars")
 
-                headers = _headers(api_key, config.get("site_url", ""), config.get("site_name", ""))
-                _log_debug(f"Request headers: {list(headers.keys())}")
+        # 参考图像用第一次请求的 key 上传（files_api 文件归属于上传账号）
+        keys = key_pool(config)
+        api_key = keys.acquire()
+        uploader = ReferenceUploader(config, api_key, timeouts, deadline)
 
-                # 根据图像尺寸调整超时时间
-                # 1K: 3分钟, 2K: 5分钟, 4K: 10分钟
-                if image_size == "4K":
-                    timeout = 600  # 10分钟
-                    _log_debug(f"Using extended timeout for 4K: {timeout}s")
-                elif image_size == "2K":
-                    timeout = 300  # 5分钟
-                    _log_debug(f"Using extended timeout for 2K: {timeout}s")
-                else:
-                    timeout = 180  # 3分钟
-                    _log_debug(f"Using standard timeout: {timeout}s")
+        # 参考图像只编码一次，重试时复用（发送前预算检查，超出时自动降采样/重压缩）
+        if image_list:
+            _log_step("Encoding reference images", f"Count: {len(image_list)}")
+            max_bytes, max_image_tokens = budget_from_config(config)
+            if config.get("stream_upload", False) and uploader.mode == "inline":
+                # 后台编码，请求体分块上传（上传第 k 张的同时编码第 k+1 张）
+                image_parts = stream_image_parts(image_list, max_bytes, max_image_tokens)
+                _log_debug(f"  Streaming upload: {len(image_parts)} image(s) encoding in background")
+            else:
+                image_parts = build_image_parts(
+                    image_list, max_bytes, max_image_tokens,
+                    make_part=uploader.part,
+                    reserved_bytes=len(json.dumps(content + text_parts).encode()),
+                )
+                for i, part in enumerate(image_parts):
+                    _log_debug(f"  Image {i+1} part size: {len(json.dumps(part))} chars")
+            content.extend(image_parts)
+        content.extend(text_parts)
 
-                res = _request("POST", f"{base}/chat/completions", headers, payload, timeout=timeout)
+        # 如果没有内容，使用默认提示词（保持为列表格式）
+        if not content:
+            content = [{"type": "text", "text": "Generate a beautiful landscape"}]
+            _log_debug("Using default prompt")
 
-                _log_step("Response received", f"Status: Success")
+        _log_step("Content built", f"Items: {len(content)}")
 
-                if "error" in res:
-                    err_msg = res.get("error", {}).get("message", "image generation failed")
-                    _log_error(f"API returned error: {err_msg}")
-                    raise Exception(err_msg)
-
-                if not res.get("choices"):
-                    _log_error(f"Empty response: {str(res)[:200]}")
-                    raise Exception(f"empty response: {res}")
-
-                _log_debug(f"Choices in response: {len(res.get('choices', []))}")
-
-                imgs = []
-                message = res["choices"][0].get("message", {})
-                images = message.get("images", [])
-
-                _log_step("Images in response", f"Count: {len(images)}")
-
-                if not images and message.get("content"):
-                    _log_error("Model returned text instead of image")
-                    _log_debug(f"Text content: {message.get('content', '')[:200]}")
-                    raise Exception("Model returned text instead of image. Use simpler image description.")
-
-                _log_step("Processing images", f"Processing {len(images)} image(s)")
-
-                for i, img_item in enumerate(images):
-                    _log_debug(f"\nImage {i+1}:")
-                    _log_debug(f"  Type: {type(img_item)}")
-
-                    # OpenRouter 返回格式:
-                    # 1. 字符串: "data:image/png;base64,..."
-                    # 2. 对象: {"type": "image_url", "image_url": {"url": "data:image/png;base64,..."}}
-
-                    if isinstance(img_item, str):
-                        # 格式 1: 直接的 data URL 字符串
-                        img_url = img_item
-                        _log_debug(f"  Format: String (data URL)")
-                    elif isinstance(img_item, dict):
-                        # 格式 2: 对象格式
-                        if "url" in img_item:
-                            img_url = img_item["url"]
-                            _log_debug(f"  Format: Dict with 'url' key")
-                        elif "image_url" in img_item:
-                            image_url_obj = img_item["image_url"]
-                            if isinstance(image_url_obj, dict):
-                                img_url = image_url_obj.get("url", "")
-                                _log_debug(f"  Format: Dict with nested 'image_url.url'")
-                            else:
-                                img_url = image_url_obj
-                                _log_debug(f"  Format: Dict with 'image_url' as string")
-                        else:
-                            img_url = ""
-                            _log_debug(f"  Format: Unknown dict structure")
-                            _log_debug(f"  Keys: {list(img_item.keys())}")
-                    else:
-                        _log_debug(f"  Format: Unsupported type")
-                        continue
+        # 构建基础 payload
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": content}],
+            "temperature": temperature,
+            # 返回 usage.cost 等用量信息
+            "usage": {"include": True}
+        }
 
-                    if img_url and img_url.startswith("data:image/"):
-                        _log_debug(f"  URL prefix: {img_url[:60]}...")
-                        b64_data = img_url.split(",", 1)[1] if "," in img_url else img_url
-                        _log_debug(f"  Base64 length: {len(b64_data)} chars")
+        # 添加 modalities 参数（用于图像生成）
+        payload["modalities"] = ["image", "text"]
+        _log_debug(f"modalities: {payload['modalities']}")
 
-                        try:
-                            data = base64.b64decode(b64_data)
-                            _log_debug(f"  Decoded size: {len(data)} bytes")
-                            _log_debug(f"  Decoded successfully")
+        # 添加 Gemini image_config
+        if aspect_ratio:
+            payload["image_config"] = payload.get("image_config", {})
+            payload["image_config"]["aspect_ratio"] = aspect_ratio
+            _log_debug(f"aspect_ratio: {aspect_ratio}")
 
-                            pil = Image.open(BytesIO(data)).convert("RGB")
-                            _log_debug(f"  PIL Image size: {pil.size}")
+        if image_size:
+            payload["image_config"] = payload.get("image_config", {})
+            payload["image_config"]["image_size"] = image_size
+            _log_debug(f"image_size: {image_size}")
 
-                            arr = np.array(pil).astype(np.float32) / 255.0
-                            _log_debug(f"  Numpy array shape: {arr.shape}")
-                            _log_debug(f"  Numpy array dtype: {arr.dtype}")
-                            _log_debug(f"  Value range: [{arr.min():.3f}, {arr.max():.3f}]")
+        deadline.check("encoding")
 
-                            imgs.append(torch.from_numpy(arr))
-                            _log_debug(f"  Converted to tensor successfully")
+        # 重试机制（退避等待同样受截止时间约束；多 key 时被限流的 key 立即换下一个）
+        # 常规失败共 2 次尝试；只有限流 / 鉴权失败的 key 被换下时才追加一次（最多每个 key 一次）
+        max_retries = 2
+        for attempt in range(1 + max(len(keys), 1)):
+            if attempt:
+                api_key = keys.acquire()
+                uploader.bind(api_key)
+            try:
+                _log_step(f"Attempt {attempt + 1}/{max_retries}")
 
-                        except Exception as e:
-                            _log_error(f"Failed to decode image {i+1}: {e}")
-                            raise
-                    else:
-                        _log_error(f"Invalid data URL format")
-                        if not img_url:
-                            _log_debug("Reason: Empty URL")
-                        else:
-                            _log_debug(f"Reason: {img_url[:100]}")
-
-                if imgs:
-                    result = torch.stack(imgs)
-                    _log_step("Stacking images", f"Result shape: {result.shape}")
-
-                    # 如果 n > 1，复制第一张图像
-                    for _ in range(n - 1):
-                        result = torch.cat([result, result[:1]], dim=0)
-                    _log_step("Final result", f"Shape: {result.shape}, n={n}")
-
-                    _log_step("SUCCESS", f"Generated {len(imgs)} image(s)")
-                    return (result,)
-                else:
-                    _log_error("No images were processed successfully")
+                _log_step("Sending request", f"URL: {base}/chat/completions")
+                _log_debug(f"Payload size: {len(json.dumps(payload, default=lambda o: ''))} bytes")
+
+                headers = _headers(api_key, config.get("site_url", ""), config.get("site_name", ""))
+                _log_debug(f"Request headers: {list(headers.keys())}")
+
+                res = _request("POST", f"{base}/chat/completions", headers, payload,
+                               timeouts=timeouts, deadline=deadline, workflow=config.get("workflow_tag", ""))
+                keys.report(api_key)
+
+                _log_step("Response received", f"Status: Success")
+
+                # 响应里没有图像时照常重试；解码 / 写盘在重试之外，本地错误不会触发再次付费生成
+                if not image_urls(res):
                     raise Exception("Failed to process any images")
+                break
             except Exception as e:
+                if isinstance(e, PayloadOverflow) or "HTTP 411" in str(e):
+                    # 流式上传超出字节预算 / 端点不接受分块上传：改为预先编码后立即重发
+                    if settle_payload(payload):
+                        _log(f"Streaming upload failed ({e}), resending pre-encoded body")
+                        if attempt < max_retries - 1:
+                            continue
+                rotated = keys.report(api_key, e) and keys.available()
+                if rotated:
+                    max_retries = min(max_retries + 1, 1 + len(keys))
+                if isinstance(e, (DeadlineExceeded, Interrupted)):
+                    _log_error(f"{e}, giving up")
+                    raise
+                if "HTTP 413" in str(e):
+                    # 同一载荷重发必然再次失败
+                    _log_error(f"Payload too large: {e}")
+                    raise Exception(f"Request body too large for endpoint (HTTP 413), lower max_payload_mb: {e}")
                 if attempt == max_retries - 1:
                     _log_error(f"Image error (final): {e}")
                     raise Exception(f"Image generation failed after {max_retries} attempts: {e}")
                 else:
                     _log(f"Retry {attempt + 1}/{max_retries} due to: {e}")
                     _log_debug(f"Error details: {str(e)[:200]}")
+                    if not rotated:
+                        deadline.sleep(RETRY_BACKOFF * (attempt + 1))
+
+        return self._result(res, n, filename_prefix)
+
+
+class ORImageGenerateFiles(ORImageGenerate):
+    """OpenRouter 图片生成节点（文件输出）：原始图像字节直接写入输出目录，不解码为张量"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        types = super().INPUT_TYPES()
+        # 与 SaveImage 相同：<prefix>_<counter>_.<ext>，可含子目录
+        types["optional"]["filename_prefix"] = ("STRING", {"default": "OpenRouter", "multiline": False})
+        return types
+
+    RETURN_TYPES = ("LLM_IMAGE_FILES", "STRING")
+    RETURN_NAMES = ("files", "paths")
+    OUTPUT_NODE = True
+
+    def _result(self, res: dict, n: int, filename_prefix: str = ""):
+        files = save_response_images(res, filename_prefix, n)
+        _log_step("SUCCESS", f"Saved {len(files)} image(s)")
+        return {"ui": {"images": files.ui()}, "result": (files, "\n".join(files.paths))}
+
+    def run(self, config, prompt, n, image_1=None, image_2=None, image_3=None, image_4=None, image_5=None, additional_text="",
+            filename_prefix="OpenRouter"):
+        # 请求前先校验输出路径
+        output_dir(filename_prefix)
+        return super().run(config, prompt, n, image_1, image_2, image_3, image_4, image_5, additional_text,
+                           filename_prefix)
 
 
 # ============ 配置节点 ============
@@ -523,6 +650,20 @@ class ORBaseConfig:
                 "api_base": ("STRING", {"default": "https://openrouter.ai/api/v1"}),
                 "site_url": ("STRING", {"default": "", "multiline": False}),
                 "site_name": ("STRING", {"default": "", "multiline": False}),
+                # 参考图像上传方式：inline 内联 / files_api 上传到 /files / url 上传到 upload_url
+                "reference_upload": (UPLOAD_MODES, ),
+                "upload_url": ("STRING", {"default": "", "multiline": False}),
+                # 用量统计分组标签
+                "workflow_tag": ("STRING", {"default": "", "multiline": False}),
+                # 用缓存的 /models 目录预检模型
+                "validate_model": ("BOOLEAN", {"default": False}),
+                # 多 key 轮换：api_key 可填多个（逗号 / 换行分隔），另可从环境变量或 key 文件读取
+                "api_key_env": ("STRING", {"default": "", "multiline": False}),
+                "api_key_file": ("STRING", {"default": "", "multiline": False}),
+                # 配置节点执行时就在后台建立到 api_base 的连接，省去首次请求的 DNS / TCP / TLS 开销
+                "prewarm": ("BOOLEAN", {"default": False}),
+                # 分块上传请求体：inline 参考图像边编码边发送（端点 / 代理需支持 chunked 请求体）
+                "stream_upload": ("BOOLEAN", {"default": False}),
             }
         }
 
@@ -531,13 +672,24 @@ class ORBaseConfig:
     FUNCTION = "run"
     CATEGORY = "Gemini-OpenRouter/Config"
 
-    def run(self, api_key, model, api_base="https://openrouter.ai/api/v1", site_url="", site_name=""):
+    def run(self, api_key, model, api_base="https://openrouter.ai/api/v1", site_url="", site_name="",
+            reference_upload="inline", upload_url="", workflow_tag="",
+            validate_model=False, api_key_env="", api_key_file="", prewarm=False, stream_upload=False):
+        keys = resolve_keys(api_key, api_key_env, api_key_file)
+        if prewarm:
+            prewarm_connections(api_base)
         return ({
             "api_base": _normalize_url(api_base),
-            "api_key": api_key,
+            "api_key": keys[0] if keys else "",
+            "api_keys": keys,
             "model": model,
             "site_url": site_url,
             "site_name": site_name,
+            "reference_upload": reference_upload,
+            "upload_url": upload_url,
+            "workflow_tag": workflow_tag,
+            "validate_model": validate_model,
+            "stream_upload": stream_upload,
         },)
 
 
@@ -551,6 +703,30 @@ class ORChatParams:
                 "base_config": ("OR_BASE_CONFIG",),
                 "temperature": ("FLOAT", {"default": 0.7, "min": 0, "max": 2, "step": 0.1}),
                 "max_tokens": ("INT", {"default": 2000, "min": 1, "max": 128000}),
+            },
+            "optional": {
+                # 请求体预算（0 = 不限制），超出时自动降采样/重压缩参考图像
+                "max_payload_mb": ("FLOAT", {"default": 20.0, "min": 0, "max": 500, "step": 0.5}),
+                "max_image_tokens": ("INT", {"default": 0, "min": 0, "max": 1000000}),
+                # 节点总截止时间（0 = 默认：聊天 180s，图片按尺寸 300/480/900s）与分离超时
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 7200}),
+                "connect_timeout": ("FLOAT", {"default": 10.0, "min": 1, "max": 120, "step": 1}),
+                "first_byte_timeout": ("FLOAT", {"default": 0.0, "min": 0, "max": 7200, "step": 1}),
+                "idle_timeout": ("FLOAT", {"default": 60.0, "min": 1, "max": 600, "step": 1}),
+                # 图像批次（视频帧）采样与去重
+                "frame_sampling": (FRAME_SAMPLING_MODES, ),
+                "max_frames": ("INT", {"default": 0, "min": 0, "max": 1000}),
+                "frame_stride": ("INT", {"default": 1, "min": 1, "max": 1000}),
+                "dedup_distance": ("INT", {"default": 0, "min": 0, "max": 32}),
+                # 语义缓存（仅纯文本请求）：相似度 ≥ 阈值且模型 / 参数 / system 相同时直接返回缓存回答
+                "semantic_cache": ("BOOLEAN", {"default": False}),
+                "semantic_threshold": ("FLOAT", {"default": DEFAULT_THRESHOLD, "min": 0.5, "max": 1.0, "step": 0.01}),
+                # 端点 /embeddings 的向量模型（按阈值复用近似提示词）；为空时只复用规范化后完全相同的提示词
+                "embedding_model": ("STRING", {"default": "", "multiline": False}),
+                # 结构化输出：json_object / json_schema（JSON Schema 文本），stream_json 时流式增量解析
+                "response_format": (RESPONSE_FORMATS, ),
+                "json_schema": ("STRING", {"default": "", "multiline": True}),
+                "stream_json": ("BOOLEAN", {"default": True}),
             }
         }
 
@@ -559,11 +735,31 @@ class ORChatParams:
     FUNCTION = "run"
     CATEGORY = "Gemini-OpenRouter/Config"
 
-    def run(self, base_config, temperature, max_tokens):
+    def run(self, base_config, temperature, max_tokens, max_payload_mb=20.0, max_image_tokens=0,
+            frame_sampling="all", max_frames=0, frame_stride=1, dedup_distance=0,
+            deadline=0, connect_timeout=10.0, first_byte_timeout=0.0, idle_timeout=60.0,
+            semantic_cache=False, semantic_threshold=DEFAULT_THRESHOLD, embedding_model="",
+            response_format="text", json_schema="", stream_json=True):
         return ({
             **base_config,
             "temperature": temperature,
             "max_tokens": max_tokens,
+            "max_payload_mb": max_payload_mb,
+            "max_image_tokens": max_image_tokens,
+            "deadline": deadline,
+            "connect_timeout": connect_timeout,
+            "first_byte_timeout": first_byte_timeout,
+            "idle_timeout": idle_timeout,
+            "frame_sampling": frame_sampling,
+            "max_frames": max_frames,
+            "frame_stride": frame_stride,
+            "dedup_distance": dedup_distance,
+            "semantic_cache": semantic_cache,
+            "semantic_threshold": semantic_threshold,
+            "embedding_model": embedding_model,
+            "response_format": response_format,
+            "json_schema": json_schema,
+            "stream_json": stream_json,
         },)
 
 
@@ -578,6 +774,16 @@ class ORImageParams:
                 "aspect_ratio": (["1:1", "16:9", "4:3", "9:16", "3:4", "2:3", "3:2", "4:5", "5:4", "21:9"], ),
                 "image_size": (["1K", "2K", "4K"], ),
                 "temperature": ("FLOAT", {"default": 1.0, "min": 0, "max": 1, "step": 0.05}),
+            },
+            "optional": {
+                # 请求体预算（0 = 不限制），超出时自动降采样/重压缩参考图像
+                "max_payload_mb": ("FLOAT", {"default": 20.0, "min": 0, "max": 500, "step": 0.5}),
+                "max_image_tokens": ("INT", {"default": 0, "min": 0, "max": 1000000}),
+                # 节点总截止时间（0 = 默认：聊天 180s，图片按尺寸 300/480/900s）与分离超时
+                "deadline": ("INT", {"default": 0, "min": 0, "max": 7200}),
+                "connect_timeout": ("FLOAT", {"default": 10.0, "min": 1, "max": 120, "step": 1}),
+                "first_byte_timeout": ("FLOAT", {"default": 0.0, "min": 0, "max": 7200, "step": 1}),
+                "idle_timeout": ("FLOAT", {"default": 60.0, "min": 1, "max": 600, "step": 1}),
             }
         }
 
@@ -586,12 +792,19 @@ class ORImageParams:
     FUNCTION = "run"
     CATEGORY = "Gemini-OpenRouter/Config"
 
-    def run(self, base_config, aspect_ratio, image_size, temperature):
+    def run(self, base_config, aspect_ratio, image_size, temperature, max_payload_mb=20.0, max_image_tokens=0,
+            deadline=0, connect_timeout=10.0, first_byte_timeout=0.0, idle_timeout=60.0):
         return ({
             **base_config,
             "aspect_ratio": aspect_ratio,
             "image_size": image_size,
             "temperature": temperature,
+            "max_payload_mb": max_payload_mb,
+            "max_image_tokens": max_image_tokens,
+            "deadline": deadline,
+            "connect_timeout": connect_timeout,
+            "first_byte_timeout": first_byte_timeout,
+            "idle_timeout": idle_timeout,
         },)
 
 
@@ -599,6 +812,7 @@ NODE_CLASS_MAPPINGS = {
     # 执行节点
     "ORChatGenerate": ORChatGenerate,
     "ORImageGenerate": ORImageGenerate,
+    "ORImageGenerateFiles": ORImageGenerateFiles,
 
     # 配置节点
     "ORBaseConfig": ORBaseConfig,
@@ -610,6 +824,7 @@ NODE_DISPLAY_NAME_MAPPINGS = {
     # 执行节点
     "ORChatGenerate": "Chat (OpenRouter)",
     "ORImageGenerate": "Image (OpenRouter)",
+    "ORImageGenerateFiles": "Image Files (OpenRouter)",
 
     # 配置节点
     "ORBaseConfig": "Base Config (OpenRouter)",
@@ -0,0 +1,161 @@
+"""
+ComfyUI Gemini Tool Nodes
+辅助节点（不直接调用模型）
+
+Architecture:
+- Stats Nodes: LLMUsageStats
+- File Nodes: LLMLoadImageFiles（文件输出节点的结果按需加载为 IMAGE）
+- JSON Nodes: LLMJsonFields（结构化输出的字段拆分为独立输出）
+"""
+
+import json
+
+try:
+    from .llm_usage import get_store, format_report, GROUP_KEYS
+    from .llm_keys import pool_report
+    from .llm_semantic import semantic_report
+    from .llm_output import ImageFiles
+    from .llm_structured import parse_structured, json_field
+except ImportError:
+    from llm_usage import get_store, format_report, GROUP_KEYS
+    from llm_keys import pool_report
+    from llm_semantic import semantic_report
+    from llm_output import ImageFiles
+    from llm_structured import parse_structured, json_field
+
+
+class LLMUsageStats:
+    """用量 / 成本 / 延迟统计（LiteLLM + OpenRouter 全部调用，含多 key 池与语义缓存状态）"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "group_by": (["model", "endpoint", "workflow", "model+endpoint", "model+workflow", "all"], ),
+                # session: 本进程；history: 汇总本地 JSONL 中的全部历史记录
+                "scope": (["session", "history"], ),
+            },
+            "optional": {
+                "reset_session": ("BOOLEAN", {"default": False}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("report",)
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Tools"
+    OUTPUT_NODE = True
+
+    @classmethod
+    def IS_CHANGED(cls, **kwargs):
+        # 统计随时变化，每次都重新执行
+        return float("nan")
+
+    def run(self, group_by, scope, reset_session=False):
+        store = get_store()
+        totals = store.history_totals() if scope == "history" else store.totals()
+        dims = GROUP_KEYS if group_by == "all" else group_by.split("+")
+        report = format_report(totals, dims)
+        # 多 key 轮换池的每个 key 统计（已脱敏）
+        keys = pool_report()
+        if keys:
+            report += "\n" + keys
+        # 语义缓存命中率 / 条目数 / 淘汰数
+        semantic = semantic_report()
+        if semantic:
+            report += "\n" + semantic
+        if reset_session:
+            store.reset()
+        return {"ui": {"text": [report]}, "result": (report,)}
+
+
+class LLMLoadImageFiles:
+    """加载文件输出节点的图像为 IMAGE 张量（只在确实需要像素时使用）"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "files": ("LLM_IMAGE_FILES",),
+            },
+            "optional": {
+                # -1 加载全部（尺寸需一致），否则只加载该序号的一张
+                "index": ("INT", {"default": -1, "min": -1, "max": 4096}),
+            }
+        }
+
+    RETURN_TYPES = ("IMAGE",)
+    RETURN_NAMES = ("images",)
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Tools"
+
+    def run(self, files: ImageFiles, index=-1):
+        if not len(files):
+            raise Exception("No image files to load")
+        return (files.load(index),)
+
+
+# JSON 字段输出数
+_JSON_FIELDS = 8
+
+
+class LLMJsonFields:
+    """把 JSON 文本（如结构化输出的 Chat 结果）中的字段拆分为独立的 STRING 输出"""
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "json_text": ("STRING", {"forceInput": True}),
+                # 逗号分隔的字段路径，按顺序对应 field_1..field_8（支持 meta.tags.0 形式的嵌套路径）
+                "fields": ("STRING", {"default": "", "multiline": False}),
+            },
+            "optional": {
+                # 字段不存在时报错（默认输出空字符串）
+                "strict": ("BOOLEAN", {"default": False}),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",) * _JSON_FIELDS
+    RETURN_NAMES = tuple(f"field_{i + 1}" for i in range(_JSON_FIELDS))
+    FUNCTION = "run"
+    CATEGORY = "Gemini-Tools"
+
+    def run(self, json_text, fields, strict=False):
+        # 容忍代码围栏 / 前后说明文字
+        value, _ = parse_structured(json_text)
+        paths = [p.strip() for p in fields.split(",") if p.strip()]
+        if len(paths) > _JSON_FIELDS:
+            raise Exception(f"At most {_JSON_FIELDS} fields, got {len(paths)}")
+        outputs = []
+        for path in paths:
+            item = json_field(value, path)
+            if item is None and strict:
+                raise Exception(f"Field not found: {path}")
+            # 字符串原样输出，其余值输出为 JSON
+            outputs.append("" if item is None else item if isinstance(item, str) else json.dumps(item, ensure_ascii=False))
+        outputs += [""] * (_JSON_FIELDS - len(outputs))
+        return tuple(outputs)
+
+
+NODE_CLASS_MAPPINGS = {
+    # 统计节点
+    "LLMUsageStats": LLMUsageStats,
+
+    # 文件节点
+    "LLMLoadImageFiles": LLMLoadImageFiles,
+
+    # JSON 节点
+    "LLMJsonFields": LLMJsonFields,
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    # 统计节点
+    "LLMUsageStats": "Usage Stats",
+
+    # 文件节点
+    "LLMLoadImageFiles": "Load Image Files",
+
+    # JSON 节点
+    "LLMJsonFields": "JSON Fields",
+}